@@ -1,10 +1,24 @@
 # Python file to run `rocm-amdgpu-bench` command for GPU health checks.
 # and parses the output into a json
 
+import argparse
+import json
+import os
 import subprocess
 import socket
+import uuid
 
-from locodb.directorydb import *
+from locodb.codec import codec_choices, parse_codec
+from locodb.engines import open_database, writable_engines
+from locodb.profiling import Tracer, active_tracer
+from locodb.spool import Spool
+from locodb.utility import get_timestamp
+from degradation import update_collection
+from export_prometheus import render_metrics, write_textfile
+from scoring import population_summary, score_gpu
+
+# Marks the summary line in the output of `--summary`
+summary_prefix = "HEALTHCHECK-SUMMARY "
 
 
 def get_guid_dict():
@@ -50,24 +64,11 @@ def get_guid():
     raise ValueError("No GPU found or rocm-smi command failed.")
 
 
-def benchmark_node():
+def parse_roofline_output(output):
     """
-    Run the `rocm-amdgpu-bench` command and parse its output.
-    Returns a dictionary with GPU health status.
+    Parse the output of `rocm-amdgpu-bench`.
+    Returns a list with a dictionary of metrics per GPU.
     """
-
-    path_to_bin = "rocm-amdgpu-bench/build/roofline"
-    node_name = socket.gethostname()
-
-    # Run the command
-    print("Running rocm-amdgpu-bench...")
-    # If temp.log is present, just read from that
-    result = subprocess.run(
-        [f"./{path_to_bin}"], capture_output=True, text=True, check=True
-    )
-    output = result.stdout
-    print("Finished running rocm-amdgpu-bench.")
-
     # Convert into list of lines
     # Remove blank lines
     # Remove all lines that contain "%""
@@ -156,154 +157,271 @@ def benchmark_node():
             continue
     # Append the last GPU data
     all_gpu_data.append(gpu_data)
+    return all_gpu_data
 
-    # file structure:
-    # cluster/
-    #   <hostname 1>/
-    #       cpu/ <- implement later
-    #       gpu-<GUID 1>/
-    #           1.json
-    #           2.json
-    #           ...
-    #       gpu-<GUID 2>/
-    #           1.json
-    #           2.json
-    #           ...
-    #       ...
-    #   <hostname 2>/
-    #       ...
-    #   ...
-
-    # Write results to database
-    client = LocoDatabase("cluster")
-    # Later, iterate over nodes
-    # for node in nodes:
-    #     database = client[node]
-    # For now, single node
-    database = client[node_name]
-
-    guid_dict = get_guid_dict()
-
-    for gpu_data in all_gpu_data:
-        collection = database[f"gpu-{guid_dict[gpu_data['GPU Device']]}"]
-
-        metrics_list = [
-            "HBM BW",
-            "MALL BW",
-            "L2 BW",
-            "L1 BW",
-            "LDS BW",
-            "Peak FLOPs (FP8)",
-            "Peak FLOPs (FP16)",
-            "Peak FLOPs (BF16)",
-            "Peak FLOPs (FP32)",
-            "Peak FLOPs (FP64)",
-            "Peak IOPs (INT8)",
-            "Peak IOPs (INT32)",
-            "Peak IOPs (INT64)",
-            "Peak MFMA FLOPs (F4)",
-            "Peak MFMA FLOPs (F6)",
-            "Peak MFMA FLOPs (F8)",
-            "Peak MFMA FLOPs (F16)",
-            "Peak MFMA FLOPs (BF16)",
-            "Peak MFMA FLOPs (F32)",
-            "Peak MFMA FLOPs (F64)",
-            "Peak MFMA IOPs (I8)",
-        ]
-
-        gpu_stats = {
-            "mean_deviation": {},
-            "stdev": {},
-            "z_score": {},
-        }
-
-        gpu_health = {
-            "Outlier": False,
-            "Outlier Metrics": [],
-            "Unhealthy": False,
-            "Unhealthy Metrics": [],
-            "Message": "",
-        }
-
-        population_benchmarks = collection.find()
-        population = len(population_benchmarks)
-        for metric in metrics_list:
-            if population != 0:
-                population_mean = (
-                    sum(
-                        [
-                            benchmark["metrics"][metric]["mean"]
-                            for benchmark in population_benchmarks
-                        ]
-                    )
-                    / population
-                )
-                population_stdev = (
-                    sum(
-                        [
-                            (benchmark["metrics"][metric]["mean"] - population_mean)
-                            ** 2
-                            for benchmark in population_benchmarks
-                        ]
-                    )
-                    / population
-                ) ** 0.5
-                population_z_score = (
-                    (gpu_data[metric]["mean"] - population_mean) / population_stdev
-                    if population_stdev != 0
-                    else 0
-                )
-            else:
-                population_mean = 0
-                population_stdev = 0
-                population_z_score = 0
 
-            gpu_stats["mean_deviation"][metric] = (
-                gpu_data[metric]["mean"] - population_mean
+def benchmark_node(
+    db_path="cluster",
+    engine="directory",
+    trace_path=None,
+    textfile_dir=None,
+    spool_dir=None,
+    codec=None,
+    hostname=None,
+):
+    """
+    Run the `rocm-amdgpu-bench` command and parse its output.
+    Returns the documents stored for every GPU, with their health status.
+    """
+
+    path_to_bin = "rocm-amdgpu-bench/build/roofline"
+    # The database of the node (e.g. a name given by the orchestrator)
+    node_name = hostname or socket.gethostname()
+
+    # Time each phase of the health check
+    # (locodb operations record their own spans and counters)
+    tracer = Tracer()
+    with active_tracer(tracer):
+        # Run the command
+        print("Running rocm-amdgpu-bench...")
+        # If temp.log is present, just read from that
+        with tracer.span("roofline"):
+            result = subprocess.run(
+                [f"./{path_to_bin}"], capture_output=True, text=True, check=True
             )
-            gpu_stats["stdev"][metric] = population_stdev
-            gpu_stats["z_score"][metric] = population_z_score
-
-            if abs(gpu_data[metric]["mean"] - population_mean) > 3 * population_stdev:
-                # Mark as outlier if check lands past 3 sigma
-                # Note: This does not necessarily mean the GPU is unhealthy
-                # (should correlate to 0.3% of all health checks)
-                if population > 30:
-                    gpu_health["Outlier"] = True
-                    gpu_health["Outlier Metrics"].append(metric)
-                    # Mark as unhealthy if the metric is >= 5 sigma
-                    # (should correlate to 0.00006% of health checks)
-                    if (
-                        abs(gpu_data[metric]["mean"] - population_mean)
-                        > 5 * population_stdev
-                    ):
-                        gpu_health["Unhealthy"] = True
-                        gpu_health["Unhealthy Metrics"].append(metric)
-                        gpu_health["Message"] = (
-                            "Health metric exceeds 5 sigma threshold. Likely unhealthy GPU."
-                        )
+        output = result.stdout
+        print("Finished running rocm-amdgpu-bench.")
+
+        with tracer.span("parse"):
+            all_gpu_data = parse_roofline_output(output)
+            tracer.count("roofline_output_bytes", len(output))
+
+        # file structure:
+        # cluster/
+        #   <hostname 1>/
+        #       cpu/ <- implement later
+        #       gpu-<GUID 1>/
+        #           1.json
+        #           2.json
+        #           ...
+        #       gpu-<GUID 2>/
+        #           1.json
+        #           2.json
+        #           ...
+        #       ...
+        #   <hostname 2>/
+        #       ...
+        #   ...
+
+        # Write results to database
+        client = open_database(db_path, engine, codec)
+        # Later, iterate over nodes
+        # for node in nodes:
+        #     database = client[node]
+        # For now, single node
+        database = client[node_name]
+
+        with tracer.span("rocm-smi"):
+            guid_dict = get_guid_dict()
+
+        # `stats` and `health` of every GPU, each scored against its own history
+        scores = {}
+        for gpu_data in all_gpu_data:
+            collection = database[f"gpu-{guid_dict[gpu_data['GPU Device']]}"]
+
+            with tracer.span("load_history", GPU=gpu_data["GPU Device"]):
+                population_benchmarks = collection.find()
+            with tracer.span("statistics", GPU=gpu_data["GPU Device"]):
+                population, summary = population_summary(population_benchmarks)
+                scores[gpu_data["GPU Device"]] = score_gpu(
+                    gpu_data, population, summary
+                )
+
+        # Identifies the documents of this run, so ingesting a spool twice
+        # does not store them twice
+        run_id = uuid.uuid4().hex
+        # With a spool, results are written to a file of this job and merged
+        # into the database later by `ingest.py`
+        spool = None
+        if spool_dir is not None:
+            job_id = os.environ.get("SLURM_JOB_ID", str(os.getpid()))
+            spool = Spool(spool_dir, f"{node_name}-{job_id}-{run_id}")
+
+        results = []
+        for gpu_data in all_gpu_data:
+            collection_name = f"gpu-{guid_dict[gpu_data['GPU Device']]}"
+            collection = database[collection_name]
+            gpu_stats, gpu_health = scores[gpu_data["GPU Device"]]
+            timestamp = get_timestamp()
+            # Update the CUSUM/EWMA state of this GPU with the new run; spooled
+            # runs are added to it when they are ingested
+            degradation = {}
+            if spool is None:
+                with tracer.span("degradation", GPU=gpu_data["GPU Device"]):
+                    degradation = update_collection(collection, gpu_data, timestamp)
+            metrics = {
+                "metrics": gpu_data,
+                "stats": gpu_stats,
+                "health": {**gpu_health, **degradation},
+            }
+            # add other metadata
+            metrics["meta"] = {
+                "hostname": node_name,
+                "GUID": guid_dict[gpu_data["GPU Device"]],
+                "run_id": run_id,
+                "timestamp": timestamp,
+                # phases timed so far (writing this document is not included)
+                "timings": tracer.summary(),
+            }
+            with tracer.span("write", GPU=gpu_data["GPU Device"]):
+                if spool is not None:
+                    spool.insert_one(node_name, collection_name, metrics)
                 else:
-                    gpu_health["Message"] = (
-                        f"Population size ({population}) is too small to determine outliers."
-                    )
-
-    for gpu_data in all_gpu_data:
-        collection = database[f"gpu-{guid_dict[gpu_data['GPU Device']]}"]
-        metrics = {
-            "metrics": gpu_data,
-            "stats": gpu_stats,
-            "health": gpu_health,
-        }
-        # add other metadata
-        metrics["meta"] = {
-            "hostname": node_name,
-            "GUID": guid_dict[gpu_data["GPU Device"]],
-        }
-        collection.insert_one(metrics)
+                    collection.insert_one(metrics)
+            results.append(metrics)
+
+        if spool is not None:
+            spool.close()
+
+        if textfile_dir is not None:
+            with tracer.span("export"):
+                write_textfile(
+                    os.path.join(textfile_dir, "gpu_health.prom"),
+                    render_metrics(results),
+                )
+
+    if trace_path is not None:
+        tracer.write_chrome_trace(trace_path)
+        print(f"Wrote trace to {trace_path}.")
+    return results
+
+
+def result_summary(results):
+    """
+    One-line summary of the results of a node, printed after `summary_prefix`
+    for `orchestrate.py` to collect.
+    """
+    gpus = []
+    for doc in results:
+        health = doc["health"]
+        gpus.append(
+            {
+                "device": doc["metrics"]["GPU Device"],
+                "GUID": doc["meta"]["GUID"],
+                "Outlier Metrics": health["Outlier Metrics"],
+                "Unhealthy": health["Unhealthy"],
+                "Unhealthy Metrics": health["Unhealthy Metrics"],
+                "Degrading": health.get("Degrading", False),
+                "Degrading Metrics": health.get("Degrading Metrics", []),
+            }
+        )
+    return {
+        "hostname": results[0]["meta"]["hostname"] if results else None,
+        "run_id": results[0]["meta"]["run_id"] if results else None,
+        "gpus": gpus,
+    }
+
+
+def load_fixture(paths, hostname=None):
+    """
+    Stored results (JSON files, e.g. of example-cluster/) standing in for the
+    results of a run, for `--fixture`: no GPU is needed and nothing is stored.
+    """
+    run_id = uuid.uuid4().hex
+    results = []
+    for path in paths:
+        with open(path) as f:
+            doc = json.load(f)
+        doc["meta"].update(
+            hostname=hostname or socket.gethostname(),
+            run_id=run_id,
+            timestamp=get_timestamp(),
+        )
+        results.append(doc)
+    return results
 
 
 def main():
-    benchmark_node()
+    parser = argparse.ArgumentParser(
+        description="Run `rocm-amdgpu-bench` and record the results of every GPU."
+    )
+    parser.add_argument(
+        "--db",
+        type=str,
+        default="cluster",
+        help="Path of the cluster database.",
+    )
+    parser.add_argument(
+        "--engine",
+        type=str,
+        default="directory",
+        choices=writable_engines,
+        help="Storage engine of the cluster database.",
+    )
+    parser.add_argument(
+        "--spool-dir",
+        type=str,
+        default=None,
+        help="Write results to a spool file in this directory instead of the database.",
+    )
+    parser.add_argument(
+        "--trace",
+        type=str,
+        default=None,
+        help="Write a Chrome trace (JSON) of the phases of the health check.",
+    )
+    parser.add_argument(
+        "--textfile-dir",
+        type=str,
+        default=None,
+        help="node_exporter textfile collector directory to write gpu_health.prom to.",
+    )
+    parser.add_argument(
+        "--codec",
+        type=str,
+        default="json",
+        choices=codec_choices,
+        help="Encoding of the stored results (see locodb/codec.py).",
+    )
+    parser.add_argument(
+        "--omit-stats",
+        action="store_true",
+        help="Do not store the `stats` block: no z-scores are exported for the results.",
+    )
+    parser.add_argument(
+        "--hostname",
+        type=str,
+        default=None,
+        help="Database to store the results in (the hostname by default).",
+    )
+    parser.add_argument(
+        "--summary",
+        action="store_true",
+        help="Print a JSON summary of the results (read by orchestrate.py).",
+    )
+    parser.add_argument(
+        "--fixture",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Report these stored results (JSON files) instead of running the "
+        "benchmark, without storing anything (to test orchestrate.py).",
+    )
+    args = parser.parse_args()
+    if args.fixture:
+        results = load_fixture(args.fixture, args.hostname)
+    else:
+        results = benchmark_node(
+            db_path=args.db,
+            engine=args.engine,
+            trace_path=args.trace,
+            textfile_dir=args.textfile_dir,
+            spool_dir=args.spool_dir,
+            codec=parse_codec(args.codec, ["stats"] if args.omit_stats else []),
+            hostname=args.hostname,
+        )
+    if args.summary:
+        print(summary_prefix + json.dumps(result_summary(results)), flush=True)
 
 
 if __name__ == "__main__":
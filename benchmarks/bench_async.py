@@ -0,0 +1,156 @@
+# Latency of many concurrent readers with AsyncLocoDatabase, compared with
+# calling the blocking API from the event loop.
+#
+# Requests arrive at a fixed rate (open loop) and latency is measured from
+# arrival, so time spent waiting for a blocked event loop is included.
+#
+#   python benchmarks/bench_async.py --db synthetic-cluster --readers 64
+
+import argparse
+import asyncio
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from locodb.asyncdb import AsyncLocoDatabase  # noqa: E402
+from locodb.engines import engines, open_database  # noqa: E402
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    pick = lambda q: latencies[min(int(q * len(latencies)), len(latencies) - 1)]
+    return f"p50 {pick(0.5) * 1e3:8.2f} ms  p95 {pick(0.95) * 1e3:8.2f} ms  p99 {pick(0.99) * 1e3:8.2f} ms"
+
+
+def targets(client, count, seed):
+    """Random (hostname, collection) pairs to read."""
+    pairs = [
+        (hostname, name)
+        for hostname in client.list_databases()
+        for name in client[hostname].list_collections()
+    ]
+    rng = random.Random(seed)
+    return [rng.choice(pairs) for _ in range(count)]
+
+
+async def readers(work, rate, read):
+    """
+    Issue the requests of `work` (one list per reader) at `rate` requests per
+    second in total, and return the latency of each from its arrival time.
+    """
+    latencies = []
+    start = time.perf_counter()
+
+    async def reader(index, requests):
+        for number, (hostname, name) in enumerate(requests):
+            arrival = start + (number * len(work) + index) / rate
+            await asyncio.sleep(max(arrival - time.perf_counter(), 0))
+            await read(hostname, name)
+            latencies.append(time.perf_counter() - arrival)
+
+    await asyncio.gather(*(reader(i, requests) for i, requests in enumerate(work)))
+    return latencies
+
+
+async def blocking_readers(client, work, rate):
+    async def read(hostname, name):
+        client[hostname][name].find_latest()
+
+    return await readers(work, rate, read)
+
+
+async def async_readers(client, work, rate):
+    async def read(hostname, name):
+        await client[hostname][name].find_latest()
+
+    return await readers(work, rate, read)
+
+
+def emulate_slow_storage(collection_class, delay):
+    """Add `delay` seconds of (GIL-free) wait to every find_latest, like a slow NFS read."""
+    find_latest = collection_class.find_latest
+
+    def slow_find_latest(self):
+        time.sleep(delay)
+        return find_latest(self)
+
+    collection_class.find_latest = slow_find_latest
+
+
+def run(label, coroutine):
+    start = time.perf_counter()
+    latencies = asyncio.run(coroutine)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {percentiles(latencies)}  total {elapsed:6.2f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db", type=str, default=None, help="Generate one if omitted.")
+    parser.add_argument("--engine", type=str, default="directory", choices=list(engines))
+    parser.add_argument("--readers", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=20, help="Requests per reader.")
+    parser.add_argument(
+        "--rate", type=float, default=2000, help="Requests per second (all readers)."
+    )
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument(
+        "--read-delay",
+        type=float,
+        default=0.0,
+        help="Seconds added to every read to emulate slow shared storage.",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = args.db
+        if db_path is None:
+            repo = Path(__file__).resolve().parent.parent
+            db_path = str(Path(tmp) / "cluster")
+            subprocess.run(
+                [
+                    sys.executable,
+                    str(repo / "generate_cluster.py"),
+                    "--templates",
+                    str(repo / "example-cluster"),
+                    "-o",
+                    db_path,
+                    "--layout",
+                    args.engine,
+                    "--nodes",
+                    "8",
+                    "--gpus-per-node",
+                    "8",
+                    "--runs",
+                    "200",
+                ],
+                check=True,
+                stdout=subprocess.DEVNULL,
+            )
+
+        client = open_database(db_path, args.engine)
+        requests = targets(client, args.readers * args.requests, seed=0)
+        if args.read_delay:
+            hostname, name = requests[0]
+            emulate_slow_storage(type(client[hostname][name]), args.read_delay)
+        work = [
+            requests[i * args.requests : (i + 1) * args.requests]
+            for i in range(args.readers)
+        ]
+        run("blocking (in event loop)", blocking_readers(client, work, args.rate))
+        for workers in args.workers:
+
+            async def bench():
+                async with AsyncLocoDatabase(db_path, args.engine, workers) as db:
+                    return await async_readers(db, work, args.rate)
+
+            run(f"async ({workers} workers)", bench())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# Bytes on disk and encode/parse time per document for every codec,
+# compared with the indented JSON written by earlier versions.
+#
+#   python benchmarks/bench_codec.py --db example-cluster
+
+import argparse
+import gc
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from locodb.codec import Codec, codec_choices, decode, parse_codec  # noqa: E402
+from locodb.engines import engines, open_database  # noqa: E402
+
+# Files smaller than a block still use a whole block of the file system
+block_size = 4096
+
+
+def load_documents(db_path, engine, limit):
+    client = open_database(db_path, engine)
+    docs = []
+    for hostname in sorted(client.list_databases()):
+        database = client[hostname]
+        for name in sorted(database.list_collections()):
+            docs += database[name].find()
+            if len(docs) >= limit:
+                return docs[:limit]
+    return docs
+
+
+def per_doc_time(func, items, repeat=5):
+    """Best time per item of `repeat` passes of `func` over `items`."""
+    best = float("inf")
+    # As timeit does, so collections do not land on a random codec
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for item in items:
+                func(item)
+            best = min(best, time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return best / len(items)
+
+
+def bench(label, codec, docs):
+    encoded = [codec.encode(doc) for doc in docs]
+    size = sum(len(data) for data in encoded) / len(docs)
+    blocks = sum(-(-len(data) // block_size) * block_size for data in encoded) / len(docs)
+    encode_time = per_doc_time(codec.encode, docs)
+    parse_time = per_doc_time(decode, encoded)
+    print(
+        f"  {label:<26} {size:9.0f} B {blocks:9.0f} B"
+        f" {encode_time * 1e6:9.1f} us {parse_time * 1e6:9.1f} us"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db", type=str, default="example-cluster")
+    parser.add_argument(
+        "--engine", type=str, default="directory", choices=list(engines)
+    )
+    parser.add_argument("--documents", type=int, default=1000)
+    args = parser.parse_args()
+
+    docs = load_documents(args.db, args.engine, args.documents)
+    print(f"{len(docs)} documents from {args.db}")
+    print(f"  {'codec':<26} {'size':>11} {'on disk':>11} {'encode':>12} {'parse':>12}")
+    bench("json indent=4 (before)", Codec(indent=4), docs)
+    for omit in [[], ["stats"]]:
+        for spec in codec_choices:
+            try:
+                codec = parse_codec(spec, omit)
+            except ImportError as e:
+                print(f"  {spec:<26} skipped: {e}")
+                continue
+            bench(spec + (" -stats" if omit else ""), codec, docs)
+
+
+if __name__ == "__main__":
+    main()
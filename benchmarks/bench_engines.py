@@ -0,0 +1,98 @@
+# Compares the directory and SQLite storage engines on a synthetic cluster.
+#
+#   python benchmarks/bench_engines.py --nodes 4 --gpus-per-node 8 --runs 1000
+
+import argparse
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from locodb.engines import open_database  # noqa: E402
+from locodb.migrate import migrate  # noqa: E402
+
+
+def timed(label, func, repeat=3):
+    """Best wall time of `repeat` calls of `func`."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    print(f"  {label:<28} {best * 1e3:10.2f} ms")
+    return best
+
+
+def bench(client):
+    hostnames = sorted(client.list_databases())
+    database = client[hostnames[0]]
+    collection = database[sorted(database.list_collections())[0]]
+    doc = collection.find_latest()
+
+    timed("list_documents", collection.list_documents)
+    timed("find (whole collection)", collection.find)
+    timed("find_latest", collection.find_latest)
+    timed("find_all (meta match)", lambda: collection.find_all({"meta": doc["meta"]}))
+    timed(
+        "find_latest (every GPU)",
+        lambda: [
+            client[hostname][name].find_latest()
+            for hostname in hostnames
+            for name in client[hostname].list_collections()
+        ],
+    )
+    timed(
+        "insert_one",
+        lambda: collection.insert_one(
+            {"metrics": doc["metrics"], "stats": doc["stats"], "health": doc["health"]}
+        ),
+        repeat=20,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--nodes", type=int, default=4)
+    parser.add_argument("--gpus-per-node", type=int, default=8)
+    parser.add_argument("--runs", type=int, default=1000)
+    args = parser.parse_args()
+
+    repo = Path(__file__).resolve().parent.parent
+    with tempfile.TemporaryDirectory() as tmp:
+        directory_path = Path(tmp) / "cluster"
+        sqlite_path = Path(tmp) / "cluster.sqlite"
+        subprocess.run(
+            [
+                sys.executable,
+                str(repo / "generate_cluster.py"),
+                "--templates",
+                str(repo / "example-cluster"),
+                "-o",
+                str(directory_path),
+                "--nodes",
+                str(args.nodes),
+                "--gpus-per-node",
+                str(args.gpus_per_node),
+                "--runs",
+                str(args.runs),
+            ],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        start = time.perf_counter()
+        copied = migrate(
+            open_database(directory_path, "directory"),
+            open_database(sqlite_path, "sqlite"),
+        )
+        print(f"Migrated {copied} documents in {time.perf_counter() - start:.2f} s")
+
+        for engine, path in [("directory", directory_path), ("sqlite", sqlite_path)]:
+            print(f"{engine}:")
+            bench(open_database(path, engine))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# Memory and time to load the results of a cluster as documents and as
+# `BenchmarkRecord`s, and to compute the population summary of each.
+#
+#   python benchmarks/bench_records.py --db synthetic-cluster --collections 64
+
+import argparse
+import gc
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from locodb.engines import engines, open_database  # noqa: E402
+from records import BenchmarkRecord, load_records  # noqa: E402
+from scoring import population_summary  # noqa: E402
+
+
+def gpu_collections(client, limit):
+    collections = []
+    for hostname in sorted(client.list_databases()):
+        database = client[hostname]
+        for name in sorted(database.list_collections()):
+            if name.startswith("gpu-"):
+                collections.append(database[name])
+                if len(collections) == limit:
+                    return collections
+    return collections
+
+
+def measure(label, load):
+    """Wall time and memory held by the result of `load()`."""
+    elapsed = best_time(load)
+    # Traced separately: tracemalloc slows allocations down
+    gc.collect()
+    tracemalloc.start()
+    result = load()
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    count = sum(len(results) for results in result)
+    print(
+        f"  {label:<10} {elapsed:8.2f} s {held / 2**20:10.1f} MiB"
+        f" {peak / 2**20:10.1f} MiB {held / count:10.0f} B"
+    )
+    return result
+
+
+def best_time(func, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db", type=str, default="example-cluster")
+    parser.add_argument(
+        "--engine", type=str, default="directory", choices=list(engines)
+    )
+    parser.add_argument("--collections", type=int, default=16)
+    args = parser.parse_args()
+
+    collections = gpu_collections(open_database(args.db, args.engine), args.collections)
+    print(f"{len(collections)} collections from {args.db}")
+    print(f"  {'loaded as':<10} {'time':>10} {'held':>14} {'peak':>14} {'per result':>12}")
+    docs = measure("documents", lambda: [c.find() for c in collections])
+    records = measure("records", lambda: [load_records(c) for c in collections])
+
+    count = sum(len(results) for results in docs)
+    mismatches = sum(
+        BenchmarkRecord.from_document(doc).to_document() != doc
+        for results in docs
+        for doc in results
+    )
+    print(f"  {count} results, {mismatches} differ after a round trip")
+
+    print("  population_summary of every collection:")
+    for label, results in [("documents", docs), ("records", records)]:
+        elapsed = best_time(lambda: [population_summary(r) for r in results])
+        print(f"  {label:<10} {elapsed * 1e3:8.1f} ms")
+    for d, r in zip(docs, records):
+        assert population_summary(d) == population_summary(r)
+
+
+if __name__ == "__main__":
+    main()
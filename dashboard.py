@@ -0,0 +1,365 @@
+# Web dashboard of the cluster database.
+#
+# The grid shows a tile per GPU, colored by the health of its latest
+# result. Clicking a tile opens the history of the GPU's metrics, served
+# downsampled by `history.py` so only a few hundred points per metric are
+# sent to the browser whatever the length of the history. The same data is
+# available as JSON from
+#   /api/history/<hostname>/<collection>?metric=HBM+BW&start=...&end=...&points=500&method=minmax
+# Requires `dash` (and `plotly`, installed with it).
+#
+#   python dashboard.py --db cluster --port 8050
+
+import argparse
+import time
+
+import dash
+import plotly.graph_objects as go
+from dash import ALL, Input, Output, ctx, dcc, html
+from flask import jsonify, request
+from plotly.subplots import make_subplots
+
+from history import HistoryService, UnknownCollection, format_timestamp
+from locodb.engines import engines, open_database
+from scoring import metrics_list
+
+# Map status to colors
+status_colors = {
+    "Healthy": "#2ecc71",  # Green
+    "Outlier": "#f1c40f",  # Yellow
+    "Degrading": "#e67e22",  # Orange
+    "Unhealthy": "#e74c3c",  # Red
+    "No data": "#7f8c8d",  # Grey
+}
+
+# Time windows of the drill-down, in hours (None for the whole history)
+windows = {
+    "24 h": 24,
+    "7 days": 24 * 7,
+    "30 days": 24 * 30,
+    "90 days": 24 * 90,
+    "All": None,
+}
+
+square_width = 16
+square_corner_radius = 2
+
+
+def gpu_status(doc):
+    if doc is None:
+        return "No data"
+    health = doc.get("health", {})
+    if health.get("Unhealthy"):
+        return "Unhealthy"
+    if health.get("Degrading"):
+        return "Degrading"
+    if health.get("Outlier"):
+        return "Outlier"
+    return "Healthy"
+
+
+def cluster_status(client):
+    """Status of every GPU, grouped by node: {hostname: [(collection, status)]}"""
+    nodes = {}
+    for hostname in sorted(client.list_databases()):
+        database = client[hostname]
+        nodes[hostname] = [
+            (name, gpu_status(database[name].find_latest()))
+            for name in sorted(database.list_collections())
+            if name.startswith("gpu-")
+        ]
+    return nodes
+
+
+def history_figure(result):
+    """One subplot per metric: the min/max band and mean, or the LTTB points."""
+    metrics = list(result["series"])
+    figure = make_subplots(
+        rows=len(metrics), cols=1, shared_xaxes=True, subplot_titles=metrics
+    )
+    for row, metric in enumerate(metrics, start=1):
+        series = result["series"][metric]
+        if result["method"] == "minmax":
+            figure.add_trace(
+                go.Scatter(
+                    x=series["t"],
+                    y=series["max"],
+                    mode="lines",
+                    line_width=0,
+                    showlegend=False,
+                    hoverinfo="skip",
+                ),
+                row=row,
+                col=1,
+            )
+            figure.add_trace(
+                go.Scatter(
+                    x=series["t"],
+                    y=series["min"],
+                    mode="lines",
+                    line_width=0,
+                    fill="tonexty",
+                    fillcolor="rgba(52, 152, 219, 0.3)",
+                    name="min/max",
+                    showlegend=row == 1,
+                ),
+                row=row,
+                col=1,
+            )
+            figure.add_trace(
+                go.Scatter(
+                    x=series["t"],
+                    y=series["mean"],
+                    mode="lines",
+                    line_color="#3498db",
+                    name="mean",
+                    showlegend=row == 1,
+                    customdata=series["count"],
+                    hovertemplate="%{y:.1f} (%{customdata} runs)",
+                ),
+                row=row,
+                col=1,
+            )
+        else:
+            figure.add_trace(
+                go.Scatter(
+                    x=series["t"],
+                    y=series["value"],
+                    mode="lines+markers",
+                    marker_size=3,
+                    line_color="#3498db",
+                    name="runs",
+                    showlegend=row == 1,
+                ),
+                row=row,
+                col=1,
+            )
+    figure.update_layout(
+        height=250 * len(metrics) + 60,
+        template="plotly_dark",
+        margin={"t": 40, "b": 20, "l": 60, "r": 20},
+    )
+    return figure
+
+
+def drilldown(history, selected, metrics, window, method, points):
+    """Title and figure of the history of the selected GPU."""
+    start = None
+    if windows[window] is not None:
+        start = format_timestamp(time.time() - windows[window] * 3600)
+    try:
+        result = history.history(
+            selected["db"], selected["collection"], metrics, start, None, points, method
+        )
+    except UnknownCollection:
+        # Removed since the grid was drawn
+        return f"{selected['db']} {selected['collection']}: no data", go.Figure()
+    title = (
+        f"{selected['db']} {selected['collection']}: {result['total']} runs"
+        f" ({result['method']}, at most {points} points per metric)"
+    )
+    return title, history_figure(result)
+
+
+def create_app(client, history, refresh=60, points=500):
+    app = dash.Dash(__name__, update_title=None)
+    app.title = "GPU Health Dashboard"
+
+    @app.server.route("/api/history/<db_name>/<collection_name>")
+    def history_api(db_name, collection_name):
+        try:
+            result = history.history(
+                db_name,
+                collection_name,
+                request.args.getlist("metric") or None,
+                request.args.get("start"),
+                request.args.get("end"),
+                request.args.get("points", points, type=int),
+                request.args.get("method", "minmax"),
+            )
+        except UnknownCollection as e:
+            return jsonify({"error": str(e)}), 404
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify(result)
+
+    app.layout = html.Div(
+        [
+            html.H1(
+                "GPU Health Monitoring Dashboard",
+                style={"textAlign": "center", "color": "#ecf0f1"},
+            ),
+            # Legend for GPU status
+            html.Div(
+                [
+                    html.Div(
+                        [
+                            html.Div(
+                                style={
+                                    "width": f"{square_width}px",
+                                    "height": f"{square_width}px",
+                                    "backgroundColor": color,
+                                    "borderRadius": f"{square_corner_radius}px",
+                                    "display": "inline-block",
+                                    "marginRight": "10px",
+                                },
+                            ),
+                            html.Span(status, style={"verticalAlign": "top"}),
+                        ],
+                        style={"display": "inline-block", "marginRight": "20px"},
+                    )
+                    for status, color in status_colors.items()
+                ],
+                style={
+                    "textAlign": "center",
+                    "color": "#ecf0f1",
+                    "marginBottom": "20px",
+                },
+            ),
+            # Grid for GPU status
+            html.Div(
+                id="gpu-grid",
+                style={
+                    "display": "flex",
+                    "flexWrap": "wrap",
+                    "justifyContent": "center",
+                },
+            ),
+            dcc.Interval(id="interval", interval=refresh * 1000, n_intervals=0),
+            dcc.Store(id="selected-gpu"),
+            # Drill-down of the selected GPU
+            html.Div(
+                [
+                    html.H2(id="drilldown-title", style={"color": "#ecf0f1"}),
+                    dcc.Dropdown(
+                        id="metrics",
+                        options=metrics_list,
+                        value=["HBM BW"],
+                        multi=True,
+                    ),
+                    dcc.RadioItems(
+                        id="window",
+                        options=list(windows),
+                        value="30 days",
+                        inline=True,
+                        style={"color": "#ecf0f1", "margin": "10px 0"},
+                    ),
+                    dcc.RadioItems(
+                        id="method",
+                        options=[
+                            {"label": "Min/mean/max", "value": "minmax"},
+                            {"label": "LTTB", "value": "lttb"},
+                        ],
+                        value="minmax",
+                        inline=True,
+                        style={"color": "#ecf0f1", "marginBottom": "10px"},
+                    ),
+                    dcc.Graph(id="history-graph"),
+                ],
+                id="drilldown",
+                style={"display": "none", "marginTop": "40px"},
+            ),
+        ],
+        style={"backgroundColor": "#1e1e1e", "minHeight": "100vh", "padding": "40px"},
+    )
+
+    @app.callback(Output("gpu-grid", "children"), Input("interval", "n_intervals"))
+    def update_gpu_grid(n):
+        return [
+            html.Div(
+                [
+                    html.Div(
+                        hostname, style={"textAlign": "center", "color": "#ecf0f1"}
+                    ),
+                    html.Div(
+                        [
+                            html.Div(
+                                id={
+                                    "type": "gpu-tile",
+                                    "db": hostname,
+                                    "collection": name,
+                                },
+                                title=f"{hostname} {name}: {status}",
+                                n_clicks=0,
+                                style={
+                                    "width": f"{square_width}px",
+                                    "height": f"{square_width}px",
+                                    "backgroundColor": status_colors[status],
+                                    "borderRadius": f"{square_corner_radius}px",
+                                    "margin": "2px",
+                                    "cursor": "pointer",
+                                },
+                            )
+                            for name, status in gpus
+                        ],
+                        style={
+                            "display": "flex",
+                            "padding": "4px",
+                            "border": "1px solid #555",
+                            "borderRadius": "4px",
+                        },
+                    ),
+                ],
+                style={"margin": "6px"},
+            )
+            for hostname, gpus in cluster_status(client).items()
+        ]
+
+    @app.callback(
+        Output("selected-gpu", "data"),
+        Input({"type": "gpu-tile", "db": ALL, "collection": ALL}, "n_clicks"),
+        prevent_initial_call=True,
+    )
+    def select_gpu(n_clicks):
+        # The grid is rebuilt on every refresh, which also fires this callback
+        if not ctx.triggered_id or not any(n_clicks):
+            return dash.no_update
+        return {
+            "db": ctx.triggered_id["db"],
+            "collection": ctx.triggered_id["collection"],
+        }
+
+    @app.callback(
+        Output("drilldown", "style"),
+        Output("drilldown-title", "children"),
+        Output("history-graph", "figure"),
+        Input("selected-gpu", "data"),
+        Input("metrics", "value"),
+        Input("window", "value"),
+        Input("method", "value"),
+        prevent_initial_call=True,
+    )
+    def update_drilldown(selected, metrics, window, method):
+        if not selected or not metrics:
+            return dash.no_update, dash.no_update, dash.no_update
+        title, figure = drilldown(history, selected, metrics, window, method, points)
+        return {"display": "block", "marginTop": "40px"}, title, figure
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the GPU health dashboard.")
+    parser.add_argument(
+        "--db", type=str, default="cluster", help="Path of the cluster database."
+    )
+    parser.add_argument(
+        "--engine", type=str, default="directory", choices=list(engines)
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8050)
+    parser.add_argument(
+        "--refresh", type=int, default=60, help="Seconds between grid refreshes."
+    )
+    parser.add_argument(
+        "--points", type=int, default=500, help="Maximum points per metric plotted."
+    )
+    args = parser.parse_args()
+
+    client = open_database(args.db, args.engine)
+    app = create_app(client, HistoryService(client), args.refresh, args.points)
+    app.run(host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+# Detection of slow per-GPU performance decay with CUSUM and EWMA charts.
+#
+# The 3/5 sigma check in `score_gpu` compares a single run with the GPU's
+# history, so a metric that loses a little throughput every week is never
+# flagged. Here every metric of every GPU keeps a small state (baseline,
+# EWMA and lower CUSUM) that is updated in O(1) per run and stored with the
+# collection, and a run is marked "degrading" when both charts signal.
+#
+# Running this script replays the history of every collection in time order
+# to rebuild the state (and the verdict stored in each document).
+
+import argparse
+
+from locodb.engines import open_database, writable_engines
+from locodb.utility import id_key
+from scoring import metrics_list
+
+# Key of the state stored with each collection
+state_key = "degradation"
+
+# Runs used to estimate the baseline mean and standard deviation of a metric
+warmup = 30
+# EWMA weight of the newest run, and control limit (in EWMA standard deviations)
+ewma_lambda = 0.1
+ewma_limit = 3.0
+# CUSUM allowance and decision threshold (in baseline standard deviations)
+cusum_k = 1.0
+cusum_h = 10.0
+# Runs whose verdict is kept in the state after ingestion
+ingested_runs = 1000
+
+
+class DegradationTracker:
+    """CUSUM and EWMA state of every metric of one GPU."""
+
+    def __init__(self, state=None):
+        self.state = state if state is not None else {"count": 0, "metrics": {}}
+
+    def update(self, gpu_data, timestamp):
+        """
+        Add one run and return its verdict, to merge into the `health` block:
+        whether the GPU is degrading, on which metrics, and from when
+        (the change point estimated by CUSUM).
+        """
+        self.state["count"] += 1
+        verdict = {
+            "Degrading": False,
+            "Degrading Metrics": [],
+            "Change Points": {},
+        }
+        for metric in metrics_list:
+            state = self.state["metrics"].setdefault(
+                metric,
+                {
+                    "n": 0,
+                    "mean": 0.0,
+                    "m2": 0.0,
+                    "ewma": None,
+                    "cusum": 0.0,
+                    "cusum_start": None,
+                },
+            )
+            value = gpu_data[metric]["mean"]
+
+            # Baseline (Welford) from the first `warmup` runs, then from every
+            # run while the CUSUM is at rest, so the estimate keeps improving
+            # but a decay in progress does not leak into the reference
+            if state["n"] < warmup or state["cusum"] == 0:
+                state["n"] += 1
+                delta = value - state["mean"]
+                state["mean"] += delta / state["n"]
+                state["m2"] += delta * (value - state["mean"])
+                if state["n"] <= warmup:
+                    state["ewma"] = state["mean"]
+                    continue
+            sigma = (state["m2"] / state["n"]) ** 0.5
+            if sigma == 0:
+                continue  # e.g. unsupported data types always report 0
+
+            # Lower one-sided charts: only losing performance matters
+            state["ewma"] = ewma_lambda * value + (1 - ewma_lambda) * state["ewma"]
+            ewma_sigma = sigma * (ewma_lambda / (2 - ewma_lambda)) ** 0.5
+            ewma_alarm = state["ewma"] < state["mean"] - ewma_limit * ewma_sigma
+
+            previous_cusum = state["cusum"]
+            state["cusum"] = max(
+                0.0, previous_cusum + (state["mean"] - value) / sigma - cusum_k
+            )
+            if state["cusum"] == 0:
+                state["cusum_start"] = None
+            elif previous_cusum == 0:
+                # The change point is the last run the CUSUM left zero
+                state["cusum_start"] = timestamp
+            cusum_alarm = state["cusum"] > cusum_h
+
+            # CUSUM detects the change, the EWMA confirms the level is still low
+            if cusum_alarm and ewma_alarm:
+                verdict["Degrading"] = True
+                verdict["Degrading Metrics"].append(metric)
+                verdict["Change Points"][metric] = state["cusum_start"]
+        return verdict
+
+
+def update_collection(collection, gpu_data, timestamp):
+    """Update the state stored with `collection` with one run. Returns the verdict."""
+    verdicts = []
+
+    def update(state):
+        tracker = DegradationTracker(state)
+        verdicts.append(tracker.update(gpu_data, timestamp))
+        return tracker.state
+
+    # Atomic, so two runs of the same GPU never lose an update
+    collection.update_state(state_key, update)
+    return verdicts[0]
+
+
+def update_ingested(collection, docs):
+    """
+    Update the state of `collection` with spooled runs as they are ingested
+    (`benchmark_node` leaves the charts to ingestion with a spool), and add
+    the verdicts to their `health` blocks. The verdicts of the latest runs
+    are kept in the state by run_id, so runs ingested again (e.g. after a
+    crash before their documents were inserted) are not counted twice.
+    """
+    pending = sorted(docs, key=lambda doc: doc["meta"]["timestamp"])
+    if not pending:
+        return
+
+    def update(state):
+        tracker = DegradationTracker(state)
+        runs = tracker.state.setdefault("runs", {})
+        for doc in pending:
+            run_id = doc["meta"]["run_id"]
+            if run_id not in runs:
+                runs[run_id] = tracker.update(doc["metrics"], doc["meta"]["timestamp"])
+            doc.setdefault("health", {}).update(runs[run_id])
+        # Oldest first, keeping at least the runs of this batch
+        for run_id in list(runs)[: -max(ingested_runs, len(pending))]:
+            del runs[run_id]
+        return tracker.state
+
+    collection.update_state(state_key, update)
+
+
+def backfill_collection(collection, rewrite=True):
+    """
+    Rebuild the state of `collection` by replaying its history in time order,
+    and (with `rewrite`) store the verdict in the `health` block of every document.
+    Returns the number of documents replayed.
+    """
+    docs = sorted(
+        collection.find(),
+        key=lambda doc: (doc["meta"]["timestamp"], id_key(doc["meta"]["id"])),
+    )
+    tracker = DegradationTracker()
+    for doc in docs:
+        verdict = tracker.update(doc["metrics"], doc["meta"]["timestamp"])
+        if rewrite:
+            doc.setdefault("health", {}).update(verdict)
+            collection.put(doc["meta"]["id"], doc)
+    collection.set_state(state_key, tracker.state)
+    return len(docs)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Rebuild the CUSUM/EWMA degradation state by replaying the history of every GPU."
+    )
+    parser.add_argument(
+        "--db", type=str, default="cluster", help="Path of the cluster database."
+    )
+    parser.add_argument(
+        "--engine", type=str, default="directory", choices=writable_engines
+    )
+    parser.add_argument(
+        "--state-only",
+        action="store_true",
+        help="Only rebuild the state, leave the stored verdicts as they are.",
+    )
+    args = parser.parse_args()
+
+    client = open_database(args.db, args.engine)
+    for db_name in sorted(client.list_databases()):
+        database = client[db_name]
+        for collection_name in sorted(database.list_collections()):
+            if not collection_name.startswith("gpu-"):
+                continue
+            replayed = backfill_collection(
+                database[collection_name], rewrite=not args.state_only
+            )
+            print(f"{db_name}/{collection_name}: replayed {replayed} documents")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+# Exports the cluster history to Parquet for fleet analytics (pandas, DuckDB, ...).
+#
+# Every document becomes one wide row, and rows are written to a Hive
+# partitioned dataset:
+#   <output>/hostname=<hostname>/month=<YYYY-MM>/part-<run>.parquet
+# Only the documents written since the last export are exported: the
+# watermark in <output>/_watermark.json keeps the change stream resume token
+# of every node (see `locodb/watch.py`) and the files of its rows. Rows of
+# documents replaced (e.g. by rescore.py) or deleted since are removed by
+# rewriting the files holding them, so every document has one row.
+
+import argparse
+import json
+import os
+import re
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+from locodb.engines import engines, open_database
+from locodb.utility import parse_timestamp
+from locodb.watch import ChangeStreamHistoryLost
+from scoring import metrics_list
+
+metric_fields = ["mean", "stdev", "duration", "z_score"]
+
+
+def metric_column(metric, field):
+    """e.g. ("Peak MFMA FLOPs (F8)", "mean") -> "peak_mfma_flops_f8_mean" """
+    return re.sub(r"[^0-9a-z]+", "_", metric.lower()).strip("_") + "_" + field
+
+
+def schema():
+    fields = [
+        pa.field("GUID", pa.int64()),
+        pa.field("id", pa.int64()),
+        pa.field("timestamp", pa.timestamp("s", tz="UTC")),
+        pa.field("gfx_version", pa.string()),
+        pa.field("CUs", pa.int64()),
+        pa.field("outlier", pa.bool_()),
+        pa.field("unhealthy", pa.bool_()),
+    ]
+    for metric in metrics_list:
+        for field in metric_fields:
+            fields.append(pa.field(metric_column(metric, field), pa.float64()))
+    return pa.schema(fields)
+
+
+def flatten(doc, doc_id):
+    """Flatten a stored document into one row (hostname is the partition key)."""
+    row = {
+        "GUID": doc["meta"]["GUID"],
+        "id": int(doc_id),
+        "timestamp": parse_timestamp(doc["meta"]["timestamp"]),
+        "gfx_version": doc["metrics"].get("gfx_version"),
+        "CUs": doc["metrics"].get("CUs"),
+        "outlier": doc.get("health", {}).get("Outlier"),
+        "unhealthy": doc.get("health", {}).get("Unhealthy"),
+    }
+    # `stats` may have been left out of the stored document
+    z_scores = doc.get("stats", {}).get("z_score", {})
+    for metric in metrics_list:
+        values = doc["metrics"].get(metric, {})
+        for field in ["mean", "stdev", "duration"]:
+            row[metric_column(metric, field)] = values.get(field)
+        row[metric_column(metric, "z_score")] = z_scores.get(metric)
+    return row
+
+
+def node_changes(database, token):
+    """
+    Drain the change stream of a node from `token` (from now if None).
+    Returns the new token, the (collection, ID) of every document changed
+    and of those replaced or deleted, whose earlier rows must be removed.
+    The token is None if the whole node has to be exported again: the
+    changes since `token` were dropped, or the engine has no change stream.
+    """
+    try:
+        stream = database.watch(resume_after=token)
+    except PermissionError:
+        return None, set(), set()  # Read-only snapshot
+    changed, replaced = set(), set()
+    with stream:
+        try:
+            for event in iter(stream.try_next, None):
+                key = (event["ns"]["coll"], event["documentKey"]["_id"])
+                changed.add(key)
+                if event["operationType"] != "insert":
+                    replaced.add(key)
+        except ChangeStreamHistoryLost:
+            return None, set(), set()
+        return stream.resume_token, changed, replaced
+
+
+def row_key(collection_name, doc_id):
+    """(GUID, ID) of the row of a document of `gpu-<GUID>`, or None."""
+    guid = collection_name.removeprefix("gpu-")
+    if not (guid.isdigit() and str(doc_id).isdigit()):
+        return None
+    return int(guid), int(doc_id)
+
+
+def remove_rows(output, files, keys, run_id):
+    """
+    Rewrite the dataset files with a row in `keys` without those rows.
+    Returns the files written and the files they replace.
+    """
+    written, removed = [], []
+    for i, name in enumerate(files):
+        table = pq.read_table(Path(output) / name, schema=schema())
+        keep = [
+            key not in keys
+            for key in zip(table["GUID"].to_pylist(), table["id"].to_pylist())
+        ]
+        if all(keep):
+            continue
+        removed.append(name)
+        if any(keep):
+            file = (Path(output) / name).with_name(f"part-{run_id}-{i}.parquet")
+            pq.write_table(table.filter(pa.array(keep)), file)
+            written.append(str(file.relative_to(output)))
+    return written, removed
+
+
+def export_node(db_path, engine, output, hostname, state, run_id):
+    """
+    Export the documents of one node changed since the last export. `state`
+    is the change stream token of the node and its files in the dataset
+    ({"token": ..., "files": [...]}).
+    Returns the new state, and the files written and removed.
+    """
+    database = open_database(db_path, engine)[hostname]
+    files = state.get("files", [])
+    token = state.get("token")
+    if token is None:
+        # First export: the stream starts before the scan, so documents
+        # written during the scan are exported again by the next export
+        token, _, _ = node_changes(database, None)
+        keys = {
+            (collection_name, name.rsplit(".", 1)[0])
+            for collection_name in database.list_collections()
+            for name in database[collection_name].list_documents()
+        }
+        removed_keys = None
+    else:
+        token, keys, replaced = node_changes(database, token)
+        if token is None:
+            # Changes lost: export everything again
+            return export_node(
+                db_path, engine, output, hostname, {"files": files}, run_id
+            )
+        removed_keys = {row_key(*key) for key in replaced} - {None}
+
+    rows_by_month = {}
+    for collection_name, doc_id in sorted(keys):
+        if row_key(collection_name, doc_id) is None:
+            continue
+        doc = database[collection_name].get(doc_id)
+        if doc is None:
+            continue  # Deleted since
+        row = flatten(doc, doc_id)
+        rows_by_month.setdefault(row["timestamp"].strftime("%Y-%m"), []).append(row)
+
+    if removed_keys is None:
+        written, removed = [], list(files)
+    else:
+        written, removed = remove_rows(output, files, removed_keys, run_id)
+    for month, rows in sorted(rows_by_month.items()):
+        partition = Path(output) / f"hostname={hostname}" / f"month={month}"
+        partition.mkdir(parents=True, exist_ok=True)
+        file = partition / f"part-{run_id}.parquet"
+        pq.write_table(pa.Table.from_pylist(rows, schema=schema()), file)
+        written.append(str(file.relative_to(output)))
+    new_files = [name for name in files if name not in removed] + written
+    return hostname, {"token": token, "files": new_files}, written, removed
+
+
+def _export_node(task):
+    return export_node(*task)
+
+
+def load_watermark(output):
+    file = Path(output) / "_watermark.json"
+    if not file.exists():
+        return {"nodes": {}}
+    with open(file, "r") as f:
+        return json.load(f)
+
+
+def save_watermark(output, watermark):
+    file = Path(output) / "_watermark.json"
+    tmp_file = file.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_file, "w") as f:
+        json.dump(watermark, f)
+    os.replace(tmp_file, file)
+
+
+def export_cluster(db_path, engine, output, workers=None):
+    """
+    Export every document written or deleted since the last export, one
+    node per task. Returns the number of files written.
+    """
+    if pa is None:
+        raise ImportError("Parquet export requires pyarrow (pip install pyarrow).")
+    Path(output).mkdir(parents=True, exist_ok=True)
+    watermark = load_watermark(output)
+
+    # Files from an export that did not finish are not in the watermark, nor
+    # are the files replaced by an export that did; remove them
+    known_files = {
+        name for state in watermark["nodes"].values() for name in state["files"]
+    }
+    for file in Path(output).glob("hostname=*/month=*/part-*.parquet"):
+        if str(file.relative_to(output)) not in known_files:
+            file.unlink()
+    for state in watermark["nodes"].values():
+        state["files"] = [
+            name for name in state["files"] if (Path(output) / name).exists()
+        ]
+
+    run_id = uuid.uuid4().hex
+    tasks = [
+        (
+            db_path,
+            engine,
+            output,
+            hostname,
+            watermark["nodes"].get(hostname, {}),
+            run_id,
+        )
+        for hostname in sorted(open_database(db_path, engine).list_databases())
+    ]
+    written, removed = [], []
+    with ProcessPoolExecutor(workers) as executor:
+        for hostname, state, files, replaced in executor.map(_export_node, tasks):
+            watermark["nodes"][hostname] = state
+            written += files
+            removed += replaced
+    # Only record the new files once every node has been exported
+    save_watermark(output, watermark)
+    for name in removed:
+        (Path(output) / name).unlink()
+    return len(written)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Append the cluster history to a Parquet dataset partitioned by hostname and month."
+    )
+    parser.add_argument(
+        "--db", type=str, default="cluster", help="Path of the cluster database."
+    )
+    parser.add_argument(
+        "--engine",
+        type=str,
+        default="directory",
+        choices=list(engines),
+        help="Storage engine of the cluster database.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default="cluster-parquet",
+        help="Directory of the Parquet dataset.",
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    written = export_cluster(args.db, args.engine, args.output, args.workers)
+    print(f"Wrote {written} files to {args.output}.")
+
+
+if __name__ == "__main__":
+    main()
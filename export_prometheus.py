@@ -0,0 +1,129 @@
+# Exports GPU health verdicts and metrics for the Prometheus node_exporter
+# textfile collector.
+#
+# `benchmark_node` writes the file for its own node at the end of each run.
+# Running this script builds the file for the whole cluster from the latest
+# document of every collection.
+
+import argparse
+import os
+
+from locodb.engines import engines, open_database
+from locodb.utility import parse_timestamp
+from scoring import metrics_list
+
+metric_help = {
+    "gpu_health_unhealthy": "1 if the latest health check marked the GPU unhealthy.",
+    "gpu_health_outlier": "1 if the latest health check marked the GPU an outlier.",
+    "gpu_metric_mean": "Mean of the benchmark metric in the latest health check.",
+    "gpu_metric_zscore": "Z-score of the benchmark metric against the GPU history.",
+    "gpu_health_last_check_timestamp_seconds": "Unix time of the latest health check.",
+}
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels):
+    return ",".join(f'{key}="{escape_label(value)}"' for key, value in labels.items())
+
+
+def render_metrics(documents):
+    """
+    Render the latest document of each GPU in the Prometheus text format.
+    Returns the file content as a string. The file is static, so the age of
+    a check is left to PromQL: `time() - gpu_health_last_check_timestamp_seconds`.
+    """
+    samples = {name: [] for name in metric_help}
+    for doc in documents:
+        gpu_labels = {"host": doc["meta"]["hostname"], "guid": doc["meta"]["GUID"]}
+        health = doc.get("health", {})
+        samples["gpu_health_unhealthy"].append(
+            (gpu_labels, int(health.get("Unhealthy", False)))
+        )
+        samples["gpu_health_outlier"].append(
+            (gpu_labels, int(health.get("Outlier", False)))
+        )
+        checked = parse_timestamp(doc["meta"]["timestamp"]).timestamp()
+        samples["gpu_health_last_check_timestamp_seconds"].append((gpu_labels, checked))
+        # `stats` may have been left out of the stored document
+        z_scores = doc.get("stats", {}).get("z_score", {})
+        for metric in metrics_list:
+            metric_labels = {**gpu_labels, "metric": metric}
+            if metric in doc["metrics"]:
+                samples["gpu_metric_mean"].append(
+                    (metric_labels, doc["metrics"][metric]["mean"])
+                )
+            if metric in z_scores:
+                samples["gpu_metric_zscore"].append((metric_labels, z_scores[metric]))
+
+    lines = []
+    for name, help_text in metric_help.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in samples[name]:
+            lines.append(f"{name}{{{format_labels(labels)}}} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path, content):
+    """
+    Write `content` to `path` atomically, so the collector never reads a
+    partially written file.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def latest_documents(client):
+    """Yield the latest document of every GPU collection of every node."""
+    for db_name in sorted(client.list_databases()):
+        database = client[db_name]
+        for collection_name in sorted(database.list_collections()):
+            if not collection_name.startswith("gpu-"):
+                continue
+            doc = database[collection_name].find_latest()
+            if doc is not None:
+                yield doc
+
+
+def export_cluster(client, path):
+    """Write the textfile of the whole cluster in a single pass over the database."""
+    write_textfile(path, render_metrics(latest_documents(client)))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Write GPU health metrics of the whole cluster for the node_exporter textfile collector."
+    )
+    parser.add_argument(
+        "--db",
+        type=str,
+        default="cluster",
+        help="Path of the cluster database.",
+    )
+    parser.add_argument(
+        "--engine",
+        type=str,
+        default="directory",
+        choices=list(engines),
+        help="Storage engine of the cluster database.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default="gpu_health.prom",
+        help="Path of the textfile to write (must end in .prom).",
+    )
+    args = parser.parse_args()
+    export_cluster(open_database(args.db, args.engine), args.output)
+
+
+if __name__ == "__main__":
+    main()
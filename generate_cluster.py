@@ -0,0 +1,244 @@
+# Generates a synthetic cluster database for load testing.
+# Real documents (e.g. `example-cluster/nicholson/gpu-*/N.json`) are used as
+# templates, and every GPU gets its own bias, drift and (optionally) a fault.
+
+import argparse
+import copy
+import json
+import random
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+from pathlib import Path
+
+from degradation import DegradationTracker
+from degradation import state_key as degradation_state_key
+from locodb.codec import codec_choices, parse_codec
+from locodb.engines import open_database, writable_engines
+from locodb.sharding import reshard
+from scoring import RunningPopulation, metrics_list, score_gpu
+
+# Set in each worker by `init_worker`
+templates = []
+
+
+def load_templates(template_dir):
+    """
+    Load the `metrics` block of every document under `template_dir`.
+    Expects the cluster layout `<hostname>/gpu-<GUID>/<N>.json`.
+    """
+    metrics = []
+    for file in sorted(Path(template_dir).glob("*/gpu-*/*.json")):
+        with open(file, "r") as f:
+            metrics.append(json.load(f)["metrics"])
+    if not metrics:
+        raise ValueError(f"No template documents found in {template_dir}.")
+    return metrics
+
+
+def init_worker(template_metrics):
+    global templates
+    templates = template_metrics
+
+
+def gpu_profile(rng, args):
+    """
+    Draw the per-GPU behaviour: a constant bias and a linear drift per metric,
+    and for faulty GPUs, the run at which the fault starts and the metrics it hits.
+    """
+    profile = {
+        "bias": {metric: rng.gauss(1.0, args.bias) for metric in metrics_list},
+        "drift": {metric: rng.gauss(0.0, args.drift) for metric in metrics_list},
+        "fault_start": None,
+        "fault_metrics": [],
+        "fault_factor": 1.0,
+    }
+    if rng.random() < args.faulty_fraction:
+        profile["fault_start"] = rng.randrange(args.runs // 2, args.runs)
+        profile["fault_metrics"] = rng.sample(metrics_list, rng.randint(1, 3))
+        profile["fault_factor"] = rng.uniform(0.5, 0.9)
+    return profile
+
+
+def synthetic_metrics(rng, args, profile, gpu_index, run):
+    """Build the `metrics` block of one run from a random template."""
+    gpu_data = copy.deepcopy(rng.choice(templates))
+    gpu_data["GPU Device"] = gpu_index
+    progress = run / max(args.runs - 1, 1)
+    faulty = profile["fault_start"] is not None and run >= profile["fault_start"]
+    for metric in metrics_list:
+        factor = profile["bias"][metric] * (1 + profile["drift"][metric] * progress)
+        factor *= rng.gauss(1.0, args.noise)
+        if faulty and metric in profile["fault_metrics"]:
+            factor *= profile["fault_factor"]
+        gpu_data[metric]["mean"] = round(gpu_data[metric]["mean"] * factor, 1)
+        gpu_data[metric]["stdev"] = round(gpu_data[metric]["stdev"] * factor, 1)
+        # Same amount of work done at a different rate
+        gpu_data[metric]["duration"] = round(gpu_data[metric]["duration"] / factor, 3)
+    return gpu_data
+
+
+def generate_node(args, node_index):
+    """Generate and write every run of every GPU of one node."""
+    # Seed per node so the output does not depend on the number of workers
+    rng = random.Random(args.seed * 1_000_003 + node_index)
+    hostname = f"{args.hostname_prefix}{node_index:04d}"
+    codec = parse_codec(args.codec, ["stats"] if args.omit_stats else [])
+    database = open_database(args.output, args.layout, codec)[hostname]
+
+    start = datetime.fromisoformat(args.start) + timedelta(
+        seconds=rng.randrange(args.interval_minutes * 60)
+    )
+    guids = rng.sample(range(1000, 65536), args.gpus_per_node)
+
+    documents = 0
+    for gpu_index, guid in enumerate(guids):
+        collection = database[f"gpu-{guid}"]
+        profile = gpu_profile(rng, args)
+        running_population = RunningPopulation()
+        degradation = DegradationTracker()
+        batch = []
+        for run in range(args.runs):
+            gpu_data = synthetic_metrics(rng, args, profile, gpu_index, run)
+            population, summary = running_population.summary()
+            gpu_stats, gpu_health = score_gpu(gpu_data, population, summary)
+            running_population.add(gpu_data)
+            timestamp = (
+                start + timedelta(minutes=run * args.interval_minutes)
+            ).strftime("%Y-%m-%d %H:%M:%S UTC")
+            gpu_health.update(degradation.update(gpu_data, timestamp))
+            batch.append(
+                {
+                    "metrics": gpu_data,
+                    "stats": gpu_stats,
+                    "health": gpu_health,
+                    "meta": {
+                        "hostname": hostname,
+                        "GUID": guid,
+                        "timestamp": timestamp,
+                    },
+                }
+            )
+            if len(batch) == args.batch_size:
+                collection.insert_many(batch)
+                documents += len(batch)
+                batch = []
+        if batch:
+            collection.insert_many(batch)
+            documents += len(batch)
+        collection.set_state(degradation_state_key, degradation.state)
+    return hostname, documents
+
+
+def _generate_node(task):
+    return generate_node(*task)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic GPU health check cluster database."
+    )
+    parser.add_argument(
+        "--templates",
+        type=str,
+        default="example-cluster",
+        help="Cluster directory with real documents to use as templates.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default="synthetic-cluster",
+        help="Path of the generated database.",
+    )
+    parser.add_argument(
+        "--layout",
+        type=str,
+        default="directory",
+        choices=writable_engines,
+        help="Storage layout of the generated database.",
+    )
+    parser.add_argument(
+        "--shard-size",
+        type=int,
+        default=None,
+        help="With the directory layout, spread the documents of every GPU over "
+        "shards of this many documents (see locodb/sharding.py).",
+    )
+    parser.add_argument(
+        "--codec",
+        type=str,
+        default="json",
+        choices=codec_choices,
+        help="Encoding of the stored documents (see locodb/codec.py).",
+    )
+    parser.add_argument(
+        "--omit-stats",
+        action="store_true",
+        help="Do not store the `stats` block of each document.",
+    )
+    parser.add_argument("--nodes", type=int, default=512)
+    parser.add_argument("--gpus-per-node", type=int, default=8)
+    parser.add_argument("--runs", type=int, default=5000, help="Runs per GPU.")
+    parser.add_argument("--hostname-prefix", type=str, default="node")
+    parser.add_argument(
+        "--start",
+        type=str,
+        default="2025-01-01 00:00:00",
+        help="Timestamp (UTC) of the first run.",
+    )
+    parser.add_argument(
+        "--interval-minutes", type=int, default=60, help="Time between runs."
+    )
+    parser.add_argument(
+        "--bias",
+        type=float,
+        default=0.01,
+        help="Standard deviation of the relative per-GPU bias of each metric.",
+    )
+    parser.add_argument(
+        "--drift",
+        type=float,
+        default=0.02,
+        help="Standard deviation of the relative drift of each metric over all runs.",
+    )
+    parser.add_argument(
+        "--noise",
+        type=float,
+        default=0.002,
+        help="Relative run-to-run noise added on top of the templates.",
+    )
+    parser.add_argument(
+        "--faulty-fraction",
+        type=float,
+        default=0.01,
+        help="Fraction of GPUs that develop a fault.",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--batch-size", type=int, default=500, help="Documents per insert_many."
+    )
+    args = parser.parse_args()
+    if args.runs < 2:
+        # Faults start in the second half of the runs
+        parser.error("--runs must be at least 2")
+    if args.shard_size is not None:
+        if args.layout != "directory":
+            parser.error("--shard-size requires the directory layout")
+        Path(args.output).mkdir(parents=True, exist_ok=True)
+        reshard(args.output, "sharded", args.shard_size)
+
+    template_metrics = load_templates(args.templates)
+    tasks = [(args, node_index) for node_index in range(args.nodes)]
+    total = 0
+    with Pool(
+        args.workers, initializer=init_worker, initargs=(template_metrics,)
+    ) as pool:
+        for hostname, documents in pool.imap_unordered(_generate_node, tasks):
+            total += documents
+            print(f"{hostname}: {documents} documents")
+    print(f"Wrote {total} documents to {args.output}.")
+
+
+if __name__ == "__main__":
+    main()
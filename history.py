@@ -0,0 +1,410 @@
+# Downsampled metric history of a GPU, for plotting.
+#
+# A GPU checked every hour has thousands of results, each with 21 metrics,
+# far more points than a plot a few hundred pixels wide can show. The
+# history of a collection is read once into per-metric arrays sorted by
+# time, and every request takes a time window and a point budget and
+# returns either
+#   "minmax": the min, mean and max of equal-width time buckets (nothing
+#             an outlier does is hidden, e.g. for a min/max band), or
+#   "lttb":   Largest-Triangle-Three-Buckets, a subset of the actual points
+#             keeping the visual shape of the series.
+# The arrays are refreshed at most every `max_age` seconds by following
+# the change stream of the collection: the documents inserted since are
+# added, and the collection is read again if a document was replaced or
+# deleted (or if the changes were dropped from the change log).
+# Downsampled results are kept in an LRU cache until the collection
+# changes. Only existing collections are read (names come from URLs), and
+# a refreshed series replaces the old one rather than changing it, so
+# requests for other collections, or for cached data, never wait for a
+# slow read.
+#
+#   python history.py node0001 gpu-19794 --db cluster --metric "HBM BW" --points 200
+
+import argparse
+import bisect
+import itertools
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from locodb.engines import engines, open_database
+from locodb.utility import parse_timestamp
+from locodb.watch import ChangeStreamHistoryLost
+from scoring import metrics_list
+
+methods = ["minmax", "lttb"]
+
+
+class UnknownCollection(LookupError):
+    """No such database or collection."""
+
+
+def format_timestamp(seconds):
+    """Inverse of `parse_timestamp`, from seconds since the epoch."""
+    return time.strftime("%Y-%m-%d %H:%M:%S UTC", time.gmtime(seconds))
+
+
+def lttb(times, values, threshold):
+    """
+    Indices of the `threshold` points chosen by Largest-Triangle-Three-Buckets
+    (Steinarsson, 2013) among the points (times[i], values[i]).
+    """
+    n = len(times)
+    if threshold >= n:
+        return list(range(n))
+    if threshold < 3:
+        return [0, n - 1][:threshold]
+    selected = [0]
+    # The first and last points are kept, the others split into equal buckets
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket, the third vertex of the triangle
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        count = next_end - next_start
+        avg_t = sum(times[next_start:next_end]) / count
+        avg_v = sum(values[next_start:next_end]) / count
+
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        ta, va = times[a], values[a]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((ta - avg_t) * (values[j] - va) - (ta - times[j]) * (avg_v - va))
+            if area > best_area:
+                best, best_area = j, area
+        selected.append(best)
+        a = best
+    selected.append(n - 1)
+    return selected
+
+
+def minmax_buckets(times, values, start, end, buckets):
+    """
+    Min, mean and max of the values in `buckets` equal time buckets of
+    [start, end]. Empty buckets are left out.
+    """
+    result = {"t": [], "min": [], "mean": [], "max": [], "count": []}
+    if not times:
+        return result
+    width = (end - start) / buckets if end > start else 1.0
+    current, low, high, total, count = None, 0.0, 0.0, 0.0, 0
+
+    def flush():
+        if count:
+            result["t"].append(format_timestamp(start + current * width))
+            result["min"].append(low)
+            result["mean"].append(total / count)
+            result["max"].append(high)
+            result["count"].append(count)
+
+    for t, value in zip(times, values):
+        bucket = min(int((t - start) / width), buckets - 1)
+        if bucket != current:
+            flush()
+            current, low, high, total, count = bucket, value, value, 0.0, 0
+        low = min(low, value)
+        high = max(high, value)
+        total += value
+        count += 1
+    flush()
+    return result
+
+
+class Series:
+    """
+    Time-sorted values of every metric of one collection. `token` is the
+    resume token of the change stream of the collection when it was read,
+    None if the collection has no change stream (a read-only snapshot).
+    """
+
+    def __init__(self, version=0):
+        self.times = []
+        self.values = {metric: [] for metric in metrics_list}
+        self.ids = set()
+        self.token = None
+        self.version = version
+        self.checked = 0.0
+
+    def copy(self, version):
+        series = Series(version)
+        series.times = list(self.times)
+        series.values = {metric: list(values) for metric, values in self.values.items()}
+        series.ids = set(self.ids)
+        series.token = self.token
+        return series
+
+    def add(self, docs):
+        rows = []
+        for doc in docs:
+            doc_id = doc.get("meta", {}).get("id")
+            if doc_id is not None:
+                # Inserted while the collection was read, and read already
+                if str(doc_id) in self.ids:
+                    continue
+                self.ids.add(str(doc_id))
+            if not isinstance(doc.get("metrics"), dict):
+                continue
+            t = parse_timestamp(doc["meta"]["timestamp"]).timestamp()
+            values = [
+                doc["metrics"].get(metric, {}).get("mean") for metric in metrics_list
+            ]
+            rows.append((t, values))
+        if not rows:
+            return
+        if self.times and min(t for t, _ in rows) < self.times[-1]:
+            # Out of order: merge with the values already there
+            rows += [
+                (t, [self.values[metric][i] for metric in metrics_list])
+                for i, t in enumerate(self.times)
+            ]
+            self.times = []
+            self.values = {metric: [] for metric in metrics_list}
+        rows.sort(key=lambda row: row[0])
+        for t, values in rows:
+            self.times.append(t)
+            for metric, value in zip(metrics_list, values):
+                self.values[metric].append(value)
+
+
+class HistoryService:
+    """
+    Downsampled history of the collections of a LocoDatabase (any engine).
+    Safe to share between the threads of a web server.
+    """
+
+    def __init__(self, client, max_age=30.0, max_series=256, max_results=1024):
+        self.client = client
+        self.max_age = max_age
+        self.max_series = max_series
+        self.max_results = max_results
+        self.series = OrderedDict()
+        self.results = OrderedDict()
+        # Guards the caches only; every collection has its own lock for reads
+        self.lock = threading.Lock()
+        self.loading = {}
+        # Version of every series read, part of the keys of the results
+        self.versions = itertools.count(1)
+
+    def _collection(self, db_name, collection_name):
+        """The collection, if it exists: looking one up may create it."""
+        if db_name not in self.client.list_databases():
+            raise UnknownCollection(f"No database {db_name}")
+        database = self.client[db_name]
+        if collection_name not in database.list_collections():
+            raise UnknownCollection(f"No collection {collection_name} in {db_name}")
+        return database[collection_name]
+
+    def _fresh(self, key):
+        series = self.series.get(key)
+        if series is not None and time.monotonic() - series.checked < self.max_age:
+            self.series.move_to_end(key)
+            return series
+        return None
+
+    def _load(self, db_name, collection_name):
+        """The series of a collection, refreshed if older than `max_age`."""
+        key = (db_name, collection_name)
+        with self.lock:
+            series = self._fresh(key)
+            if series is not None:
+                return series
+            loading = self.loading.setdefault(key, threading.Lock())
+        with loading:
+            with self.lock:
+                # Refreshed by another request in the meantime
+                series = self._fresh(key)
+                if series is not None:
+                    return series
+                series = self.series.get(key)
+            try:
+                collection = self._collection(db_name, collection_name)
+            except UnknownCollection:
+                with self.lock:
+                    self.loading.pop(key, None)
+                raise
+            series = self._refresh(collection, series)
+            series.checked = time.monotonic()
+            with self.lock:
+                self.series[key] = series
+                self.series.move_to_end(key)
+                while len(self.series) > self.max_series:
+                    evicted, _ = self.series.popitem(last=False)
+                    self.loading.pop(evicted, None)
+        return series
+
+    def _refresh(self, collection, series):
+        """
+        `series` (None if not read yet) brought up to date with the change
+        stream of `collection`, the same object if nothing changed.
+        """
+        if series is not None and series.token is None:
+            return series  # Read-only
+        if series is not None:
+            inserted = []
+            try:
+                with collection.watch(resume_after=series.token) as stream:
+                    for event in iter(stream.try_next, None):
+                        if event["operationType"] != "insert":
+                            break
+                        inserted.append(event["fullDocument"])
+                    else:
+                        if not inserted:
+                            return series
+                        # Only the documents inserted since the last refresh
+                        series = series.copy(next(self.versions))
+                        series.add(doc for doc in inserted if doc is not None)
+                        series.token = stream.resume_token
+                        return series
+            except ChangeStreamHistoryLost:
+                pass
+        # Read again: a document was replaced or deleted, whose earlier
+        # values are somewhere in the arrays
+        series = Series(next(self.versions))
+        try:
+            # Before reading, so the documents written meanwhile are not missed
+            with collection.watch() as stream:
+                series.token = stream.resume_token
+        except PermissionError:
+            pass  # Read-only snapshot
+        series.add(collection.find())
+        return series
+
+    def history(
+        self,
+        db_name,
+        collection_name,
+        metrics=None,
+        start=None,
+        end=None,
+        points=500,
+        method="minmax",
+    ):
+        """
+        History of `metrics` (all by default) between the timestamps `start`
+        and `end` (the whole history by default), downsampled to at most
+        `points` points per metric with `method`.
+        """
+        if method not in methods:
+            raise ValueError(f"Unknown method {method}; use one of {methods}")
+        metrics = list(metrics or metrics_list)
+        for metric in metrics:
+            if metric not in metrics_list:
+                raise ValueError(f"Unknown metric {metric}")
+        points = max(1, int(points))
+        series = self._load(db_name, collection_name)
+        key = (
+            db_name,
+            collection_name,
+            tuple(metrics),
+            start,
+            end,
+            points,
+            method,
+            series.version,
+        )
+        with self.lock:
+            if key in self.results:
+                self.results.move_to_end(key)
+                return self.results[key]
+
+        start_time = parse_timestamp(start).timestamp() if start else None
+        end_time = parse_timestamp(end).timestamp() if end else None
+        lo, hi = 0, len(series.times)
+        if start_time is not None:
+            lo = bisect.bisect_left(series.times, start_time)
+        if end_time is not None:
+            hi = bisect.bisect_right(series.times, end_time)
+        times = series.times[lo:hi]
+        if times:
+            # Buckets span the requested window, or the data where open ended
+            start_time = times[0] if start_time is None else start_time
+            end_time = times[-1] if end_time is None else end_time
+        result = {
+            "db": db_name,
+            "collection": collection_name,
+            "start": format_timestamp(start_time) if times else start,
+            "end": format_timestamp(end_time) if times else end,
+            "method": method,
+            "total": len(times),
+            "series": {},
+        }
+        for metric in metrics:
+            # Runs without the metric are left out
+            pairs = [
+                (t, value)
+                for t, value in zip(times, series.values[metric][lo:hi])
+                if value is not None
+            ]
+            metric_times = [t for t, _ in pairs]
+            metric_values = [value for _, value in pairs]
+            if method == "minmax":
+                result["series"][metric] = minmax_buckets(
+                    metric_times, metric_values, start_time, end_time, points
+                )
+            else:
+                selected = lttb(metric_times, metric_values, points)
+                result["series"][metric] = {
+                    "t": [format_timestamp(metric_times[i]) for i in selected],
+                    "value": [metric_values[i] for i in selected],
+                }
+
+        with self.lock:
+            self.results[key] = result
+            while len(self.results) > self.max_results:
+                self.results.popitem(last=False)
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Print the downsampled metric history of a GPU as JSON."
+    )
+    parser.add_argument("database", type=str, help="Hostname of the node.")
+    parser.add_argument(
+        "collection", type=str, help="Collection of the GPU (gpu-<GUID>)."
+    )
+    parser.add_argument(
+        "--db", type=str, default="cluster", help="Path of the cluster database."
+    )
+    parser.add_argument(
+        "--engine", type=str, default="directory", choices=list(engines)
+    )
+    parser.add_argument(
+        "--metric",
+        type=str,
+        action="append",
+        default=None,
+        help="Metric to include (repeatable; all by default).",
+    )
+    parser.add_argument(
+        "--start", type=str, default=None, help="e.g. 2025-06-01 00:00:00 UTC"
+    )
+    parser.add_argument("--end", type=str, default=None)
+    parser.add_argument(
+        "--points", type=int, default=500, help="Maximum points per metric."
+    )
+    parser.add_argument("--method", type=str, default="minmax", choices=methods)
+    args = parser.parse_args()
+
+    service = HistoryService(open_database(args.db, args.engine))
+    try:
+        result = service.history(
+            args.database,
+            args.collection,
+            args.metric,
+            args.start,
+            args.end,
+            args.points,
+            args.method,
+        )
+    except UnknownCollection as e:
+        parser.error(str(e))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
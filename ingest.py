@@ -0,0 +1,11 @@
+# Merges spooled health checks (see `benchmark_gpus.py --spool-dir`) into
+# the cluster database, adding the runs to the CUSUM/EWMA charts of their
+# GPUs and their degradation verdict to their `health` blocks.
+#
+#   python ingest.py /shared/spool --db cluster --daemon
+
+from degradation import update_ingested
+from locodb.ingest import main
+
+if __name__ == "__main__":
+    main(prepare=update_ingested)
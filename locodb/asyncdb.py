@@ -0,0 +1,190 @@
+# Asyncio front end to any LocoDatabase storage engine.
+#
+# Every call runs the blocking engine method on a bounded thread pool, so a
+# slow (e.g. NFS) read only holds up the coroutine waiting for it, not the
+# event loop serving every other client.
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from locodb.engines import open_database
+
+
+class AsyncLocoDatabase:
+    """Mirrors LocoDatabase with `async` methods."""
+
+    def __init__(self, base_path, engine="directory", max_workers=8):
+        self.client = open_database(base_path, engine)
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="locodb"
+        )
+
+    async def run(self, func, *args, **kwargs):
+        """Run a blocking call on the executor."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    def __getitem__(self, db_name):
+        """Get a database."""
+        return AsyncDatabase(self, db_name)
+
+    async def list_databases(self):
+        return await self.run(self.client.list_databases)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+
+class AsyncDatabase:
+    """Mirrors Database with `async` methods."""
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self._database = None
+
+    async def database(self):
+        # Opening a database may touch the disk (e.g. mkdir), so it is
+        # done on the executor too
+        if self._database is None:
+            self._database = await self.client.run(self.client.client.__getitem__, self.name)
+        return self._database
+
+    def __getitem__(self, collection_name):
+        """Get a collection."""
+        return AsyncCollection(self, collection_name)
+
+    async def list_collections(self):
+        database = await self.database()
+        return await self.client.run(database.list_collections)
+
+    async def fan_out(self, method, *args, collections=None):
+        """
+        Call `method` (e.g. "find_latest") concurrently on several collections
+        (all of them by default). Returns a dictionary of collection name to result.
+        """
+        if collections is None:
+            collections = await self.list_collections()
+        results = await asyncio.gather(
+            *(getattr(self[name], method)(*args) for name in collections)
+        )
+        return dict(zip(collections, results))
+
+
+class AsyncCollection:
+    """Mirrors Collection with `async` methods."""
+
+    def __init__(self, database, name):
+        self.database = database
+        self.client = database.client
+        self.name = name
+        self._collection = None
+
+    async def collection(self):
+        if self._collection is None:
+            database = await self.database.database()
+            self._collection = await self.client.run(database.__getitem__, self.name)
+        return self._collection
+
+    async def _call(self, method, *args):
+        collection = await self.collection()
+        return await self.client.run(getattr(collection, method), *args)
+
+    async def insert_one(self, doc):
+        return await self._call("insert_one", doc)
+
+    async def insert_many(self, docs):
+        return await self._call("insert_many", docs)
+
+    async def get(self, doc_id):
+        return await self._call("get", doc_id)
+
+    async def find_one(self, query):
+        return await self._call("find_one", query)
+
+    async def find_all(self, query):
+        return await self._call("find_all", query)
+
+    async def find_latest(self):
+        return await self._call("find_latest")
+
+    async def find_most_recent_matching(self, query):
+        return await self._call("find_most_recent_matching", query)
+
+    async def find_most_recent_matching_set(self, query={}):
+        return await self._call("find_most_recent_matching_set", query)
+
+    async def explain(self, query):
+        return await self._call("explain", query)
+
+    async def delete_one(self, query):
+        return await self._call("delete_one", query)
+
+    async def list_documents(self):
+        return await self._call("list_documents")
+
+    def find(self, query={}, batch_size=100, document_class=None):
+        """Return an async cursor over the documents matching the query."""
+        return AsyncCursor(self, query, batch_size, document_class)
+
+
+class AsyncCursor:
+    """
+    Async iterator over the documents of a query, read on the executor
+    `batch_size` at a time. The directory engine reads the files of a batch
+    only; the sqlite engine fetches the rows of the query at the first batch
+    and parses them a batch at a time.
+    """
+
+    def __init__(self, collection, query, batch_size, document_class=None):
+        self.collection = collection
+        self.query = query
+        self.batch_size = batch_size
+        self.document_class = document_class
+        self._iterator = None
+        self._batch = []
+        self._pending = None
+
+    def _next_batch(self):
+        batch = []
+        for doc in self._iterator:
+            batch.append(doc)
+            if len(batch) == self.batch_size:
+                break
+        return batch
+
+    async def _read_batch(self):
+        if self._iterator is None:
+            collection = await self.collection.collection()
+            self._iterator = collection.find_iter(self.query, self.document_class)
+        return await self.collection.client.run(self._next_batch)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._batch:
+            if self._pending is None:
+                self._pending = asyncio.ensure_future(self._read_batch())
+            # Shielded: the batch being read when a caller is cancelled is
+            # kept for the next call, rather than lost or read twice at once
+            try:
+                self._batch = await asyncio.shield(self._pending)
+            finally:
+                if self._pending.done():
+                    self._pending = None
+            if not self._batch:
+                raise StopAsyncIteration
+            self._batch.reverse()
+        return self._batch.pop()
+
+    async def to_list(self):
+        """All remaining documents."""
+        return [doc async for doc in self]
@@ -0,0 +1,125 @@
+# How documents are encoded on disk.
+#
+# A codec is a format (JSON or msgpack) and an optional compression (gzip
+# or zstd), written as e.g. "json", "json+zstd" or "msgpack+gzip". Reading
+# does not depend on the codec: the compression and format of every file
+# are recognized from its first bytes, so a collection can hold documents
+# written with different codecs (e.g. while it is being rewritten). Files
+# keep their `<N>.json` names whatever the codec, so document IDs, indexes
+# and listings do not depend on it.
+#
+# A codec can also leave top-level blocks out of the stored document, such
+# as `stats`, which can be recomputed from the history (see `scoring.py`).
+
+import gzip
+import json
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+formats = ["json", "msgpack"]
+compressions = ["gzip", "zstd"]
+codec_choices = formats + [f"{f}+{c}" for f in formats for c in compressions]
+
+gzip_magic = b"\x1f\x8b"
+zstd_magic = b"\x28\xb5\x2f\xfd"
+
+# zstandard (de)compressors must not be shared between threads
+_local = threading.local()
+
+
+def _require(module, name):
+    if module is None:
+        raise ImportError(f"The {name} codec requires {name} (pip install {name}).")
+
+
+class Codec:
+    """Encodes documents as bytes, e.g. Codec("msgpack", "zstd", omit=["stats"])."""
+
+    def __init__(self, format="json", compression=None, omit=(), indent=None):
+        if format not in formats:
+            raise ValueError(f"Unknown document format: {format}")
+        if compression not in [None] + compressions:
+            raise ValueError(f"Unknown compression: {compression}")
+        if format == "msgpack":
+            _require(msgpack, "msgpack")
+        if compression == "zstd":
+            _require(zstandard, "zstandard")
+        self.format = format
+        self.compression = compression
+        self.omit = list(omit)
+        # Only for human-readable JSON, as written by earlier versions
+        self.indent = indent
+
+    @property
+    def name(self):
+        if self.compression is None:
+            return self.format
+        return f"{self.format}+{self.compression}"
+
+    def prepare(self, doc):
+        """The document as stored, without the omitted blocks."""
+        if not self.omit:
+            return doc
+        return {key: value for key, value in doc.items() if key not in self.omit}
+
+    def encode(self, doc):
+        doc = self.prepare(doc)
+        if self.format == "msgpack":
+            data = msgpack.packb(doc, use_bin_type=True)
+        elif self.indent is not None:
+            data = json.dumps(doc, indent=self.indent).encode()
+        else:
+            data = json.dumps(doc, separators=(",", ":")).encode()
+        if self.compression == "gzip":
+            # mtime=0 so identical documents give identical files
+            data = gzip.compress(data, compresslevel=6, mtime=0)
+        elif self.compression == "zstd":
+            data = _zstd_compressor().compress(data)
+        return data
+
+
+def _zstd_compressor():
+    compressor = getattr(_local, "compressor", None)
+    if compressor is None:
+        compressor = _local.compressor = zstandard.ZstdCompressor(level=3)
+    return compressor
+
+
+def _zstd_decompressor():
+    decompressor = getattr(_local, "decompressor", None)
+    if decompressor is None:
+        decompressor = _local.decompressor = zstandard.ZstdDecompressor()
+    return decompressor
+
+
+def parse_codec(spec, omit=()):
+    """Codec from a name such as "json+zstd"."""
+    if spec not in codec_choices:
+        raise ValueError(
+            f"Unknown codec: {spec} (expected one of {', '.join(codec_choices)})"
+        )
+    format, _, compression = spec.partition("+")
+    return Codec(format, compression or None, omit)
+
+
+def decode(data):
+    """Decode a document written with any codec."""
+    if data[:2] == gzip_magic:
+        data = gzip.decompress(data)
+    elif data[:4] == zstd_magic:
+        _require(zstandard, "zstandard")
+        data = _zstd_decompressor().decompress(data)
+    # A JSON document starts with "{"; a msgpack map never does
+    if data.lstrip()[:1] == b"{":
+        return json.loads(data)
+    _require(msgpack, "msgpack")
+    return msgpack.unpackb(data, raw=False)
@@ -1,158 +1,524 @@
+import fcntl
 import json
+import os
 from pathlib import Path
 from datetime import datetime
 
-from locodb.utility import get_timestamp
+from locodb.codec import Codec, decode
+from locodb.profiling import get_tracer, traced
+from locodb.query import _missing, get_path, matches, matches_condition, plan_query
+from locodb.sharding import (
+    append_shard_timestamp,
+    is_shard,
+    load_layout,
+    shard_may_match,
+    shard_name,
+    shard_ranges,
+)
+from locodb.utility import get_timestamp, lock_file, temporary_file
+from locodb.watch import DirectoryChangeStream, append_change
 
 
 class LocoDatabase:
     """A class that mimics the pymongo API but stores data in a directory structure."""
 
-    def __init__(self, base_path):
+    def __init__(self, base_path, codec=None):
         self.base_path = Path(base_path)
         self.base_path.mkdir(
             parents=True, exist_ok=True
         )  # Ensure base directory exists
+        # Encoding of the documents written (see `locodb/codec.py`)
+        self.codec = codec or Codec()
+        # Flat or sharded collections (see `locodb/sharding.py`)
+        self.layout = load_layout(self.base_path)
 
     def __getitem__(self, db_name):
         """Get a database (top-level directory)."""
-        return Database(self.base_path / db_name)
+        return Database(self.base_path / db_name, self.codec, self.layout)
+
+    def list_databases(self):
+        """List available databases (top-level directories)."""
+        return [d.name for d in self.base_path.iterdir() if d.is_dir()]
 
 
 class Database:
     """Represents a MongoDB-like database (maps to a top-level directory)."""
 
-    def __init__(self, path):
+    def __init__(self, path, codec=None, layout=None):
         self.path = Path(path)
         self.path.mkdir(parents=True, exist_ok=True)  # Ensure database directory exists
+        self.codec = codec or Codec()
+        self.layout = layout or load_layout(self.path.parent)
 
     def __getitem__(self, collection_name):
         """Get a collection (second-level directory)."""
-        return Collection(self.path / collection_name)
+        return Collection(self.path / collection_name, self.codec, self.layout)
 
     def list_collections(self):
         """List available collections in the database."""
         return [d.name for d in self.path.iterdir() if d.is_dir()]
 
+    def watch(self, resume_after=None, poll_interval=1.0):
+        """Change stream of every collection of the database (see `locodb/watch.py`)."""
+        return DirectoryChangeStream(self, None, resume_after, poll_interval)
+
 
 class Collection:
     """Represents a MongoDB-like collection (maps to a subdirectory)."""
 
-    def __init__(self, path):
+    def __init__(self, path, codec=None, layout=None):
         self.path = Path(path)
         self.path.mkdir(
             parents=True, exist_ok=True
         )  # Ensure collection directory exists
-
+        self.codec = codec or Codec()
+        self.layout = layout or load_layout(self.path.parent.parent)
+        self.sharded = self.layout["layout"] == "sharded"
+
+    def _file(self, doc_id):
+        """Where the document `doc_id` is written."""
+        if self.sharded:
+            shard = shard_name(doc_id, self.layout["shard_size"])
+            return self.path / shard / f"{doc_id}.json"
+        return self.path / f"{doc_id}.json"
+
+    def _locate(self, doc_id):
+        """Where the document `doc_id` is, if it exists."""
+        file = self._file(doc_id)
+        if self.sharded and not file.exists():
+            # Not moved to its shard yet
+            return self.path / f"{doc_id}.json"
+        return file
+
+    def _shards(self):
+        """Shard directories, by increasing ID."""
+        shards = [d for d in self.path.iterdir() if d.is_dir() and is_shard(d.name)]
+        return sorted(shards, key=lambda d: int(d.name) if d.name.isdigit() else -1)
+
+    def _files(self, query={}, stats=None):
+        """
+        Every document file, skipping the shards whose time range cannot
+        match a condition of `query` on `meta.timestamp`.
+        """
+        if not self.sharded:
+            yield from self.path.glob("*.json")
+            return
+        shards = self._shards()
+        if "meta.timestamp" in query:
+            ranges = shard_ranges(self.path)
+            condition = query["meta.timestamp"]
+            selected = [
+                d for d in shards if shard_may_match(ranges.get(d.name), condition)
+            ]
+        else:
+            selected = shards
+        if stats is not None:
+            stats["shards"] = f"{len(selected)}/{len(shards)}"
+        for shard in selected:
+            yield from shard.glob("*.json")
+        # Documents not moved to their shard yet
+        yield from self.path.glob("*.json")
+
+    def _follow_layout(self):
+        """
+        Switch to the sharded layout if the database was sharded since this
+        collection was opened, so new documents never take the IDs of the
+        documents moved to the shards.
+        """
+        if not self.sharded:
+            self.layout = load_layout(self.path.parent.parent)
+            self.sharded = self.layout["layout"] == "sharded"
+
+    def _next_id(self):
+        """First ID to try for a new document."""
+        self._follow_layout()
+        if not self.sharded:
+            return len(list(self.path.glob("*.json"))) + 1
+        # After the highest ID, found in the last numeric shard (or not moved yet)
+        files = list(self.path.glob("*.json"))
+        shards = [d for d in self._shards() if d.name.isdigit()]
+        if shards:
+            files += shards[-1].glob("*.json")
+        ids = [int(file.stem) for file in files if file.stem.isdigit()]
+        return max(ids, default=0) + 1
+
+    @traced("collection.insert_one")
     def insert_one(self, doc):
         """Insert a single document (store as a JSON file)."""
-        # Auto-generate ID if not given
-        doc_id = doc.get("_id", str(len(list(self.path.iterdir())) + 1))
-        # Add meta field
-        # appends to any metadata already present in the document
-        doc.setdefault("meta", {}).update(
-            {
-                "id": doc_id,
-                "timestamp": get_timestamp(),
-            }
-        )
-        with open(self.path / f"{doc_id}.json", "w") as f:
-            json.dump(doc, f, indent=4)
+        if "_id" in doc:
+            doc_id = doc["_id"]
+            self._write(doc, doc_id)
+        else:
+            # Auto-generate ID if not given
+            doc_id = self._write_new(doc, self._next_id())
         return {"_id": doc_id}
 
+    @traced("collection.insert_many")
+    def insert_many(self, docs):
+        """Insert several documents, listing the collection only once to allocate IDs."""
+        next_id = self._next_id()
+        inserted_ids = []
+        for doc in docs:
+            if "_id" in doc:
+                doc_id = doc["_id"]
+                self._write(doc, doc_id)
+            else:
+                doc_id = self._write_new(doc, next_id)
+                next_id = int(doc_id) + 1
+            inserted_ids.append(doc_id)
+        return {"inserted_ids": inserted_ids}
+
+    def _stamp(self, doc, doc_id):
+        # Add meta field
+        # appends to any metadata already present in the document
+        # (a timestamp already present is kept, e.g. when importing history)
+        meta = doc.setdefault("meta", {})
+        meta["id"] = doc_id
+        meta.setdefault("timestamp", get_timestamp())
+
+    def _write(self, doc, doc_id):
+        self._stamp(doc, doc_id)
+        self._store(doc_id, doc)
+
+    def _write_tmp(self, doc_id, doc):
+        data = self.codec.encode(doc)
+        f, tmp_file = temporary_file(self.path, f"{doc_id}.json")
+        with f:
+            f.write(data)
+        tracer = get_tracer()
+        tracer.count("documents_written")
+        tracer.count("bytes_written", len(data))
+        return tmp_file
+
+    def _write_new(self, doc, first_id):
+        """
+        Write `doc` under the first free numeric ID from `first_id`.
+        The file is hard-linked into place, which fails if another writer
+        (e.g. a concurrent Slurm job) took the ID in the meantime, so
+        writers never overwrite each other's documents.
+        """
+        doc_id = first_id
+        while True:
+            self._stamp(doc, str(doc_id))
+            tmp_file = self._write_tmp(str(doc_id), doc)
+            file = self._file(str(doc_id))
+            try:
+                if self.sharded:
+                    if (self.path / file.name).exists():
+                        raise FileExistsError  # Not moved to its shard yet
+                    file.parent.mkdir(exist_ok=True)
+                os.link(tmp_file, file)
+                break
+            except FileExistsError:
+                doc_id += 1
+            finally:
+                tmp_file.unlink()
+        if self.sharded:
+            append_shard_timestamp(self.path, file.parent.name, doc)
+        self._append_index(str(doc_id), doc)
+        append_change(self.path, "insert", str(doc_id))
+        return str(doc_id)
+
+    def _store(self, doc_id, doc, record=True):
+        # Write to a temporary file and rename it into place, so readers
+        # never see a partially written document
+        self._follow_layout()
+        tmp_file = self._write_tmp(doc_id, doc)
+        file = self._file(doc_id)
+        operation = "replace" if file.exists() else "insert"
+        if self.sharded:
+            file.parent.mkdir(exist_ok=True)
+        os.replace(tmp_file, file)
+        if self.sharded:
+            append_shard_timestamp(self.path, file.parent.name, doc)
+            # The previous version, if it was not moved to its shard yet
+            unsharded = self.path / file.name
+            if unsharded.exists():
+                unsharded.unlink()
+                operation = "replace"
+        self._append_index(doc_id, doc)
+        if record:
+            append_change(self.path, operation, doc_id)
+
+    def _read(self, file):
+        with open(file, "rb") as f:
+            data = f.read()
+        tracer = get_tracer()
+        tracer.count("documents_read")
+        tracer.count("bytes_parsed", len(data))
+        return decode(data)
+
+    def _index_file(self, field):
+        return self.path / "_index" / f"{field}.jsonl"
+
+    def list_indexes(self):
+        """List the fields (dotted paths) with an index in this collection."""
+        return [file.stem for file in (self.path / "_index").glob("*.jsonl")]
+
+    @traced("collection.create_index")
+    def create_index(self, field):
+        """
+        Index the dotted path `field` (e.g. "meta.timestamp") so queries on it
+        only read the matching documents. The index is an append-only log of
+        [ID, value] lines ([ID] when a document is deleted), kept up to date
+        by every write.
+        """
+        if field in self.list_indexes():
+            return field
+        (self.path / "_index").mkdir(exist_ok=True)
+        # Writers wait to add their entries until the index is in place, so
+        # a document written during the scan is never left out
+        with open(self.path / "_index" / ".lock", "a") as lock:
+            lock_file(lock, fcntl.LOCK_EX)
+            if field in self.list_indexes():
+                return field
+            lines = []
+            for file in self._files():
+                try:
+                    value = get_path(self._read(file), field)
+                except FileNotFoundError:
+                    continue  # Deleted after the listing
+                if value is not _missing:
+                    lines.append(json.dumps([file.stem, value]) + "\n")
+            f, tmp_file = temporary_file(self.path / "_index", f"{field}.jsonl")
+            with f:
+                f.write("".join(lines).encode())
+            os.replace(tmp_file, self._index_file(field))
+        return field
+
+    def _append_index(self, doc_id, doc):
+        if not (self.path / "_index").exists():
+            return  # An index created from now on scans this document
+        with open(self.path / "_index" / ".lock", "a") as lock:
+            lock_file(lock, fcntl.LOCK_SH)
+            for field in self.list_indexes():
+                entry = [doc_id]
+                if doc is not None:
+                    value = get_path(doc, field)
+                    if value is not _missing:
+                        entry.append(value)
+                # One write per entry, so concurrent writers never interleave lines
+                with open(self._index_file(field), "a") as f:
+                    f.write(json.dumps(entry) + "\n")
+
+    def _read_index(self, field):
+        """Map of document ID to indexed value (the last entry of each ID wins)."""
+        values = {}
+        with open(self._index_file(field), "r") as f:
+            for line in f:
+                entry = json.loads(line)
+                if len(entry) == 2:
+                    values[entry[0]] = entry[1]
+                else:
+                    values.pop(entry[0], None)
+        return values
+
+    def _scan(self, query, stats=None):
+        """
+        Yield (file, document) of the documents matching `query`, reading only
+        the documents an index selects when one applies, or streaming through
+        every file.
+        """
+        plan = plan_query(query, self.list_indexes())
+        if plan.index is None:
+            files = self._files(query, stats)
+        else:
+            files = [
+                self._locate(doc_id)
+                for doc_id, value in self._read_index(plan.index).items()
+                if matches_condition(value, plan.bounds)
+            ]
+        if stats is not None:
+            stats["plan"] = plan.describe()
+        for file in files:
+            try:
+                doc = self._read(file)
+            except FileNotFoundError:
+                continue  # Deleted after the listing
+            if stats is not None:
+                stats["docs_examined"] += 1
+            if matches(doc, query):
+                yield file, doc
+
+    @traced("collection.explain")
+    def explain(self, query):
+        """Run `query` and report the plan used and the documents examined and returned."""
+        stats = {"plan": None, "docs_examined": 0}
+        returned = sum(1 for _ in self._scan(query, stats))
+        explanation = {
+            "plan": stats["plan"],
+            "docs_examined": stats["docs_examined"],
+            "docs_returned": returned,
+        }
+        if "shards" in stats:
+            explanation["shards_scanned"] = stats["shards"]
+        return explanation
+
+    def find_iter(self, query={}, document_class=None):
+        """
+        Yield the documents matching the query one at a time, converted by
+        `document_class` (e.g. `BenchmarkRecord.from_document`) if given.
+        """
+        for _, doc in self._scan(query):
+            yield doc if document_class is None else document_class(doc)
+
+    @traced("collection.find_one")
     def find_one(self, query):
-        """Find a document that matches ALL key-value pairs in the query."""
-        for file in self.path.glob("*.json"):
-            with open(file, "r") as f:
-                doc = json.load(f)
-                # Check if all key-value pairs in the query exist in the document
-                if all(doc.get(k) == v for k, v in query.items()):
-                    return doc  # Return the first matching document
-        return None  # No match found
+        """Find a document that matches the query."""
+        # None if no match found
+        return next((doc for _, doc in self._scan(query)), None)
 
+    @traced("collection.find_all")
     def find_all(self, query):
-        """Find all documents that match ALL key-value pairs in the query."""
-        matching_docs = []
-        for file in self.path.glob("*.json"):
-            with open(file, "r") as f:
-                doc = json.load(f)
-                # Check if all key-value pairs in the query exist in the document
-                if all(doc.get(k) == v for k, v in query.items()):
-                    matching_docs.append(doc)
-
-        return matching_docs  # Return all matching documents (empty list if no match)
+        """Find all documents that match the query."""
+        return [doc for _, doc in self._scan(query)]  # Empty list if no match
 
+    @traced("collection.find_most_recent_matching")
     def find_most_recent_matching(self, query):
         """Find the most recent document that matches ALL key-value pairs in the query."""
         most_recent_doc = None
         most_recent_time = datetime.min  # Start with the earliest possible datetime
 
-        for file in self.path.glob("*.json"):
-            with open(file, "r") as f:
-                doc = json.load(f)
-
-                # Check if the document matches the query
-                if not all(doc.get(k) == v for k, v in query.items()):
-                    continue  # Skip if it doesn't match
-
-                # Parse '_timestamp' if it exists
-                if "_timestamp" in doc:
-                    try:
-                        timestamp = datetime.fromisoformat(doc["_timestamp"])
-                        if timestamp > most_recent_time:
-                            most_recent_time = timestamp
-                            most_recent_doc = doc
-                    except ValueError:
-                        continue  # Skip invalid date formats
+        for _, doc in self._scan(query):
+            # Parse '_timestamp' if it exists
+            if "_timestamp" in doc:
+                try:
+                    timestamp = datetime.fromisoformat(doc["_timestamp"])
+                    if timestamp > most_recent_time:
+                        most_recent_time = timestamp
+                        most_recent_doc = doc
+                except ValueError:
+                    continue  # Skip invalid date formats
 
         return most_recent_doc  # Return the most recent matching document (or None if no match)
 
+    @traced("collection.find_most_recent_matching_set")
     def find_most_recent_matching_set(self, query={}):
         """Find the set of documents with the most recent '_timestamp' timestamp."""
         most_recent_docs = []
         most_recent_time = datetime.min
-        for file in self.path.glob("*.json"):
-            with open(file, "r") as f:
-                doc = json.load(f)
-                # Check if the document matches the query
-                if not all(doc.get(k) == v for k, v in query.items()):
-                    continue  # Skip if it doesn't match
-
-                if "_timestamp" in doc:
-                    # _timestamp is stored as an ISO string
-                    # e.g., "2025-03-14 16:15:30 UTC"
-                    timestamp_str = doc["_timestamp"].replace(" UTC", "")
-                    timestamp = datetime.strptime(timestamp_str, "%Y-%m-%d %H:%M:%S")
-                    # If later _timestamp found, then update most_recent_time and most_recent_docs
-                    if timestamp > most_recent_time:
-                        most_recent_time = timestamp
-                        most_recent_docs = [doc]
-                    # If same _timestamp found, then just append to most_recent_docs
-                    elif timestamp == most_recent_time:
-                        most_recent_docs.append(doc)
+        for _, doc in self._scan(query):
+            if "_timestamp" in doc:
+                # _timestamp is stored as an ISO string
+                # e.g., "2025-03-14 16:15:30 UTC"
+                timestamp_str = doc["_timestamp"].replace(" UTC", "")
+                timestamp = datetime.strptime(timestamp_str, "%Y-%m-%d %H:%M:%S")
+                # If later _timestamp found, then update most_recent_time and most_recent_docs
+                if timestamp > most_recent_time:
+                    most_recent_time = timestamp
+                    most_recent_docs = [doc]
+                # If same _timestamp found, then just append to most_recent_docs
+                elif timestamp == most_recent_time:
+                    most_recent_docs.append(doc)
         return most_recent_docs
 
-    def find(self):
-        """Return all documents in the collection."""
-        documents = []
-        for file in self.path.glob("*.json"):
-            with open(file, "r") as f:
-                documents.append(json.load(f))
-        return documents
-
+    @traced("collection.find")
+    def find(self, query={}, document_class=None):
+        """
+        Return all documents in the collection (matching the query, if given).
+        With `document_class`, every document is converted as it is read.
+        """
+        return list(self.find_iter(query, document_class))
+
+    @traced("collection.get")
+    def get(self, doc_id):
+        """Return the document with ID `doc_id`, or None."""
+        file = self._locate(doc_id)
+        if not file.exists():
+            return None
+        return self._read(file)
+
+    @traced("collection.put")
+    def put(self, doc_id, doc):
+        """Store `doc` as-is under `doc_id`, replacing any existing document."""
+        self._store(doc_id, doc)
+
+    @traced("collection.put_many")
+    def put_many(self, items):
+        """Store (ID, document) pairs as-is."""
+        for doc_id, doc in items:
+            self._store(doc_id, doc)
+
+    @traced("collection.recode")
+    def recode(self, doc_id, doc):
+        """
+        Store `doc` under `doc_id` like `put`, without recording a change:
+        for writing a document again with another codec (see `rewrite.py`).
+        """
+        self._store(doc_id, doc, record=False)
+
+    @traced("collection.get_state")
+    def get_state(self, key):
+        """Return the state object `key` kept alongside the documents, or None."""
+        file = self.path / "_state" / f"{key}.json"
+        if not file.exists():
+            return None
+        with open(file, "r") as f:
+            return json.load(f)
+
+    def list_states(self):
+        """List the keys of the state objects kept alongside the documents."""
+        return [file.stem for file in (self.path / "_state").glob("*.json")]
+
+    @traced("collection.set_state")
+    def set_state(self, key, value):
+        """Store a state object (e.g. incremental statistics) alongside the documents."""
+        (self.path / "_state").mkdir(exist_ok=True)
+        f, tmp_file = temporary_file(self.path / "_state", f"{key}.json")
+        with f:
+            f.write(json.dumps(value).encode())
+        os.replace(tmp_file, self.path / "_state" / f"{key}.json")
+
+    @traced("collection.update_state")
+    def update_state(self, key, update):
+        """
+        Replace the state object `key` with `update(state)` (None if there is
+        no state yet), holding a lock so concurrent updates are never lost.
+        Returns the new state.
+        """
+        (self.path / "_state").mkdir(exist_ok=True)
+        with open(self.path / "_state" / f".{key}.lock", "a") as lock:
+            lock_file(lock, fcntl.LOCK_EX)
+            value = update(self.get_state(key))
+            self.set_state(key, value)
+        return value
+
+    @traced("collection.find_latest")
+    def find_latest(self):
+        """Return the most recently inserted document (highest numeric ID), or None."""
+        files = list(self.path.glob("*.json"))
+        if self.sharded:
+            shards = [d for d in self._shards() if d.name.isdigit()]
+            if shards:
+                files += shards[-1].glob("*.json")
+        files = [file for file in files if file.stem.isdigit()]
+        if not files:
+            return None
+        return self._read(max(files, key=lambda file: int(file.stem)))
+
+    @traced("collection.delete_one")
     def delete_one(self, query):
         """Delete a document by a simple key-value pair."""
-        for file in self.path.glob("*.json"):
-            with open(file, "r") as f:
-                doc = json.load(f)
-                if all(doc.get(k) == v for k, v in query.items()):
-                    file.unlink()  # Delete the file
-                    return {"deleted_count": 1}
+        for file, _ in self._scan(query):
+            file.unlink()  # Delete the file
+            self._append_index(file.stem, None)
+            append_change(self.path, "delete", file.stem)
+            return {"deleted_count": 1}
         return {"deleted_count": 0}
 
+    @traced("collection.list_documents")
     def list_documents(self):
         """List all document filenames in the collection."""
-        return [file.name for file in self.path.glob("*.json")]
+        return [file.name for file in self._files()]
+
+    def watch(self, resume_after=None, poll_interval=1.0):
+        """Change stream of the collection (see `locodb/watch.py`)."""
+        return DirectoryChangeStream(
+            Database(self.path.parent, self.codec, self.layout),
+            [self.path.name],
+            resume_after,
+            poll_interval,
+        )
 
 
 # Example Usage
@@ -0,0 +1,27 @@
+# Storage engines implementing the LocoDatabase API.
+
+from locodb import directorydb, snapshot, sqlitedb
+
+engines = {
+    # cluster/<hostname>/gpu-<GUID>/<N>.json
+    "directory": directorydb.LocoDatabase,
+    # a single SQLite file
+    "sqlite": sqlitedb.LocoDatabase,
+    # a single-file snapshot, read-only
+    "snapshot": snapshot.SnapshotDatabase,
+}
+
+# Engines that can be written to, for the commands storing documents
+writable_engines = ["directory", "sqlite"]
+
+
+def open_database(path, engine="directory", codec=None):
+    """
+    Open the LocoDatabase at `path` with the storage engine `engine`, writing
+    documents with `codec` (a `locodb.codec.Codec`, compact JSON by default).
+    """
+    if engine not in engines:
+        raise ValueError(
+            f"Unknown storage engine: {engine} (expected one of {', '.join(engines)})"
+        )
+    return engines[engine](path, codec=codec)
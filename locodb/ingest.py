@@ -0,0 +1,149 @@
+# Merges spool files (see `locodb/spool.py`) into a LocoDatabase.
+#
+# Each spool is claimed by renaming it, so several ingesters can share a
+# spool directory. Documents whose `meta.run_id` is already in the target
+# collection are skipped, so a spool ingested twice (e.g. after a crash
+# between inserting and removing it) is only stored once. A `prepare` hook
+# can complete every batch of new documents before they are inserted (the
+# health checks get their degradation verdict from `ingest.py` this way).
+
+import argparse
+import os
+import socket
+import time
+from pathlib import Path
+
+from locodb.codec import codec_choices, parse_codec
+from locodb.engines import open_database, writable_engines
+from locodb.spool import read_spool
+
+
+def ingest_records(client, records, batch_size=1000, prepare=None):
+    """
+    Insert spooled records, skipping documents already in the database.
+    `prepare(collection, docs)` is called on every batch of new documents
+    before they are inserted.
+    Returns the number of documents inserted and skipped.
+    """
+    groups = {}
+    for record in records:
+        key = (record["database"], record["collection"])
+        groups.setdefault(key, []).append(record["document"])
+
+    inserted = skipped = 0
+    for (db_name, collection_name), docs in groups.items():
+        collection = client[db_name][collection_name]
+        collection.create_index("meta.run_id")
+        for start in range(0, len(docs), batch_size):
+            batch = docs[start : start + batch_size]
+            run_ids = [doc["meta"]["run_id"] for doc in batch]
+            seen = {
+                doc["meta"]["run_id"]
+                for doc in collection.find({"meta.run_id": {"$in": run_ids}})
+            }
+            new_docs = []
+            for doc in batch:
+                if doc["meta"]["run_id"] in seen:
+                    skipped += 1
+                else:
+                    seen.add(doc["meta"]["run_id"])
+                    new_docs.append(doc)
+            if new_docs:
+                if prepare is not None:
+                    prepare(collection, new_docs)
+                collection.insert_many(new_docs)
+                inserted += len(new_docs)
+    return inserted, skipped
+
+
+def pending_spools(spool_dir, stale_after):
+    """
+    Spools ready for ingestion: closed spools, plus spools left open by a job
+    or claimed by an ingester that have not changed for `stale_after` seconds.
+    """
+    now = time.time()
+    spools = sorted(Path(spool_dir).glob("*.jsonl"))
+    for pattern in ["*.jsonl.open", "*.jsonl.ingesting-*"]:
+        for path in sorted(Path(spool_dir).glob(pattern)):
+            try:
+                if now - path.stat().st_mtime > stale_after:
+                    spools.append(path)
+            except FileNotFoundError:
+                continue
+    return spools
+
+
+def ingest_spools(client, spool_dir, stale_after=3600, batch_size=1000, prepare=None):
+    """
+    Ingest every pending spool of `spool_dir` once.
+    Returns the number of documents inserted and skipped.
+    """
+    inserted = skipped = 0
+    for path in pending_spools(spool_dir, stale_after):
+        name = path.name.split(".jsonl")[0]
+        claimed = path.with_name(
+            f"{name}.jsonl.ingesting-{socket.gethostname()}-{os.getpid()}"
+        )
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            continue  # Claimed by another ingester
+        counts = ingest_records(client, read_spool(claimed), batch_size, prepare)
+        inserted += counts[0]
+        skipped += counts[1]
+        claimed.unlink()
+    return inserted, skipped
+
+
+def main(prepare=None):
+    """
+    Command line of ingestion. Applications pass their `prepare` hook (see
+    `ingest_records`), e.g. `ingest.py` at the top of the repository adds
+    the degradation verdicts.
+    """
+    parser = argparse.ArgumentParser(
+        description="Merge spooled results into a LocoDatabase."
+    )
+    parser.add_argument("spool_dir", type=str, help="Directory of the spool files.")
+    parser.add_argument(
+        "--db", type=str, default="cluster", help="Path of the cluster database."
+    )
+    parser.add_argument(
+        "--engine", type=str, default="directory", choices=writable_engines
+    )
+    parser.add_argument("--codec", type=str, default="json", choices=codec_choices)
+    parser.add_argument(
+        "--omit-stats",
+        action="store_true",
+        help="Do not store the `stats` block of the ingested documents.",
+    )
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument(
+        "--stale-after",
+        type=float,
+        default=3600,
+        help="Seconds after which an unclosed or unfinished spool is ingested anyway.",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keep running, ingesting new spools every --interval seconds.",
+    )
+    parser.add_argument("--interval", type=float, default=30)
+    args = parser.parse_args()
+
+    codec = parse_codec(args.codec, ["stats"] if args.omit_stats else [])
+    client = open_database(args.db, args.engine, codec)
+    while True:
+        inserted, skipped = ingest_spools(
+            client, args.spool_dir, args.stale_after, args.batch_size, prepare
+        )
+        if inserted or skipped:
+            print(f"Inserted {inserted} documents, skipped {skipped} duplicates.")
+        if not args.daemon:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# Copies every document of a LocoDatabase to another one, e.g. from the
+# directory layout to SQLite. Document IDs and metadata are kept as-is, and
+# so are the states stored with each collection (e.g. the degradation
+# charts and rescoring checkpoints).
+
+import argparse
+
+from locodb.engines import engines, open_database, writable_engines
+
+
+def migrate(source, destination):
+    """
+    Copy all databases, collections, documents and states from `source` to
+    `destination`. Returns the number of documents copied.
+    """
+    copied = 0
+    for db_name in source.list_databases():
+        source_database = source[db_name]
+        destination_database = destination[db_name]
+        for collection_name in source_database.list_collections():
+            source_collection = source_database[collection_name]
+            destination_collection = destination_database[collection_name]
+            doc_ids = [
+                name.rsplit(".", 1)[0] for name in source_collection.list_documents()
+            ]
+            destination_collection.put_many(
+                (doc_id, source_collection.get(doc_id)) for doc_id in doc_ids
+            )
+            copied += len(doc_ids)
+            for key in source_collection.list_states():
+                destination_collection.set_state(key, source_collection.get_state(key))
+    return copied
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Copy a LocoDatabase to another storage engine."
+    )
+    parser.add_argument("source", type=str, help="Path of the database to copy.")
+    parser.add_argument("destination", type=str, help="Path of the new database.")
+    parser.add_argument(
+        "--from", dest="source_engine", default="directory", choices=list(engines)
+    )
+    parser.add_argument(
+        "--to", dest="destination_engine", default="sqlite", choices=writable_engines
+    )
+    args = parser.parse_args()
+
+    copied = migrate(
+        open_database(args.source, args.source_engine),
+        open_database(args.destination, args.destination_engine),
+    )
+    print(f"Copied {copied} documents from {args.source} to {args.destination}.")
+
+
+if __name__ == "__main__":
+    main()
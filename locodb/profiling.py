@@ -0,0 +1,148 @@
+# Lightweight timing spans and counters.
+#
+# A `Tracer` is made active with `set_tracer`; instrumented code calls
+# `get_tracer()` and records into it. When no tracer is active the calls go
+# to a `NullTracer` and cost next to nothing.
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+
+class Tracer:
+    """Records timed spans and counters, exportable as a Chrome trace."""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.events = []
+        self.counters = defaultdict(int)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **args):
+        """Time the body of a `with` block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self.events.append(
+                    {
+                        "name": name,
+                        "start": start - self.origin,
+                        "duration": end - start,
+                        "tid": threading.get_ident(),
+                        "args": args,
+                    }
+                )
+
+    def count(self, name, value=1):
+        """Add `value` to the counter `name`."""
+        with self._lock:
+            self.counters[name] += value
+
+    def summary(self):
+        """
+        Total seconds spent in each span name, and the counters.
+        Nested spans are included in their parent's total as well as their own.
+        """
+        spans = defaultdict(float)
+        calls = defaultdict(int)
+        for event in self.events:
+            spans[event["name"]] += event["duration"]
+            calls[event["name"]] += 1
+        return {
+            "spans": {
+                name: {"seconds": round(seconds, 6), "calls": calls[name]}
+                for name, seconds in spans.items()
+            },
+            "counters": dict(self.counters),
+        }
+
+    def chrome_trace(self):
+        """Events in the Chrome trace format (chrome://tracing, Perfetto)."""
+        pid = os.getpid()
+        trace_events = [
+            {
+                "name": event["name"],
+                "ph": "X",
+                "ts": event["start"] * 1e6,
+                "dur": event["duration"] * 1e6,
+                "pid": pid,
+                "tid": event["tid"],
+                "args": event["args"],
+            }
+            for event in self.events
+        ]
+        end = max((e["start"] + e["duration"] for e in self.events), default=0.0)
+        trace_events.append(
+            {
+                "name": "counters",
+                "ph": "C",
+                "ts": end * 1e6,
+                "pid": pid,
+                "args": dict(self.counters),
+            }
+        )
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f)
+
+
+class NullTracer:
+    """Tracer used when none is active. Records nothing."""
+
+    @contextmanager
+    def span(self, name, **args):
+        yield
+
+    def count(self, name, value=1):
+        pass
+
+
+_null_tracer = NullTracer()
+_active_tracer = None
+
+
+def get_tracer():
+    """Return the active tracer, or a tracer that records nothing."""
+    return _active_tracer or _null_tracer
+
+
+def set_tracer(tracer):
+    """Make `tracer` the active tracer (None to disable). Returns the previous one."""
+    global _active_tracer
+    previous = _active_tracer
+    _active_tracer = tracer
+    return previous
+
+
+@contextmanager
+def active_tracer(tracer):
+    """Make `tracer` the active tracer in a `with` block, even if it raises."""
+    previous = set_tracer(tracer)
+    try:
+        yield tracer
+    finally:
+        set_tracer(previous)
+
+
+def traced(name):
+    """Decorator recording every call of the function as a span."""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with get_tracer().span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
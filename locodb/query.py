@@ -0,0 +1,138 @@
+# Mongo-style queries on documents, and the choice of index to answer them.
+#
+# A query maps dotted paths (e.g. "metrics.HBM BW.mean") to either a value
+# (equality) or a dictionary of operators:
+#   {"metrics.HBM BW.mean": {"$lt": 3500}, "meta.timestamp": {"$gte": "2025-06-01"}}
+# Supported operators: $eq, $ne, $gt, $gte, $lt, $lte, $in, $nin, $exists,
+# and the top-level $and / $or with a list of queries.
+
+import re
+
+# Operators an index can answer, by narrowing the documents to examine
+index_operators = ["$eq", "$in", "$gt", "$gte", "$lt", "$lte"]
+
+_missing = object()
+
+
+def get_path(doc, path):
+    """Value at the dotted `path` of `doc`, or `_missing`."""
+    value = doc
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return _missing
+        value = value[key]
+    return value
+
+
+def is_operator_dict(condition):
+    return (
+        isinstance(condition, dict)
+        and len(condition) > 0
+        and all(key.startswith("$") for key in condition)
+    )
+
+
+def _compare(value, op, operand):
+    try:
+        if op == "$gt":
+            return value > operand
+        if op == "$gte":
+            return value >= operand
+        if op == "$lt":
+            return value < operand
+        if op == "$lte":
+            return value <= operand
+    except TypeError:
+        return False  # Values of different types never match a range
+
+
+def matches_condition(value, condition):
+    """Whether `value` (possibly `_missing`) satisfies one field's condition."""
+    if not is_operator_dict(condition):
+        condition = {"$eq": condition}
+    for op, operand in condition.items():
+        if op == "$exists":
+            if (value is not _missing) != bool(operand):
+                return False
+            continue
+        if op in ("$eq", "$ne", "$in", "$nin"):
+            # A missing field compares equal to None, as in `doc.get(k) == v`
+            present = None if value is _missing else value
+            if op == "$eq" and not present == operand:
+                return False
+            if op == "$ne" and present == operand:
+                return False
+            if op == "$in" and present not in operand:
+                return False
+            if op == "$nin" and present in operand:
+                return False
+            continue
+        if op in ("$gt", "$gte", "$lt", "$lte"):
+            if value is _missing or not _compare(value, op, operand):
+                return False
+            continue
+        raise ValueError(f"Unsupported query operator: {op}")
+    return True
+
+
+def matches(doc, query):
+    """Whether `doc` matches ALL the conditions of `query`."""
+    for key, condition in query.items():
+        if key == "$and":
+            if not all(matches(doc, sub_query) for sub_query in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(doc, sub_query) for sub_query in condition):
+                return False
+        elif not matches_condition(get_path(doc, key), condition):
+            return False
+    return True
+
+
+class Plan:
+    """How to answer a query: scan an index on `index` within `bounds`, or scan every document."""
+
+    def __init__(self, index=None, bounds=None):
+        self.index = index
+        self.bounds = bounds or {}
+
+    def describe(self):
+        if self.index is None:
+            return "COLLSCAN"
+        return f"IXSCAN {self.index} {self.bounds}"
+
+
+def plan_query(query, indexes):
+    """
+    Choose the index among `indexes` (dotted paths) that narrows `query` the most.
+    Equality ($eq, $in) beats a range; without a usable index the collection is scanned.
+    """
+    best, best_rank = Plan(), 0
+    for field in indexes:
+        if field not in query:
+            continue
+        condition = query[field]
+        if not is_operator_dict(condition):
+            condition = {"$eq": condition}
+        bounds = {op: v for op, v in condition.items() if op in index_operators}
+        if not bounds:
+            continue
+        if ("$eq" in bounds and bounds["$eq"] is None) or None in bounds.get("$in", []):
+            # A missing field equals None, but documents without the field
+            # are not in the index
+            continue
+        rank = 2 if ("$eq" in bounds or "$in" in bounds) else 1
+        if rank > best_rank:
+            best, best_rank = Plan(field, bounds), rank
+    return best
+
+
+def json_path(field):
+    """SQLite JSON path of a dotted field, e.g. "meta.timestamp" -> "$.meta.timestamp"."""
+    parts = []
+    for key in field.split("."):
+        if re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", key):
+            parts.append(key)
+        else:
+            parts.append('"' + key.replace('"', '""') + '"')
+    return "$." + ".".join(parts)
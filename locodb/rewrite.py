@@ -0,0 +1,105 @@
+# Rewrites every document of a LocoDatabase with another codec (see
+# `codec.py`), e.g. to compress an existing directory database:
+#
+#   python -m locodb.rewrite cluster --codec json+zstd --omit-stats
+#
+# Documents are replaced one at a time with an atomic rename, so readers
+# and writers can keep using the database during the rewrite, and an
+# interrupted rewrite can simply be run again. Their content does not
+# change, so no change is recorded: consumers of the change streams (e.g.
+# `export_parquet.py`) do not read the whole history again.
+#
+# With --omit-stats the rewritten documents lose their `stats` block for
+# good: nothing recomputes it, so `export_prometheus.py` has no
+# gpu_metric_zscore gauges for them, and the z_score columns of the
+# documents exported to Parquet from then on are empty.
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from locodb.codec import codec_choices, parse_codec
+from locodb.engines import open_database, writable_engines
+
+
+def disk_usage(path):
+    """Bytes allocated on disk to the file or directory tree at `path`."""
+    path = Path(path)
+    if path.is_file():
+        return path.stat().st_blocks * 512
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.stat(os.path.join(root, name)).st_blocks * 512
+            except FileNotFoundError:
+                continue
+    return total
+
+
+def rewrite_node(db_path, engine, codec_spec, omit, hostname):
+    """Rewrite every document of one database. Returns the number of documents."""
+    client = open_database(db_path, engine, parse_codec(codec_spec, omit))
+    database = client[hostname]
+    rewritten = 0
+    for collection_name in database.list_collections():
+        collection = database[collection_name]
+        for name in collection.list_documents():
+            doc_id = name.rsplit(".", 1)[0]
+            doc = collection.get(doc_id)
+            if doc is None:
+                continue  # Deleted after the listing
+            collection.recode(doc_id, doc)
+            rewritten += 1
+    return rewritten
+
+
+def _rewrite_node(task):
+    return rewrite_node(*task)
+
+
+def rewrite(db_path, engine, codec_spec, omit=(), workers=None):
+    """Rewrite the whole database, one node per task. Returns the number of documents."""
+    hostnames = sorted(open_database(db_path, engine).list_databases())
+    tasks = [(db_path, engine, codec_spec, list(omit), hostname) for hostname in hostnames]
+    with ProcessPoolExecutor(workers) as executor:
+        return sum(executor.map(_rewrite_node, tasks))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Rewrite every document of a LocoDatabase with another codec."
+    )
+    parser.add_argument("db", type=str, help="Path of the database to rewrite.")
+    parser.add_argument(
+        "--engine", type=str, default="directory", choices=writable_engines
+    )
+    parser.add_argument("--codec", type=str, default="json", choices=codec_choices)
+    parser.add_argument(
+        "--omit-stats",
+        action="store_true",
+        help="Leave out the `stats` block: no z-scores are exported for the documents.",
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    omit = ["stats"] if args.omit_stats else []
+    if omit:
+        print(
+            "Warning: the z-scores of the `stats` blocks are dropped; they will be"
+            " missing from the Prometheus and Parquet exports."
+        )
+    before = disk_usage(args.db)
+    rewritten = rewrite(args.db, args.engine, args.codec, omit, args.workers)
+    after = disk_usage(args.db)
+    print(
+        f"Rewrote {rewritten} documents as {args.codec}: "
+        f"{before / 2**20:.1f} MiB -> {after / 2**20:.1f} MiB"
+    )
+    if args.engine == "sqlite":
+        print("(the SQLite file only shrinks after a VACUUM)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+# Sharded layout of the directory engine.
+#
+# In the default "flat" layout every document of a collection is a file in
+# the collection directory, which becomes slow to list (glob, iterdir) on
+# Lustre/NFS once it holds tens of thousands of entries. In the "sharded"
+# layout documents are spread over fan-out subdirectories by ID:
+#   cluster/<hostname>/gpu-<GUID>/<ID // shard_size>/<ID>.json
+# (IDs that are not numbers go to `h<2 hex digits of their hash>/`). Since
+# IDs grow with time, each shard also covers a time range: the timestamp of
+# every document written is appended to the collection's `_shards.jsonl`,
+# so scans with a condition on `meta.timestamp` skip the shards out of range.
+#
+# The layout applies to the whole database and is stored in its
+# `_layout.json`. Documents left in the collection directory (e.g. while
+# migrating) are still read, so a database can be migrated while in use:
+#
+#   python -m locodb.sharding cluster --layout sharded --shard-size 1000
+
+import argparse
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from locodb.query import is_operator_dict
+
+layouts = ["flat", "sharded"]
+layout_file = "_layout.json"
+shard_log = "_shards.jsonl"
+
+
+def load_layout(base_path):
+    """Layout of the database at `base_path` ({"layout": "flat"} by default)."""
+    file = Path(base_path) / layout_file
+    if not file.exists():
+        return {"layout": "flat"}
+    with open(file, "r") as f:
+        return json.load(f)
+
+
+def save_layout(base_path, layout):
+    file = Path(base_path) / layout_file
+    tmp_file = file.with_name(f".{layout_file}.{os.getpid()}.tmp")
+    with open(tmp_file, "w") as f:
+        json.dump(layout, f)
+    os.replace(tmp_file, file)
+
+
+def shard_name(doc_id, shard_size):
+    """Shard of a document, e.g. ("12345", 1000) -> "12"."""
+    if str(doc_id).isdigit():
+        return str(int(doc_id) // shard_size)
+    return "h" + hashlib.sha1(str(doc_id).encode()).hexdigest()[:2]
+
+
+def is_shard(name):
+    return name.isdigit() or (len(name) == 3 and name[0] == "h")
+
+
+def shard_ranges(collection_path):
+    """Map of shard to the [earliest, latest] timestamp written to it."""
+    ranges = {}
+    try:
+        with open(Path(collection_path) / shard_log, "r") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    break  # Still being written
+                shard, timestamp = json.loads(line)
+                if shard not in ranges:
+                    ranges[shard] = [timestamp, timestamp]
+                else:
+                    ranges[shard][0] = min(ranges[shard][0], timestamp)
+                    ranges[shard][1] = max(ranges[shard][1], timestamp)
+    except FileNotFoundError:
+        pass
+    return ranges
+
+
+def append_shard_timestamp(collection_path, shard, doc):
+    timestamp = doc.get("meta", {}).get("timestamp")
+    if not isinstance(timestamp, str):
+        return  # The shard is never skipped
+    # One write per entry, so concurrent writers never interleave lines
+    with open(Path(collection_path) / shard_log, "a") as f:
+        f.write(json.dumps([shard, timestamp]) + "\n")
+
+
+def shard_may_match(time_range, condition):
+    """Whether a shard whose timestamps lie in `time_range` may hold a match of `condition`."""
+    if time_range is None:
+        return True  # Nothing known about the shard
+    earliest, latest = time_range
+    if not is_operator_dict(condition):
+        condition = {"$eq": condition}
+    for op, operand in condition.items():
+        operands = operand if op == "$in" else [operand]
+        if not all(isinstance(value, str) for value in operands):
+            continue
+        if op == "$gt" and not latest > operand:
+            return False
+        if op == "$gte" and not latest >= operand:
+            return False
+        if op == "$lt" and not earliest < operand:
+            return False
+        if op == "$lte" and not earliest <= operand:
+            return False
+        if op in ("$eq", "$in") and not any(earliest <= v <= latest for v in operands):
+            return False
+    return True
+
+
+def _move(source, destination):
+    # Linked then unlinked rather than renamed, so a newer version written
+    # to the destination by a concurrent writer is never overwritten
+    destination.parent.mkdir(exist_ok=True)
+    try:
+        os.link(source, destination)
+    except FileExistsError:
+        pass
+    source.unlink()
+
+
+def shard_collection(collection):
+    """Move the documents left in the collection directory into their shards."""
+    # Highest IDs first: writers allocate IDs after the highest one in the shards
+    files = sorted(
+        collection.path.glob("*.json"),
+        key=lambda file: int(file.stem) if file.stem.isdigit() else -1,
+        reverse=True,
+    )
+    for file in files:
+        try:
+            doc = collection._read(file)
+        except FileNotFoundError:
+            continue
+        shard = shard_name(file.stem, collection.layout["shard_size"])
+        _move(file, collection.path / shard / file.name)
+        append_shard_timestamp(collection.path, shard, doc)
+    return len(files)
+
+
+def unshard_collection(collection):
+    """Move the documents of every shard back into the collection directory."""
+    moved = 0
+    shards = sorted(
+        (d for d in collection.path.iterdir() if d.is_dir() and is_shard(d.name)),
+        key=lambda d: int(d.name) if d.name.isdigit() else -1,
+    )
+    # Lowest IDs first, so the highest shard is still there for writers
+    for shard in shards:
+        for file in shard.glob("*.json"):
+            _move(file, collection.path / file.name)
+            moved += 1
+        shard.rmdir()
+    (collection.path / shard_log).unlink(missing_ok=True)
+    return moved
+
+
+def reshard(base_path, layout, shard_size=1000):
+    """
+    Convert the whole database at `base_path` to `layout`. Returns the number
+    of documents moved. Writers opened before the conversion to the flat
+    layout keep writing to the shards until they reopen the database;
+    running the conversion again moves the documents they wrote. (Writers
+    of a flat database follow a conversion to shards at their next write.)
+    """
+    # Not at the top: the directory engine imports this module
+    from locodb.directorydb import LocoDatabase
+
+    moved = 0
+    current = load_layout(base_path)
+    if layout == "sharded":
+        if current["layout"] == "sharded" and current["shard_size"] != shard_size:
+            raise ValueError(
+                f"{base_path} already has shards of {current['shard_size']} documents;"
+                " convert it to the flat layout first."
+            )
+        # Writers opened from now on use the shards; documents not moved
+        # yet are still found in the collection directories
+        save_layout(base_path, {"layout": "sharded", "shard_size": shard_size})
+        client = LocoDatabase(base_path)
+        for db_name in client.list_databases():
+            for collection_name in client[db_name].list_collections():
+                moved += shard_collection(client[db_name][collection_name])
+    else:
+        # Documents are moved while the database is still sharded, since
+        # the flat layout only reads the collection directories
+        client = LocoDatabase(base_path)
+        for db_name in client.list_databases():
+            for collection_name in client[db_name].list_collections():
+                moved += unshard_collection(client[db_name][collection_name])
+        save_layout(base_path, {"layout": "flat"})
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert a directory database to another layout, in place."
+    )
+    parser.add_argument("db", type=str, help="Path of the cluster database.")
+    parser.add_argument("--layout", type=str, default="sharded", choices=layouts)
+    parser.add_argument(
+        "--shard-size", type=int, default=1000, help="Documents per shard."
+    )
+    args = parser.parse_args()
+    moved = reshard(args.db, args.layout, args.shard_size)
+    print(f"Moved {moved} documents; {args.db} now has the {args.layout} layout.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,642 @@
+# Single-file snapshots of a LocoDatabase.
+#
+# Copying a directory database means copying one small file per result,
+# which is very slow on shared and object storage. A snapshot streams the
+# documents (all of them, or those of some hosts, GUIDs or time range) into
+# one archive:
+#
+#   LOCOSNAP\x01 | frame | frame | ... | index | index offset, length | LOCOSNAP
+#
+# Every frame is the zstd (or gzip) compressed JSON lines of up to
+# `frame_size` bytes of documents of one collection, compressed on its own
+# so any document can be read by decompressing a single frame. The index
+# (compressed JSON) locates every document in its frame, records the time
+# range of every frame, so queries on `meta.timestamp` skip the frames out
+# of range, and holds the state objects and index fields of every collection.
+#
+# An incremental snapshot is taken against a previous one (its base): it
+# holds only the documents added or changed since, by content hash, and the
+# IDs of those deleted. A snapshot is opened read-only as a LocoDatabase
+# through its chain of bases, without extracting it, e.g. with the
+# "snapshot" engine, and can be restored into any other engine:
+#
+#   python -m locodb.snapshot export cluster -o cluster.locosnap
+#   python -m locodb.snapshot export cluster -o cluster-2.locosnap --base cluster.locosnap
+#   python -m locodb.snapshot restore cluster-2.locosnap restored --engine directory
+#   python benchmark_gpus.py ... / python dashboard.py --db cluster-2.locosnap --engine snapshot
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import struct
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+
+from locodb.codec import Codec
+from locodb.profiling import get_tracer, traced
+from locodb.query import matches, plan_query
+from locodb.sharding import shard_may_match
+from locodb.utility import get_timestamp, id_key
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+magic = b"LOCOSNAP"
+header = magic + b"\x01"
+trailer = struct.Struct("<QQ8s")  # index offset, index length, magic
+compressions = ["zstd", "gzip"]
+
+
+def _compress(data, compression, level):
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return gzip.compress(data, compresslevel=min(level, 9))
+
+
+def _decompress(data, compression):
+    if compression == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def _check_compression(compression):
+    if compression not in compressions:
+        raise ValueError(f"Unknown compression: {compression}")
+    if compression == "zstd" and zstandard is None:
+        raise ImportError(
+            "zstd snapshots require zstandard (pip install zstandard);"
+            " use --compression gzip otherwise."
+        )
+
+
+def content_hash(doc):
+    """Hash of a document, to find the documents changed since a snapshot."""
+    data = json.dumps(doc, sort_keys=True, separators=(",", ":")).encode()
+    return hashlib.sha1(data).hexdigest()[:16]
+
+
+def read_index(path):
+    """The index of the snapshot at `path`."""
+    with open(path, "rb") as f:
+        if f.read(len(header)) != header:
+            raise ValueError(f"{path} is not a LocoDatabase snapshot")
+        f.seek(-trailer.size, os.SEEK_END)
+        offset, length, end_magic = trailer.unpack(f.read(trailer.size))
+        if end_magic != magic:
+            raise ValueError(f"{path} is incomplete (no index)")
+        f.seek(offset)
+        compressed = f.read(length)
+    # The compression is not known before the index is read
+    compression = "zstd" if compressed[:4] == b"\x28\xb5\x2f\xfd" else "gzip"
+    return json.loads(_decompress(compressed, compression))
+
+
+class SnapshotWriter:
+    """Writes the frames and index of a new snapshot."""
+
+    def __init__(self, path, compression="zstd", level=3, frame_size=1 << 20):
+        _check_compression(compression)
+        self.path = Path(path)
+        self.compression = compression
+        self.level = level
+        self.frame_size = frame_size
+        # Written next to the final file and renamed when complete
+        self.tmp_file = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        self.file = open(self.tmp_file, "wb")
+        self.file.write(header)
+        self.frames = []
+        self._lines = []
+        self._entries = []  # Locations of the documents of the current frame
+        self._size = 0
+        self._range = None
+
+    def add(self, entries, doc_id, doc, digest):
+        """Add a document; its location is stored in `entries[doc_id]`."""
+        line = json.dumps(doc, separators=(",", ":")).encode() + b"\n"
+        timestamp = doc.get("meta", {}).get("timestamp")
+        self._entries.append(
+            (entries, doc_id, self._size, len(line), digest, timestamp)
+        )
+        self._lines.append(line)
+        self._size += len(line)
+        if isinstance(timestamp, str):
+            if self._range is None:
+                self._range = [timestamp, timestamp]
+            else:
+                self._range = [
+                    min(self._range[0], timestamp),
+                    max(self._range[1], timestamp),
+                ]
+        if self._size >= self.frame_size:
+            self.flush()
+
+    def flush(self):
+        """End the current frame (e.g. at the end of a collection)."""
+        if not self._lines:
+            return
+        data = _compress(b"".join(self._lines), self.compression, self.level)
+        frame = len(self.frames)
+        self.frames.append(
+            [self.file.tell(), len(data)] + (self._range or [None, None])
+        )
+        self.file.write(data)
+        for entries, doc_id, offset, length, digest, timestamp in self._entries:
+            entries[doc_id] = [frame, offset, length, digest, timestamp]
+        self._lines, self._entries, self._size, self._range = [], [], 0, None
+
+    def close(self, index):
+        """Write the index and move the snapshot in place."""
+        self.flush()
+        index["compression"] = self.compression
+        index["frames"] = self.frames
+        data = _compress(json.dumps(index).encode(), self.compression, self.level)
+        offset = self.file.tell()
+        self.file.write(data)
+        self.file.write(trailer.pack(offset, len(data), magic))
+        self.file.close()
+        os.replace(self.tmp_file, self.path)
+
+    def abort(self):
+        self.file.close()
+        self.tmp_file.unlink(missing_ok=True)
+
+
+def export_snapshot(
+    client,
+    path,
+    hosts=None,
+    guids=None,
+    since=None,
+    until=None,
+    base=None,
+    compression="zstd",
+    level=3,
+    frame_size=1 << 20,
+):
+    """
+    Write the documents of `client` (any LocoDatabase) to a snapshot at
+    `path`: those of the databases in `hosts`, the collections gpu-<GUID>
+    of `guids` and with a `meta.timestamp` in [since, until) if given.
+    With `base` (the path of a previous snapshot), only the changes since
+    are written. Returns the numbers of documents written and deleted.
+    """
+    query = {}
+    if since is not None or until is not None:
+        condition = {}
+        if since is not None:
+            condition["$gte"] = since
+        if until is not None:
+            condition["$lt"] = until
+        query["meta.timestamp"] = condition
+    base_view = None
+    if base is not None:
+        base_view = SnapshotDatabase(base)
+
+    index = {
+        "format": 1,
+        "snapshot_id": uuid.uuid4().hex,
+        "created": get_timestamp(),
+        "filter": {"hosts": hosts, "guids": guids, "since": since, "until": until},
+        "base": None,
+        "databases": {},
+    }
+    if base_view is not None:
+        # Stored relative to the new snapshot, so both can be moved together
+        base_path = os.path.relpath(Path(base).resolve(), Path(path).resolve().parent)
+        index["base"] = {"path": base_path, "snapshot_id": base_view.snapshot_id}
+
+    writer = SnapshotWriter(path, compression, level, frame_size)
+    written = deleted = 0
+    guid_collections = {f"gpu-{guid}" for guid in guids or []}
+    exported = set()
+    try:
+        for db_name in sorted(client.list_databases()):
+            if hosts and db_name not in hosts:
+                continue
+            for collection_name in sorted(client[db_name].list_collections()):
+                if guids and collection_name not in guid_collections:
+                    continue
+                exported.add((db_name, collection_name))
+                collection = client[db_name][collection_name]
+                known = {}
+                if base_view is not None:
+                    known = base_view._entries(db_name, collection_name)
+                entries = {}
+                doc_ids = sorted(
+                    (name.rsplit(".", 1)[0] for name in collection.list_documents()),
+                    key=id_key,
+                )
+                for doc_id in doc_ids:
+                    doc = collection.get(doc_id)
+                    if doc is None or not matches(doc, query):
+                        continue
+                    digest = content_hash(doc)
+                    if doc_id in known and known[doc_id][1][3] == digest:
+                        continue  # Unchanged since the base
+                    writer.add(entries, doc_id, doc, digest)
+                    written += 1
+                writer.flush()
+                # Deleted since the base (among the documents in range)
+                current = set(doc_ids)
+                removed = [
+                    doc_id
+                    for doc_id, (_, entry) in known.items()
+                    if doc_id not in current
+                    and matches({"meta": {"timestamp": entry[4]}}, query)
+                ]
+                deleted += len(removed)
+                index["databases"].setdefault(db_name, {})[collection_name] = {
+                    "docs": entries,
+                    "deleted": removed,
+                    "states": {
+                        key: collection.get_state(key)
+                        for key in collection.list_states()
+                    },
+                    "indexes": collection.list_indexes(),
+                }
+        if base_view is not None:
+            # Collections (and hosts) of the base removed since
+            for db_name in base_view.list_databases():
+                if hosts and db_name not in hosts:
+                    continue
+                for collection_name in base_view._collections(db_name):
+                    if guids and collection_name not in guid_collections:
+                        continue
+                    if (db_name, collection_name) in exported:
+                        continue
+                    removed = [
+                        doc_id
+                        for doc_id, (_, entry) in base_view._entries(
+                            db_name, collection_name
+                        ).items()
+                        if matches({"meta": {"timestamp": entry[4]}}, query)
+                    ]
+                    deleted += len(removed)
+                    index["databases"].setdefault(db_name, {})[collection_name] = {
+                        "docs": {},
+                        "deleted": removed,
+                        # Documents out of the time range are not known to be gone
+                        "dropped": not query,
+                        "states": {},
+                        "indexes": [],
+                    }
+        writer.close(index)
+    except BaseException:
+        writer.abort()
+        raise
+    return {"written": written, "deleted": deleted}
+
+
+class SnapshotDatabase:
+    """
+    A snapshot opened read-only with the LocoDatabase API, through its chain
+    of base snapshots (the newest version of every document wins).
+    """
+
+    def __init__(self, base_path, codec=None, cache_frames=64):
+        self.base_path = Path(base_path)
+        # Nothing is written; accepted like the other storage engines
+        self.codec = codec or Codec()
+        # Oldest first
+        self.chain = []
+        path = self.base_path
+        while True:
+            index = read_index(path)
+            self.chain.insert(0, (path, index))
+            if index["base"] is None:
+                break
+            base_path = path.parent / index["base"]["path"]
+            if read_index(base_path)["snapshot_id"] != index["base"]["snapshot_id"]:
+                raise ValueError(
+                    f"{base_path} is not the base {path} was taken against"
+                )
+            path = base_path
+        for _, index in self.chain:
+            _check_compression(index["compression"])
+        self.snapshot_id = self.chain[-1][1]["snapshot_id"]
+        self.cache_frames = cache_frames
+        self._frames = OrderedDict()
+        self._views = {}
+
+    def __getitem__(self, db_name):
+        return SnapshotDb(self, db_name)
+
+    def list_databases(self):
+        names = set()
+        for _, index in self.chain:
+            names.update(index["databases"])
+        return sorted(name for name in names if self._collections(name))
+
+    def _collections(self, db_name):
+        names = set()
+        for _, index in self.chain:
+            names.update(index["databases"].get(db_name, {}))
+        # Without those removed (as of the newest snapshot holding them)
+        return sorted(
+            name
+            for name in names
+            if not self._collection_index(db_name, name).get("dropped")
+        )
+
+    def _entries(self, db_name, collection_name):
+        """ID -> (snapshot in the chain, index entry) of every document."""
+        key = (db_name, collection_name)
+        if key not in self._views:
+            view = {}
+            for i, (_, index) in enumerate(self.chain):
+                collection = index["databases"].get(db_name, {}).get(collection_name)
+                if collection is None:
+                    continue
+                for doc_id in collection["deleted"]:
+                    view.pop(doc_id, None)
+                for doc_id, entry in collection["docs"].items():
+                    view[doc_id] = (i, entry)
+            self._views[key] = dict(
+                sorted(view.items(), key=lambda item: id_key(item[0]))
+            )
+        return self._views[key]
+
+    def _collection_index(self, db_name, collection_name):
+        """The newest index entry of a collection (for its states and indexes)."""
+        for _, index in reversed(self.chain):
+            collection = index["databases"].get(db_name, {}).get(collection_name)
+            if collection is not None:
+                return collection
+        return {"states": {}, "indexes": []}
+
+    def _frame(self, snapshot, frame):
+        key = (snapshot, frame)
+        if key in self._frames:
+            self._frames.move_to_end(key)
+            return self._frames[key]
+        path, index = self.chain[snapshot]
+        offset, length = index["frames"][frame][:2]
+        with open(path, "rb") as f:
+            f.seek(offset)
+            compressed = f.read(length)
+        data = _decompress(compressed, index["compression"])
+        tracer = get_tracer()
+        tracer.count("snapshot_frames_read")
+        tracer.count("bytes_parsed", len(data))
+        self._frames[key] = data
+        while len(self._frames) > self.cache_frames:
+            self._frames.popitem(last=False)
+        return data
+
+    def _read(self, snapshot, entry):
+        frame, offset, length = entry[:3]
+        return json.loads(self._frame(snapshot, frame)[offset : offset + length])
+
+    def _frame_range(self, snapshot, frame):
+        earliest, latest = self.chain[snapshot][1]["frames"][frame][2:4]
+        return None if earliest is None else (earliest, latest)
+
+
+class SnapshotDb:
+    """A database of a snapshot."""
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def __getitem__(self, collection_name):
+        return SnapshotCollection(self.client, self.name, collection_name)
+
+    def list_collections(self):
+        return self.client._collections(self.name)
+
+
+class SnapshotCollection:
+    """A collection of a snapshot, read-only."""
+
+    def __init__(self, client, db_name, name):
+        self.client = client
+        self.db_name = db_name
+        self.name = name
+
+    def _read_only(self, *args, **kwargs):
+        raise PermissionError(f"{self.client.base_path} is a read-only snapshot")
+
+    insert_one = insert_many = put = put_many = set_state = update_state = _read_only
+    delete_one = recode = create_index = watch = _read_only
+
+    def _scan(self, query, stats=None):
+        """Yield the documents matching `query`, skipping the frames out of range."""
+        entries = self.client._entries(self.db_name, self.name)
+        condition = query.get("meta.timestamp")
+        frames, skipped = set(), set()
+        for doc_id, (snapshot, entry) in entries.items():
+            frame = (snapshot, entry[0])
+            if condition is not None and not shard_may_match(
+                self.client._frame_range(*frame), condition
+            ):
+                skipped.add(frame)
+                continue
+            frames.add(frame)
+            doc = self.client._read(snapshot, entry)
+            if stats is not None:
+                stats["docs_examined"] += 1
+            if matches(doc, query):
+                yield doc
+        if stats is not None:
+            stats["frames"] = f"{len(frames)}/{len(frames | skipped)}"
+
+    def list_indexes(self):
+        return self.client._collection_index(self.db_name, self.name)["indexes"]
+
+    def list_states(self):
+        return list(self.client._collection_index(self.db_name, self.name)["states"])
+
+    def get_state(self, key):
+        return self.client._collection_index(self.db_name, self.name)["states"].get(key)
+
+    @traced("collection.get")
+    def get(self, doc_id):
+        """Return the document with ID `doc_id`, or None."""
+        found = self.client._entries(self.db_name, self.name).get(str(doc_id))
+        return None if found is None else self.client._read(*found)
+
+    def find_iter(self, query={}, document_class=None):
+        """
+        Yield the documents matching the query one at a time, converted by
+        `document_class` if given.
+        """
+        for doc in self._scan(query):
+            yield doc if document_class is None else document_class(doc)
+
+    @traced("collection.find")
+    def find(self, query={}, document_class=None):
+        """Return all documents matching the query."""
+        return list(self.find_iter(query, document_class))
+
+    @traced("collection.find_one")
+    def find_one(self, query):
+        return next(self._scan(query), None)
+
+    @traced("collection.find_all")
+    def find_all(self, query):
+        return list(self._scan(query))
+
+    @traced("collection.find_most_recent_matching")
+    def find_most_recent_matching(self, query):
+        """Find the most recent document that matches ALL key-value pairs in the query."""
+        most_recent_doc = None
+        most_recent_time = datetime.min
+        for doc in self._scan(query):
+            if "_timestamp" in doc:
+                try:
+                    timestamp = datetime.fromisoformat(doc["_timestamp"])
+                    if timestamp > most_recent_time:
+                        most_recent_time = timestamp
+                        most_recent_doc = doc
+                except ValueError:
+                    continue  # Skip invalid date formats
+        return most_recent_doc
+
+    @traced("collection.find_most_recent_matching_set")
+    def find_most_recent_matching_set(self, query={}):
+        """Find the set of documents with the most recent '_timestamp' timestamp."""
+        most_recent_docs = []
+        most_recent_time = datetime.min
+        for doc in self._scan(query):
+            if "_timestamp" in doc:
+                timestamp_str = doc["_timestamp"].replace(" UTC", "")
+                timestamp = datetime.strptime(timestamp_str, "%Y-%m-%d %H:%M:%S")
+                if timestamp > most_recent_time:
+                    most_recent_time = timestamp
+                    most_recent_docs = [doc]
+                elif timestamp == most_recent_time:
+                    most_recent_docs.append(doc)
+        return most_recent_docs
+
+    @traced("collection.find_latest")
+    def find_latest(self):
+        """Return the document with the highest numeric ID, or None."""
+        numeric = [
+            doc_id
+            for doc_id in self.client._entries(self.db_name, self.name)
+            if doc_id.isdigit()
+        ]
+        if not numeric:
+            return None
+        return self.get(max(numeric, key=int))
+
+    def explain(self, query):
+        stats = {"docs_examined": 0}
+        returned = sum(1 for _ in self._scan(query, stats))
+        return {
+            "plan": plan_query(query, []).describe(),
+            "docs_examined": stats["docs_examined"],
+            "docs_returned": returned,
+            "frames_scanned": stats["frames"],
+        }
+
+    def list_documents(self):
+        return [
+            f"{doc_id}.json" for doc_id in self.client._entries(self.db_name, self.name)
+        ]
+
+
+def restore_snapshot(path, destination):
+    """
+    Copy the documents, states and indexes of the snapshot at `path` (with
+    its bases) into `destination` (any LocoDatabase). Returns the number of
+    documents copied.
+    """
+    # Not at the top: the storage engines import this module
+    from locodb.migrate import migrate
+
+    source = SnapshotDatabase(path)
+    copied = migrate(source, destination)
+    for db_name in source.list_databases():
+        for collection_name in source[db_name].list_collections():
+            collection = source[db_name][collection_name]
+            target = destination[db_name][collection_name]
+            for key in collection.list_states():
+                target.set_state(key, collection.get_state(key))
+            for field in collection.list_indexes():
+                if field not in target.list_indexes():
+                    target.create_index(field)
+    return copied
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export a LocoDatabase to a single-file snapshot, or restore one."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="Write a snapshot of a database.")
+    export.add_argument("db", type=str, help="Path of the cluster database.")
+    export.add_argument("-o", "--output", type=str, required=True)
+    export.add_argument("--engine", type=str, default="directory")
+    export.add_argument(
+        "--base",
+        type=str,
+        default=None,
+        help="Previous snapshot: only write the changes since.",
+    )
+    export.add_argument("--host", action="append", default=None, help="Repeatable.")
+    export.add_argument("--guid", action="append", default=None, help="Repeatable.")
+    export.add_argument(
+        "--since", type=str, default=None, help="e.g. 2025-06-01 00:00:00 UTC"
+    )
+    export.add_argument("--until", type=str, default=None)
+    export.add_argument("--compression", type=str, default="zstd", choices=compressions)
+    export.add_argument("--level", type=int, default=3)
+
+    restore = commands.add_parser("restore", help="Copy a snapshot into a database.")
+    restore.add_argument("snapshot", type=str)
+    restore.add_argument("db", type=str, help="Path of the database to restore into.")
+    restore.add_argument("--engine", type=str, default="directory")
+
+    info = commands.add_parser("info", help="Describe a snapshot and its bases.")
+    info.add_argument("snapshot", type=str)
+    args = parser.parse_args()
+
+    # Not at the top: the storage engines import this module
+    from locodb.engines import open_database
+
+    if args.command == "export":
+        counts = export_snapshot(
+            open_database(args.db, args.engine),
+            args.output,
+            hosts=args.host,
+            guids=args.guid,
+            since=args.since,
+            until=args.until,
+            base=args.base,
+            compression=args.compression,
+            level=args.level,
+        )
+        size = os.path.getsize(args.output)
+        print(
+            f"Wrote {counts['written']} documents ({counts['deleted']} deleted)"
+            f" to {args.output} ({size / 2**20:.1f} MiB)."
+        )
+    elif args.command == "restore":
+        copied = restore_snapshot(args.snapshot, open_database(args.db, args.engine))
+        print(f"Restored {copied} documents from {args.snapshot} to {args.db}.")
+    else:
+        snapshot = SnapshotDatabase(args.snapshot)
+        for path, index in reversed(snapshot.chain):
+            documents = sum(
+                len(collection["docs"])
+                for database in index["databases"].values()
+                for collection in database.values()
+            )
+            print(
+                f"{path}: {index['snapshot_id']} created {index['created']},"
+                f" {documents} documents in {len(index['frames'])} frames"
+                f" ({index['compression']}), filter {json.dumps(index['filter'])}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# Spool files: inserts written to a local file first and merged into a
+# LocoDatabase later in large batches (see `ingest.py`).
+#
+# A spool is a JSON lines file with one record per document:
+#   {"database": <name>, "collection": <name>, "document": {...}}
+# It is written as `<name>.jsonl.open` and renamed to `<name>.jsonl` when
+# closed, so only complete spools are picked up for ingestion.
+
+import json
+import os
+import uuid
+from pathlib import Path
+
+from locodb.utility import get_timestamp
+
+
+class Spool:
+    """Append-only spool file of documents to insert into a LocoDatabase."""
+
+    def __init__(self, spool_dir, name):
+        self.spool_dir = Path(spool_dir)
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        self.path = self.spool_dir / f"{name}.jsonl"
+        self.open_path = self.spool_dir / f"{name}.jsonl.open"
+        self.file = open(self.open_path, "a")
+
+    def insert_one(self, db_name, collection_name, doc):
+        """
+        Append a document to the spool.
+        Every document gets a `meta.run_id` (if it has none) so ingestion can
+        skip documents already in the database, and is timestamped now
+        rather than when it is ingested.
+        """
+        meta = doc.setdefault("meta", {})
+        meta.setdefault("run_id", uuid.uuid4().hex)
+        meta.setdefault("timestamp", get_timestamp())
+        record = {"database": db_name, "collection": collection_name, "document": doc}
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return {"run_id": meta["run_id"]}
+
+    def close(self):
+        """Close the spool and make it available for ingestion."""
+        if not self.file.closed:
+            self.file.close()
+            os.replace(self.open_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_spool(path):
+    """
+    Read the records of a spool file.
+    A last line cut short (the writer died mid-write) is ignored.
+    """
+    records = []
+    with open(path, "r") as f:
+        for line in f:
+            if not line.endswith("\n"):
+                break
+            records.append(json.loads(line))
+    return records
@@ -0,0 +1,538 @@
+import json
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+
+from locodb.codec import Codec
+from locodb.profiling import get_tracer, traced
+from locodb.query import Plan, json_path, matches, plan_query
+from locodb.utility import get_timestamp
+from locodb.watch import ChangeStream, ChangeStreamHistoryLost
+
+# Every document of every collection lives in one table. The fields queried
+# the most (meta.timestamp, meta.hostname, meta.GUID and the numeric ID used
+# to find the latest insert) have JSON1 expression indexes. Triggers record
+# every write in `changes`, which change streams (`watch()`) follow.
+schema = """
+CREATE TABLE IF NOT EXISTS databases (
+    name TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS collections (
+    db TEXT NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (db, name)
+);
+CREATE TABLE IF NOT EXISTS documents (
+    db TEXT NOT NULL,
+    collection TEXT NOT NULL,
+    id TEXT NOT NULL,
+    doc TEXT NOT NULL,
+    PRIMARY KEY (db, collection, id)
+);
+CREATE TABLE IF NOT EXISTS indexes (
+    field TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS state (
+    db TEXT NOT NULL,
+    collection TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (db, collection, key)
+);
+CREATE INDEX IF NOT EXISTS documents_num
+    ON documents (db, collection, CAST(id AS INTEGER));
+CREATE INDEX IF NOT EXISTS documents_timestamp
+    ON documents (db, collection, json_extract(doc, '$.meta.timestamp'));
+CREATE INDEX IF NOT EXISTS documents_hostname
+    ON documents (json_extract(doc, '$.meta.hostname'));
+CREATE INDEX IF NOT EXISTS documents_guid
+    ON documents (json_extract(doc, '$.meta.GUID'));
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    db TEXT NOT NULL,
+    collection TEXT NOT NULL,
+    id TEXT NOT NULL,
+    operation TEXT NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS documents_insert AFTER INSERT ON documents BEGIN
+    INSERT INTO changes (db, collection, id, operation)
+        VALUES (new.db, new.collection, new.id, 'insert');
+END;
+CREATE TRIGGER IF NOT EXISTS documents_replace AFTER UPDATE ON documents BEGIN
+    INSERT INTO changes (db, collection, id, operation)
+        VALUES (new.db, new.collection, new.id, 'replace');
+END;
+CREATE TRIGGER IF NOT EXISTS documents_delete AFTER DELETE ON documents BEGIN
+    INSERT INTO changes (db, collection, id, operation)
+        VALUES (old.db, old.collection, old.id, 'delete');
+END;
+"""
+
+# Fields indexed by the schema above
+default_indexes = ["meta.timestamp", "meta.hostname", "meta.GUID"]
+
+# Number of changes kept for change streams (older ones are dropped)
+max_changes = 100_000
+
+sql_operators = {"$eq": "=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+
+class LocoDatabase:
+    """A class that mimics the pymongo API but stores data in a SQLite file."""
+
+    def __init__(self, base_path, codec=None):
+        self.base_path = Path(base_path)
+        self.base_path.parent.mkdir(parents=True, exist_ok=True)
+        # Documents are stored as JSON text for the JSON1 indexes, so only
+        # the blocks left out (`omit`) of a codec apply here
+        self.codec = codec or Codec()
+        if self.codec.format != "json" or self.codec.compression is not None:
+            raise ValueError(
+                f"The sqlite engine stores JSON text, not {self.codec.name} documents."
+            )
+        # sqlite3 connections cannot be shared between threads
+        self._local = threading.local()
+        connection = self.connection()
+        # WAL lets readers run alongside the (single) writer, and concurrent
+        # writers from several Slurm jobs wait on the busy timeout
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(schema)
+
+    def connection(self):
+        """Return this thread's connection to the database file."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.base_path, timeout=60, isolation_level=None
+            )
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def __getitem__(self, db_name):
+        """Get a database."""
+        return Database(self, db_name)
+
+    def list_databases(self):
+        """List available databases."""
+        rows = self.connection().execute("SELECT name FROM databases")
+        return [row[0] for row in rows]
+
+
+class Database:
+    """Represents a MongoDB-like database (rows sharing the same `db`)."""
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def __getitem__(self, collection_name):
+        """Get a collection."""
+        return Collection(self, collection_name)
+
+    def list_collections(self):
+        """List available collections in the database."""
+        rows = self.client.connection().execute(
+            "SELECT name FROM collections WHERE db = ?", (self.name,)
+        )
+        return [row[0] for row in rows]
+
+    def watch(self, resume_after=None, poll_interval=1.0):
+        """Change stream of every collection of the database (see `locodb/watch.py`)."""
+        return SQLiteChangeStream(self, None, resume_after, poll_interval)
+
+
+class Collection:
+    """Represents a MongoDB-like collection (rows sharing `db` and `collection`)."""
+
+    def __init__(self, database, name):
+        self.client = database.client
+        self.db = database.name
+        self.name = name
+
+    def _execute(self, sql, params=()):
+        return self.client.connection().execute(sql, params)
+
+    def _register(self):
+        # Names are only registered by writes: looking a collection up must
+        # not take the write lock, nor create it
+        self._execute("INSERT OR IGNORE INTO databases (name) VALUES (?)", (self.db,))
+        self._execute(
+            "INSERT OR IGNORE INTO collections (db, name) VALUES (?, ?)",
+            (self.db, self.name),
+        )
+
+    def _trim_changes(self):
+        self._execute(
+            "DELETE FROM changes WHERE seq <= (SELECT MAX(seq) FROM changes) - ?",
+            (max_changes,),
+        )
+
+    def list_indexes(self):
+        """List the fields (dotted paths) with an index."""
+        rows = self._execute("SELECT field FROM indexes")
+        return default_indexes + [row[0] for row in rows]
+
+    @traced("collection.create_index")
+    def create_index(self, field):
+        """Create a JSON1 expression index on the dotted path `field`."""
+        if field in self.list_indexes():
+            return field
+        name = "documents_" + re.sub(r"[^0-9A-Za-z]+", "_", field)
+        expression = json_path(field).replace("'", "''")
+        self._execute(
+            f'CREATE INDEX IF NOT EXISTS "{name}"'
+            f" ON documents (json_extract(doc, '{expression}'))"
+        )
+        self._execute("INSERT OR IGNORE INTO indexes (field) VALUES (?)", (field,))
+        return field
+
+    def _query_sql(self, query, suffix=""):
+        """
+        SQL selecting the candidate rows of `query`: the bounds of the chosen
+        index are pushed down to SQLite, the rest of the query is checked in
+        Python on every candidate.
+        """
+        plan = plan_query(query, self.list_indexes())
+        sql = "SELECT id, doc FROM documents WHERE db = ? AND collection = ?"
+        params = [self.db, self.name]
+        operands = [
+            operand
+            for operand in plan.bounds.values()
+            for operand in (operand if isinstance(operand, list) else [operand])
+        ]
+        if plan.index is not None and all(
+            isinstance(operand, (str, int, float)) for operand in operands
+        ):
+            # Must match the indexed expression exactly for SQLite to use it
+            expression = "json_extract(doc, '{}')".format(
+                json_path(plan.index).replace("'", "''")
+            )
+            for op, operand in plan.bounds.items():
+                if op == "$in":
+                    sql += f" AND {expression} IN ({', '.join('?' * len(operand))})"
+                    params += operand
+                else:
+                    sql += f" AND {expression} {sql_operators[op]} ?"
+                    params.append(operand)
+        else:
+            plan = Plan()
+        return plan, sql + suffix, params
+
+    def _select(self, query, suffix="", stats=None):
+        """Yield (ID, document) of the documents matching the query."""
+        plan, sql, params = self._query_sql(query, suffix)
+        if stats is not None:
+            stats["plan"] = plan.describe()
+        tracer = get_tracer()
+        for doc_id, data in self._execute(sql, params).fetchall():
+            tracer.count("documents_read")
+            tracer.count("bytes_parsed", len(data))
+            if stats is not None:
+                stats["docs_examined"] += 1
+            doc = json.loads(data)
+            if matches(doc, query):
+                yield doc_id, doc
+
+    @traced("collection.explain")
+    def explain(self, query):
+        """Run `query` and report the plan used and the documents examined and returned."""
+        stats = {"plan": None, "docs_examined": 0}
+        returned = sum(1 for _ in self._select(query, stats=stats))
+        _, sql, params = self._query_sql(query)
+        rows = self._execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+        return {
+            "plan": stats["plan"],
+            "docs_examined": stats["docs_examined"],
+            "docs_returned": returned,
+            "sqlite_plan": [row[-1] for row in rows],
+        }
+
+    def _next_id(self):
+        row = self._execute(
+            "SELECT COALESCE(MAX(CAST(id AS INTEGER)), 0) + 1 FROM documents"
+            " WHERE db = ? AND collection = ?",
+            (self.db, self.name),
+        ).fetchone()
+        return row[0]
+
+    def _store(self, doc_id, doc):
+        data = self.client.codec.encode(doc).decode()
+        # An upsert rather than INSERT OR REPLACE, so a replaced document is
+        # recorded as such by the triggers
+        self._execute(
+            "INSERT INTO documents (db, collection, id, doc) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT (db, collection, id) DO UPDATE SET doc = excluded.doc",
+            (self.db, self.name, doc_id, data),
+        )
+        tracer = get_tracer()
+        tracer.count("documents_written")
+        tracer.count("bytes_written", len(data))
+
+    def _write(self, doc, doc_id):
+        # Add meta field
+        # appends to any metadata already present in the document
+        meta = doc.setdefault("meta", {})
+        meta["id"] = doc_id
+        meta.setdefault("timestamp", get_timestamp())
+        self._store(doc_id, doc)
+
+    @traced("collection.insert_one")
+    def insert_one(self, doc):
+        """Insert a single document."""
+        return {"_id": self.insert_many([doc])["inserted_ids"][0]}
+
+    @traced("collection.insert_many")
+    def insert_many(self, docs):
+        """Insert several documents in a single transaction."""
+        inserted_ids = []
+        # BEGIN IMMEDIATE takes the write lock before IDs are allocated
+        self._execute("BEGIN IMMEDIATE")
+        try:
+            self._register()
+            next_id = self._next_id()
+            for doc in docs:
+                if "_id" in doc:
+                    doc_id = doc["_id"]
+                else:
+                    doc_id = str(next_id)
+                    next_id += 1
+                self._write(doc, doc_id)
+                inserted_ids.append(doc_id)
+            self._trim_changes()
+            self._execute("COMMIT")
+        except BaseException:
+            self._execute("ROLLBACK")
+            raise
+        return {"inserted_ids": inserted_ids}
+
+    @traced("collection.get")
+    def get(self, doc_id):
+        """Return the document with ID `doc_id`, or None."""
+        row = self._execute(
+            "SELECT doc FROM documents WHERE db = ? AND collection = ? AND id = ?",
+            (self.db, self.name, doc_id),
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    @traced("collection.put")
+    def put(self, doc_id, doc):
+        """Store `doc` as-is under `doc_id`, replacing any existing document."""
+        self.put_many([(doc_id, doc)])
+
+    @traced("collection.put_many")
+    def put_many(self, items):
+        """Store (ID, document) pairs as-is, in a single transaction."""
+        self._execute("BEGIN IMMEDIATE")
+        try:
+            self._register()
+            for doc_id, doc in items:
+                self._store(doc_id, doc)
+            self._trim_changes()
+            self._execute("COMMIT")
+        except BaseException:
+            self._execute("ROLLBACK")
+            raise
+
+    @traced("collection.recode")
+    def recode(self, doc_id, doc):
+        """
+        Store `doc` under `doc_id` like `put`, without recording a change:
+        for writing a document again with another codec (see `rewrite.py`).
+        """
+        self._execute("BEGIN IMMEDIATE")
+        try:
+            last = self._execute("SELECT COALESCE(MAX(seq), 0) FROM changes")
+            last = last.fetchone()[0]
+            self._register()
+            self._store(doc_id, doc)
+            # Recorded by the triggers; no change stream has seen it yet
+            self._execute("DELETE FROM changes WHERE seq > ?", (last,))
+            self._execute("COMMIT")
+        except BaseException:
+            self._execute("ROLLBACK")
+            raise
+
+    def find_iter(self, query={}, document_class=None):
+        """
+        Yield the documents matching the query one at a time, converted by
+        `document_class` (e.g. `BenchmarkRecord.from_document`) if given.
+        """
+        for _, doc in self._select(query):
+            yield doc if document_class is None else document_class(doc)
+
+    @traced("collection.find_one")
+    def find_one(self, query):
+        """Find a document that matches the query."""
+        return next((doc for _, doc in self._select(query)), None)
+
+    @traced("collection.find_all")
+    def find_all(self, query):
+        """Find all documents that match the query."""
+        return [doc for _, doc in self._select(query)]
+
+    @traced("collection.find_most_recent_matching")
+    def find_most_recent_matching(self, query):
+        """Find the most recent document that matches ALL key-value pairs in the query."""
+        most_recent_doc = None
+        most_recent_time = datetime.min
+        for _, doc in self._select(query):
+            if "_timestamp" in doc:
+                try:
+                    timestamp = datetime.fromisoformat(doc["_timestamp"])
+                    if timestamp > most_recent_time:
+                        most_recent_time = timestamp
+                        most_recent_doc = doc
+                except ValueError:
+                    continue  # Skip invalid date formats
+        return most_recent_doc
+
+    @traced("collection.find_most_recent_matching_set")
+    def find_most_recent_matching_set(self, query={}):
+        """Find the set of documents with the most recent '_timestamp' timestamp."""
+        most_recent_docs = []
+        most_recent_time = datetime.min
+        for _, doc in self._select(query):
+            if "_timestamp" in doc:
+                timestamp_str = doc["_timestamp"].replace(" UTC", "")
+                timestamp = datetime.strptime(timestamp_str, "%Y-%m-%d %H:%M:%S")
+                if timestamp > most_recent_time:
+                    most_recent_time = timestamp
+                    most_recent_docs = [doc]
+                elif timestamp == most_recent_time:
+                    most_recent_docs.append(doc)
+        return most_recent_docs
+
+    @traced("collection.find")
+    def find(self, query={}, document_class=None):
+        """
+        Return all documents in the collection (matching the query, if given).
+        With `document_class`, every document is converted as it is read.
+        """
+        return list(self.find_iter(query, document_class))
+
+    @traced("collection.get_state")
+    def get_state(self, key):
+        """Return the state object `key` kept alongside the documents, or None."""
+        row = self._execute(
+            "SELECT value FROM state WHERE db = ? AND collection = ? AND key = ?",
+            (self.db, self.name, key),
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def list_states(self):
+        """List the keys of the state objects kept alongside the documents."""
+        rows = self._execute(
+            "SELECT key FROM state WHERE db = ? AND collection = ?",
+            (self.db, self.name),
+        )
+        return [row[0] for row in rows]
+
+    @traced("collection.set_state")
+    def set_state(self, key, value):
+        """Store a state object (e.g. incremental statistics) alongside the documents."""
+        self.update_state(key, lambda _: value)
+
+    @traced("collection.update_state")
+    def update_state(self, key, update):
+        """
+        Replace the state object `key` with `update(state)` (None if there is
+        no state yet) in one transaction, so concurrent updates are never lost.
+        Returns the new state.
+        """
+        self._execute("BEGIN IMMEDIATE")
+        try:
+            value = update(self.get_state(key))
+            self._register()
+            self._execute(
+                "INSERT OR REPLACE INTO state (db, collection, key, value) VALUES (?, ?, ?, ?)",
+                (self.db, self.name, key, json.dumps(value)),
+            )
+            self._execute("COMMIT")
+        except BaseException:
+            self._execute("ROLLBACK")
+            raise
+        return value
+
+    @traced("collection.find_latest")
+    def find_latest(self):
+        """Return the most recently inserted document (highest numeric ID), or None."""
+        for _, doc in self._select({}, " ORDER BY CAST(id AS INTEGER) DESC LIMIT 1"):
+            return doc
+        return None
+
+    @traced("collection.delete_one")
+    def delete_one(self, query):
+        """Delete a document by a simple key-value pair."""
+        for doc_id, _ in self._select(query):
+            self._execute(
+                "DELETE FROM documents WHERE db = ? AND collection = ? AND id = ?",
+                (self.db, self.name, doc_id),
+            )
+            self._trim_changes()
+            return {"deleted_count": 1}
+        return {"deleted_count": 0}
+
+    @traced("collection.list_documents")
+    def list_documents(self):
+        """List all document names in the collection (`<id>.json`, as in the directory engine)."""
+        rows = self._execute(
+            "SELECT id FROM documents WHERE db = ? AND collection = ?",
+            (self.db, self.name),
+        )
+        return [f"{row[0]}.json" for row in rows]
+
+    def watch(self, resume_after=None, poll_interval=1.0):
+        """Change stream of the collection (see `locodb/watch.py`)."""
+        return SQLiteChangeStream(
+            Database(self.client, self.db), self.name, resume_after, poll_interval
+        )
+
+
+class SQLiteChangeStream(ChangeStream):
+    """Change stream following the `changes` table; the resume token is a sequence number."""
+
+    def __init__(self, database, collection=None, resume_after=None, poll_interval=1.0):
+        super().__init__(poll_interval)
+        self.database = database
+        self.collection = collection
+        if resume_after is None:
+            # Only changes from now on
+            row = database.client.connection().execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM changes"
+            ).fetchone()
+            resume_after = row[0]
+        self._token = self._seq = resume_after
+
+    def _poll(self, limit=1000):
+        connection = self.database.client.connection()
+        first = connection.execute("SELECT MIN(seq) FROM changes").fetchone()[0]
+        if first is not None and self._seq < first - 1:
+            raise ChangeStreamHistoryLost(
+                f"The changes before {first} have been dropped;"
+                f" cannot resume from {self._seq}."
+            )
+        sql = "SELECT seq, collection, id, operation FROM changes WHERE seq > ? AND db = ?"
+        params = [self._seq, self.database.name]
+        if self.collection is not None:
+            sql += " AND collection = ?"
+            params.append(self.collection)
+        rows = connection.execute(
+            sql + " ORDER BY seq LIMIT ?", params + [limit]
+        ).fetchall()
+        events = []
+        for seq, name, doc_id, operation in rows:
+            event = {
+                "_id": seq,
+                "operationType": operation,
+                "ns": {"db": self.database.name, "coll": name},
+                "documentKey": {"_id": doc_id},
+            }
+            if operation != "delete":
+                # The current version, None if deleted since
+                event["fullDocument"] = self.database[name].get(doc_id)
+            events.append(event)
+            self._seq = seq
+        return events
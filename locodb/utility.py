@@ -1,7 +1,10 @@
 # Miscellanous utilities
 
 from datetime import datetime, timezone
+import fcntl
 import os
+import tempfile
+from pathlib import Path
 import urllib.request
 import xml.etree.ElementTree as ET
 import pytz
@@ -56,6 +59,43 @@ def get_timestamp():
     return timestamp
 
 
+def lock_file(f, operation):
+    """
+    flock the open file `f`. Returns False if a non-blocking lock is taken.
+    Where locks are not supported (e.g. Lustre without -o flock), blocking
+    locks are skipped (True) and non-blocking ones are never taken (False).
+    """
+    try:
+        fcntl.flock(f, operation)
+        return True
+    except BlockingIOError:
+        return False
+    except OSError:
+        return operation & fcntl.LOCK_NB == 0
+
+
+def id_key(doc_id):
+    """Sort key of document IDs: numeric IDs in numeric order, then the others."""
+    return (0, int(doc_id), "") if str(doc_id).isdigit() else (1, 0, str(doc_id))
+
+
+def parse_timestamp(timestamp):
+    """Converts a timestamp from `get_timestamp` back to an aware UTC datetime."""
+    dt_object = datetime.strptime(timestamp.replace(" UTC", ""), "%Y-%m-%d %H:%M:%S")
+    return dt_object.replace(tzinfo=timezone.utc)
+
+
+def temporary_file(directory, name):
+    """
+    Create a temporary file in `directory`, to be renamed to `name` once
+    written. Its name is unique to the call, since the writers may be
+    threads of one process (e.g. `AsyncLocoDatabase`).
+    Returns the open (binary) file and its path.
+    """
+    fd, path = tempfile.mkstemp(dir=directory, prefix=f".{name}.", suffix=".tmp")
+    return os.fdopen(fd, "wb"), Path(path)
+
+
 def get_supported_repos(default_xml_path="default.xml"):
     """
     Get the list of supported repositories from the default.xml file.
@@ -0,0 +1,374 @@
+# Change streams: `collection.watch()` and `database.watch()` yield an event
+# for every document inserted, replaced or deleted, in the format of
+# pymongo's change streams:
+#   {"_id": <resume token>, "operationType": "insert", "ns": {"db": ..., "coll": ...},
+#    "documentKey": {"_id": "42"}, "fullDocument": {...}}
+#
+# With the directory engine every write appends [operation, ID] to the
+# collection's `_changes.jsonl`, and the position (byte offset) reached in
+# each log is the resume token. The stream keeps a manifest of the offset
+# reached in every log, so a poll only stats the logs and reads the ones
+# that grew. The sqlite engine records changes in a table instead (see
+# `sqlitedb.py`), and its resume token is the sequence number of a change.
+# Where inotify is available it wakes the stream up as soon as a log is
+# written; polling still runs every `poll_interval` seconds, since inotify
+# does not see writes from other hosts on a network file system.
+#
+# Change logs do not grow forever. Once a log is larger than `max_log_bytes`
+# its oldest half is dropped, and a {"base": N} header line records the
+# position of the first change kept, so the positions of the changes kept
+# (and the resume tokens) do not move. Likewise the sqlite engine keeps the
+# last `max_changes` changes. Resuming from a change dropped since raises
+# ChangeStreamHistoryLost; the consumer then has to rescan the database.
+#
+#   python -m locodb.watch cluster --database node0001
+
+import argparse
+import ctypes
+import ctypes.util
+import fcntl
+import json
+import os
+import select
+import struct
+import time
+from collections import deque
+from pathlib import Path
+
+from locodb.utility import lock_file, temporary_file
+
+# Change log of a collection of the directory engine
+change_log = "_changes.jsonl"
+# Size above which a change log drops its oldest half (~25,000 changes)
+max_log_bytes = 1 << 20
+
+# inotify(7)
+IN_MODIFY = 0x00000002
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+IN_ISDIR = 0x40000000
+_event_header = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+class ChangeStreamHistoryLost(Exception):
+    """The changes after a resume token have been dropped from the change log."""
+
+
+def _read_header(f):
+    """Position of the first change of an open change log, and its header length."""
+    f.seek(0)
+    line = f.readline()
+    if line.startswith(b"{") and line.endswith(b"\n"):
+        return json.loads(line)["base"], len(line)
+    f.seek(0)
+    return 0, 0
+
+
+def append_change(collection_path, operation, doc_id):
+    """Record a write to a collection of the directory engine."""
+    log = Path(collection_path) / change_log
+    line = (json.dumps([operation, doc_id]) + "\n").encode()
+    while True:
+        # One write per entry, so concurrent writers never interleave lines
+        with open(log, "ab") as f:
+            # Shared with the other writers, exclusive to a compaction
+            lock_file(f, fcntl.LOCK_SH)
+            if os.fstat(f.fileno()).st_ino != os.stat(log).st_ino:
+                continue  # Compacted since it was opened
+            f.write(line)
+            size = f.tell()
+        break
+    if size > max_log_bytes:
+        compact_changes(collection_path, max_log_bytes // 2)
+
+
+def compact_changes(collection_path, keep_bytes):
+    """Drop the oldest changes of a change log, keeping about `keep_bytes` of them."""
+    log = Path(collection_path) / change_log
+    with open(log, "rb") as f:
+        # Skipped if another process is writing (a later write compacts it)
+        # or if locks are not supported
+        if not lock_file(f, fcntl.LOCK_EX | fcntl.LOCK_NB):
+            return
+        if os.fstat(f.fileno()).st_ino != os.stat(log).st_ino:
+            return  # Compacted by another process already
+        base, _ = _read_header(f)
+        data = f.read()
+        if len(data) <= keep_bytes:
+            return
+        cut = data.find(b"\n", len(data) - keep_bytes) + 1
+        tmp, tmp_file = temporary_file(log.parent, change_log)
+        with tmp:
+            tmp.write((json.dumps({"base": base + cut}) + "\n").encode())
+            tmp.write(data[cut:])
+        os.replace(tmp_file, log)
+
+
+class Inotify:
+    """Minimal inotify binding (ctypes), used to wake up a change stream."""
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+
+    @staticmethod
+    def available():
+        library = ctypes.util.find_library("c")
+        return library is not None and hasattr(ctypes.CDLL(library), "inotify_init1")
+
+    def add_watch(self, path, mask):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(str(path)), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed on {path}")
+        self.watches[wd] = Path(path)
+        return wd
+
+    def read(self, timeout):
+        """
+        Wait up to `timeout` seconds for events.
+        Returns (directory, name, mask) of every event received.
+        """
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _event_header.unpack_from(data, offset)
+                offset += _event_header.size
+                name = data[offset : offset + length].rstrip(b"\0").decode()
+                offset += length
+                if wd in self.watches:
+                    events.append((self.watches[wd], name, mask))
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class ChangeStream:
+    """
+    Iterator over change events; blocks until the next event.
+    `resume_token` is the position after the last event returned: pass it as
+    `resume_after` to `watch()` to continue from there after a restart.
+    """
+
+    def __init__(self, poll_interval=1.0):
+        self.poll_interval = poll_interval
+        self._events = deque()
+        self._closed = False
+        self._token = None
+
+    @property
+    def resume_token(self):
+        return json.loads(json.dumps(self._token))  # A copy
+
+    def _poll(self):
+        """New events, each with the resume token after it as `_id`."""
+        raise NotImplementedError
+
+    def _wait(self, timeout):
+        time.sleep(timeout)
+
+    def try_next(self):
+        """The next event, or None if there is none yet."""
+        if not self._events:
+            self._events.extend(self._poll())
+        if not self._events:
+            return None
+        event = self._events.popleft()
+        self._token = event["_id"]
+        return event
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while not self._closed:
+            event = self.try_next()
+            if event is not None:
+                return event
+            self._wait(self.poll_interval)
+        raise StopIteration
+
+    def close(self):
+        self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class DirectoryChangeStream(ChangeStream):
+    """
+    Change stream of the directory engine, over the collections `collections`
+    of the database at `path` (every collection, including new ones, by default).
+    """
+
+    def __init__(
+        self,
+        database,
+        collections=None,
+        resume_after=None,
+        poll_interval=1.0,
+        use_inotify=True,
+    ):
+        super().__init__(poll_interval)
+        self.database = database
+        self.path = Path(database.path)
+        self.collections = collections
+        self.inotify = None
+        # Inode, base position and header length of every change log
+        self._headers = {}
+        if use_inotify and Inotify.available():
+            self.inotify = Inotify()
+            if collections is None:
+                self.inotify.add_watch(self.path, IN_CREATE | IN_MOVED_TO)
+        if resume_after is not None:
+            self._token = dict(resume_after)
+        else:
+            # Only changes from now on
+            self._token = {name: self._log_size(name) for name in self._names()}
+        # Manifest: how far every change log has been read
+        self._offsets = dict(self._token)
+        for name in self._offsets:
+            self._add_collection(name)
+
+    def _names(self):
+        if self.collections is not None:
+            return list(self.collections)
+        return [d.name for d in self.path.iterdir() if d.is_dir()]
+
+    def _log_size(self, name):
+        """Position of the end of a change log."""
+        try:
+            stat = (self.path / name / change_log).stat()
+        except FileNotFoundError:
+            return 0
+        if self._headers.get(name, (None,))[0] != stat.st_ino:
+            # Compacted (or created) since the last poll
+            with open(self.path / name / change_log, "rb") as f:
+                self._headers[name] = (os.fstat(f.fileno()).st_ino, *_read_header(f))
+        _, base, header = self._headers[name]
+        return base + stat.st_size - header
+
+    def _add_collection(self, name):
+        self._offsets.setdefault(name, 0)
+        if self.inotify is not None:
+            (self.path / name).mkdir(exist_ok=True)
+            self.inotify.add_watch(self.path / name, IN_MODIFY | IN_CREATE | IN_MOVED_TO)
+
+    def _read_log(self, name, offset):
+        """Complete lines of a change log from `offset`, with the offset after each."""
+        with open(self.path / name / change_log, "rb") as f:
+            base, header = _read_header(f)
+            if offset < base:
+                raise ChangeStreamHistoryLost(
+                    f"The changes of {self.path.name}/{name} before position {base}"
+                    f" have been dropped; cannot resume from position {offset}."
+                )
+            f.seek(header + offset - base)
+            data = f.read()
+        # A line still being written is read by the next poll
+        data = data[: data.rfind(b"\n") + 1]
+        for line in data.splitlines(keepends=True):
+            offset += len(line)
+            yield json.loads(line), offset
+
+    def _poll(self):
+        if self.collections is None:
+            for name in self._names():
+                if name not in self._offsets:
+                    self._add_collection(name)  # Created since the last poll
+        events = []
+        position = dict(self._offsets)
+        for name in sorted(self._offsets):
+            if self._log_size(name) <= self._offsets[name]:
+                continue
+            for (operation, doc_id), offset in self._read_log(name, self._offsets[name]):
+                position[name] = offset
+                event = {
+                    "_id": dict(position),
+                    "operationType": operation,
+                    "ns": {"db": self.path.name, "coll": name},
+                    "documentKey": {"_id": doc_id},
+                }
+                if operation != "delete":
+                    # The current version, None if deleted since
+                    event["fullDocument"] = self.database[name].get(doc_id)
+                events.append(event)
+            self._offsets[name] = position[name]
+        return events
+
+    def _wait(self, timeout):
+        if self.inotify is None:
+            time.sleep(timeout)
+            return
+        # Wake up early when a change log is written or a collection is created
+        deadline = time.monotonic() + timeout
+        while (remaining := deadline - time.monotonic()) > 0:
+            for directory, name, mask in self.inotify.read(remaining):
+                if name == change_log or (directory == self.path and mask & IN_ISDIR):
+                    return
+
+    def close(self):
+        super().close()
+        if self.inotify is not None:
+            self.inotify.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Print the changes to a LocoDatabase as JSON lines."
+    )
+    parser.add_argument("db", type=str, help="Path of the cluster database.")
+    parser.add_argument(
+        "--engine", type=str, default="directory", help="Storage engine of the database."
+    )
+    parser.add_argument("--database", type=str, required=True)
+    parser.add_argument("--collection", type=str, default=None)
+    parser.add_argument(
+        "--token-file",
+        type=str,
+        default=None,
+        help="Resume from the token saved in this file, and save it after every event.",
+    )
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    args = parser.parse_args()
+
+    # Not at the top: the storage engines import this module
+    from locodb.engines import open_database
+
+    target = open_database(args.db, args.engine)[args.database]
+    if args.collection is not None:
+        target = target[args.collection]
+    resume_after = None
+    if args.token_file is not None and os.path.exists(args.token_file):
+        with open(args.token_file, "r") as f:
+            resume_after = json.load(f)
+
+    with target.watch(resume_after=resume_after, poll_interval=args.poll_interval) as stream:
+        for event in stream:
+            print(json.dumps(event), flush=True)
+            if args.token_file is not None:
+                tmp_file = f"{args.token_file}.{os.getpid()}.tmp"
+                with open(tmp_file, "w") as f:
+                    json.dump(stream.resume_token, f)
+                os.replace(tmp_file, args.token_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,470 @@
+# Runs the health check on many nodes and collects one fleet report.
+#
+# The nodes come from a Slurm hostlist (`--nodes node[001-064]`) or from the
+# nodes of a partition (`--partition`), optionally in the priority order of
+# `schedule.py`. Every node runs `benchmark_gpus.py --summary` through a
+# launcher:
+#   srun   one job step per node, inside an allocation (see slurm/fleet.sh)
+#          or with its own (`--slurm-partition`)
+#   ssh    ssh to the node, e.g. on clusters without Slurm
+#   local  a local process per node reporting stored results
+#          (`benchmark_gpus.py --fixture`, `--fixture` below) under the
+#          node's name: a stand-in to test the orchestration without a
+#          cluster or GPUs, which stores nothing
+# At most `--parallel` nodes are checked at once. The output of every node
+# goes to `<log dir>/<node>.log`, and the summary line it prints is read as
+# soon as the node finishes. The report (status, wall time and GPU verdicts
+# of every node) is rewritten after every node, so it is complete up to the
+# last node finished if the sweep is interrupted.
+#
+#   python orchestrate.py --nodes node[001-064] --launcher srun --parallel 16
+#   python orchestrate.py --nodes a,b,c --launcher local
+
+import argparse
+import json
+import math
+import os
+import re
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from benchmark_gpus import summary_prefix
+from locodb.engines import open_database, writable_engines
+from locodb.utility import get_timestamp
+
+
+def expand_hostlist(hostlist):
+    """
+    Hostnames of a Slurm hostlist expression,
+    e.g. "n[01-03,07],login" -> n01, n02, n03, n07, login.
+    """
+    # Split on the commas outside of brackets
+    items, depth, start = [], 0, 0
+    for i, char in enumerate(hostlist):
+        if char == "[":
+            depth += 1
+        elif char == "]":
+            depth -= 1
+        elif char == "," and depth == 0:
+            items.append(hostlist[start:i])
+            start = i + 1
+    items.append(hostlist[start:])
+
+    hostnames = []
+    for item in filter(None, (item.strip() for item in items)):
+        match = re.match(r"([^\[]*)\[([^\]]*)\](.*)", item)
+        if match is None:
+            hostnames.append(item)
+            continue
+        prefix, ranges, suffix = match.groups()
+        for part in ranges.split(","):
+            if "-" in part:
+                first, last = part.split("-")
+                width = len(first)
+                for number in range(int(first), int(last) + 1):
+                    # Expanded again for any later bracket group
+                    hostnames += expand_hostlist(f"{prefix}{number:0{width}d}{suffix}")
+            else:
+                hostnames += expand_hostlist(f"{prefix}{part}{suffix}")
+    return hostnames
+
+
+def partition_nodes(partition, states=None):
+    """Nodes of a Slurm partition (in the given states, e.g. "idle,mix")."""
+    command = [
+        "sinfo",
+        "--noheader",
+        "--Node",
+        "--partition",
+        partition,
+        "--format",
+        "%N",
+    ]
+    if states:
+        command += ["--states", states]
+    output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+    # A node in several partitions is listed once per partition
+    return list(dict.fromkeys(output.split()))
+
+
+class Launcher:
+    """Builds the command running the health check `check` (argv) on a node."""
+
+    # Working directory of the command (the launchers below change directory
+    # on the node themselves)
+    cwd = None
+
+    def __init__(self, args):
+        self.args = args
+
+    def command(self, node, check):
+        raise NotImplementedError
+
+
+class LocalLauncher(Launcher):
+    def __init__(self, args):
+        super().__init__(args)
+        self.cwd = args.workdir
+
+    def command(self, node, check):
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), check[0])
+        # The check arguments (--db, ...) do not apply to stored results
+        return [
+            sys.executable,
+            script,
+            "--summary",
+            "--hostname",
+            node,
+            "--fixture",
+        ] + self.args.fixture
+
+
+class SshLauncher(Launcher):
+    def command(self, node, check):
+        script = f"cd {shlex.quote(self.args.workdir)} && "
+        if self.args.setup:
+            script += f"{self.args.setup} && "
+        command = [self.args.python] + check
+        if self.args.timeout:
+            # Killing the local ssh client would leave the check running on
+            # the node: stop it there too
+            command = ["timeout", f"{math.ceil(self.args.timeout)}"] + command
+        script += shlex.join(command)
+        return ["ssh", "-o", "BatchMode=yes", node, script]
+
+
+class SrunLauncher(Launcher):
+    def command(self, node, check):
+        command = [
+            "srun",
+            "--nodes=1",
+            "--ntasks=1",
+            "--exclusive",
+            f"--nodelist={node}",
+            f"--chdir={self.args.workdir}",
+            "--job-name=healthcheck",
+        ]
+        if self.args.slurm_partition:
+            command.append(f"--partition={self.args.slurm_partition}")
+        if self.args.timeout:
+            command.append(f"--time={math.ceil(self.args.timeout / 60)}")
+        return command + [self.args.python] + check
+
+
+launchers = {"srun": SrunLauncher, "ssh": SshLauncher, "local": LocalLauncher}
+
+
+class Fleet:
+    """The checks running, so they can be stopped on an interrupt."""
+
+    def __init__(self):
+        self.processes = {}
+        self.lock = threading.Lock()
+
+    def run(self, node, command, log_path, timeout=None, cwd=None):
+        """
+        Run the check of `node` and wait for it.
+        Returns the report of the node.
+        """
+        started = time.monotonic()
+        report = {"hostname": node, "started": get_timestamp(), "command": command}
+        summary = None
+        timer = None
+        timed_out = threading.Event()
+        try:
+            with open(log_path, "w") as log:
+                process = subprocess.Popen(
+                    command,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    stdin=subprocess.DEVNULL,
+                    text=True,
+                    cwd=cwd,
+                )
+                with self.lock:
+                    self.processes[node] = process
+                if timeout:
+
+                    def expire():
+                        timed_out.set()
+                        process.kill()
+
+                    timer = threading.Timer(timeout, expire)
+                    timer.start()
+                for line in process.stdout:
+                    log.write(line)
+                    log.flush()
+                    if line.startswith(summary_prefix):
+                        summary = json.loads(line[len(summary_prefix) :])
+                returncode = process.wait()
+        except OSError as e:
+            # e.g. the launcher is not installed
+            report.update(status="failed", error=str(e))
+            returncode = None
+        finally:
+            if timer is not None:
+                timer.cancel()
+            with self.lock:
+                self.processes.pop(node, None)
+
+        report["wall_seconds"] = time.monotonic() - started
+        report["returncode"] = returncode
+        report["log"] = log_path
+        if "status" not in report:
+            if timed_out.is_set():
+                report["status"] = "timeout"
+            elif returncode != 0:
+                report["status"] = "failed"
+            elif summary is None:
+                report["status"] = "no summary"
+            else:
+                report["status"] = "ok"
+        report["summary"] = summary
+        return report
+
+    def stop(self):
+        with self.lock:
+            for process in self.processes.values():
+                process.kill()
+
+
+def node_verdict(report):
+    """e.g. "8 GPUs, 1 unhealthy (gpu-1234: HBM BW)" """
+    summary = report["summary"]
+    if "error" in report:
+        return report["error"]
+    if summary is None:
+        return f"see {report['log']}"
+    unhealthy = [gpu for gpu in summary["gpus"] if gpu["Unhealthy"]]
+    degrading = [gpu for gpu in summary["gpus"] if gpu["Degrading"]]
+    text = f"{len(summary['gpus'])} GPUs"
+    for label, gpus, key in [
+        ("unhealthy", unhealthy, "Unhealthy Metrics"),
+        ("degrading", degrading, "Degrading Metrics"),
+    ]:
+        if gpus:
+            details = "; ".join(
+                f"gpu-{gpu['GUID']}: {', '.join(gpu[key])}" for gpu in gpus
+            )
+            text += f", {len(gpus)} {label} ({details})"
+    return text
+
+
+def fleet_totals(reports):
+    totals = {
+        "nodes": len(reports),
+        "gpus": 0,
+        "unhealthy_gpus": 0,
+        "degrading_gpus": 0,
+    }
+    for report in reports:
+        status = report["status"]
+        totals[status] = totals.get(status, 0) + 1
+        if report["summary"] is not None:
+            gpus = report["summary"]["gpus"]
+            totals["gpus"] += len(gpus)
+            totals["unhealthy_gpus"] += sum(1 for gpu in gpus if gpu["Unhealthy"])
+            totals["degrading_gpus"] += sum(1 for gpu in gpus if gpu["Degrading"])
+    walls = sorted(report["wall_seconds"] for report in reports)
+    if walls:
+        totals["wall_seconds"] = {
+            "min": walls[0],
+            "median": walls[len(walls) // 2],
+            "max": walls[-1],
+        }
+    return totals
+
+
+def save_report(path, report):
+    tmp_file = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_file, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the health check on many nodes and write a fleet report.",
+        epilog="Arguments after `--` are passed to benchmark_gpus.py.",
+    )
+    parser.add_argument(
+        "--nodes",
+        type=str,
+        default=None,
+        help="Slurm hostlist of the nodes to check, e.g. node[001-064],login1.",
+    )
+    parser.add_argument(
+        "--partition",
+        type=str,
+        default=None,
+        help="Check the nodes of this Slurm partition.",
+    )
+    parser.add_argument(
+        "--states",
+        type=str,
+        default=None,
+        help="With --partition, only the nodes in these states (e.g. idle,mix).",
+    )
+    parser.add_argument("--launcher", type=str, default="srun", choices=list(launchers))
+    parser.add_argument(
+        "--parallel", type=int, default=8, help="Nodes checked at the same time."
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        help="Seconds after which the check of a node is stopped.",
+    )
+    parser.add_argument(
+        "--prioritize",
+        action="store_true",
+        help="Check the nodes in the priority order of schedule.py (reads --db).",
+    )
+    parser.add_argument(
+        "--db", type=str, default="cluster", help="Path of the cluster database."
+    )
+    parser.add_argument(
+        "--engine", type=str, default="directory", choices=writable_engines
+    )
+    parser.add_argument(
+        "--workdir",
+        type=str,
+        default=os.getcwd(),
+        help="Directory of benchmark_gpus.py on the nodes (srun, ssh).",
+    )
+    parser.add_argument(
+        "--python", type=str, default="python", help="Python on the nodes (srun, ssh)."
+    )
+    parser.add_argument(
+        "--setup",
+        type=str,
+        default=None,
+        help="Shell commands run before the check over ssh, e.g. 'module load rocm'.",
+    )
+    parser.add_argument(
+        "--slurm-partition",
+        type=str,
+        default=None,
+        help="Partition of the job steps started by srun outside of an allocation.",
+    )
+    parser.add_argument(
+        "--fixture",
+        type=str,
+        nargs="+",
+        default=[
+            os.path.join(
+                os.path.dirname(os.path.abspath(__file__)),
+                "example-cluster/nicholson/gpu-19794/1.json",
+            )
+        ],
+        help="Stored results reported by every node of the local launcher.",
+    )
+    parser.add_argument("--log-dir", type=str, default="fleet-logs")
+    parser.add_argument("--report", type=str, default="fleet-report.json")
+    parser.add_argument("check_args", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    nodes = []
+    if args.nodes:
+        nodes += expand_hostlist(args.nodes)
+    if args.partition:
+        nodes += partition_nodes(args.partition, args.states)
+    nodes = list(dict.fromkeys(nodes))
+    if not nodes:
+        parser.error("no nodes to check: pass --nodes or --partition")
+    if args.prioritize:
+        # Not at the top: only needed here
+        from schedule import rank_nodes
+
+        ranked = rank_nodes(open_database(args.db, args.engine), hostnames=nodes)
+        order = {node["hostname"]: i for i, node in enumerate(ranked)}
+        nodes.sort(key=lambda node: order.get(node, len(order)))
+
+    check_args = (
+        args.check_args[1:] if args.check_args[:1] == ["--"] else args.check_args
+    )
+    check = [
+        "benchmark_gpus.py",
+        "--summary",
+        "--db",
+        args.db,
+        "--engine",
+        args.engine,
+    ] + check_args
+    launcher = launchers[args.launcher](args)
+    os.makedirs(args.log_dir, exist_ok=True)
+
+    report = {
+        "started": get_timestamp(),
+        "launcher": args.launcher,
+        "parallel": args.parallel,
+        "nodes": [],
+    }
+    print(f"Checking {len(nodes)} nodes, {args.parallel} at a time ({args.launcher}).")
+    fleet = Fleet()
+    started = time.monotonic()
+    executor = ThreadPoolExecutor(args.parallel)
+    try:
+        futures = [
+            executor.submit(
+                fleet.run,
+                node,
+                launcher.command(node, check),
+                os.path.abspath(os.path.join(args.log_dir, f"{node}.log")),
+                args.timeout,
+                launcher.cwd,
+            )
+            for node in nodes
+        ]
+        # Reported as they finish
+        for done, future in enumerate(as_completed(futures), start=1):
+            node_report = future.result()
+            report["nodes"].append(node_report)
+            print(
+                f"[{done}/{len(nodes)}] {node_report['hostname']:<16}"
+                f" {node_report['status']:<10} {node_report['wall_seconds']:8.1f} s"
+                f"  {node_verdict(node_report)}",
+                flush=True,
+            )
+            report["wall_seconds"] = time.monotonic() - started
+            report["totals"] = fleet_totals(report["nodes"])
+            save_report(args.report, report)
+    except KeyboardInterrupt:
+        print("Interrupted: stopping the checks still running.")
+        fleet.stop()
+        raise
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    report["finished"] = get_timestamp()
+    report["wall_seconds"] = time.monotonic() - started
+    report["nodes"].sort(key=lambda node_report: node_report["hostname"])
+    report["totals"] = fleet_totals(report["nodes"])
+    save_report(args.report, report)
+
+    totals = report["totals"]
+    statuses = ", ".join(
+        f"{totals[status]} {status}"
+        for status in ["ok", "failed", "timeout", "no summary"]
+        if status in totals
+    )
+    print(
+        f"Checked {len(nodes)} nodes in {report['wall_seconds']:.1f} s ({statuses}):"
+        f" {totals['gpus']} GPUs, {totals['unhealthy_gpus']} unhealthy,"
+        f" {totals['degrading_gpus']} degrading. Report in {args.report}."
+    )
+    slowest = sorted(
+        report["nodes"], key=lambda node_report: -node_report["wall_seconds"]
+    )
+    print(
+        "Slowest nodes: "
+        + ", ".join(f"{r['hostname']} ({r['wall_seconds']:.1f} s)" for r in slowest[:5])
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+# Compact in-memory form of the stored results, for fleet-wide analysis.
+#
+# A result decoded from the database is a nested dictionary: 21 metric
+# dictionaries of 7 keys each, plus the `stats`, `health` and `meta` blocks,
+# i.e. a few hundred Python objects. A `BenchmarkRecord` keeps the same
+# information in a handful of slots: the mean, stdev and duration of every
+# metric in `array('d')` rows in the order of `metrics_list`, and the `stats`
+# block in one more. The parts that are the same in most results (the
+# workload of every metric and the device description) are interned, so all
+# the records share one copy of them. The `health` block differs from run to
+# run (e.g. its change points), so it is kept as is.
+#
+# `to_document()` gives back a document equal to the one loaded (numbers
+# stored in the arrays come back as floats). Collections load records
+# directly, without keeping the dictionaries, with
+#   collection.find(query, document_class=BenchmarkRecord.from_document)
+
+import json
+import sys
+from array import array
+
+from scoring import metrics_list
+
+# Values of every metric kept in the arrays
+value_fields = ("mean", "stdev", "duration")
+# Blocks of `stats`, one value per metric each
+stats_fields = ("mean_deviation", "stdev", "z_score")
+# Fields of `meta` kept in slots
+meta_fields = ("id", "hostname", "GUID", "run_id", "timestamp")
+
+metric_index = {metric: i for i, metric in enumerate(metrics_list)}
+
+# Interned values, by repr. There are only a few distinct workloads and
+# devices; the cache is emptied if it grows past `max_interned` anyway, so a
+# long-lived process does not keep every value it ever saw.
+_interned = {}
+max_interned = 1024
+
+
+def intern_value(value):
+    """A shared copy of a JSON value equal to `value`."""
+    # repr is much faster than json.dumps, and tells 1, 1.0 and True apart
+    key = repr(value)
+    if key not in _interned and len(_interned) >= max_interned:
+        _interned.clear()
+    return _interned.setdefault(key, value)
+
+
+def _intern_string(value):
+    # Hostnames and GUIDs repeat in every result of a GPU
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _copy(value):
+    # Interned values are shared, so callers get their own copy
+    return json.loads(json.dumps(value))
+
+
+class BenchmarkRecord:
+    """
+    One stored result. `means`, `stdevs` and `durations` are indexed like
+    `metrics_list` (NaN where the result has no such metric); `stats` is
+    None or the three `stats` blocks one after the other.
+    """
+
+    __slots__ = (
+        "id",
+        "hostname",
+        "guid",
+        "run_id",
+        "timestamp",
+        "means",
+        "stdevs",
+        "durations",
+        "stats",
+        "device",
+        "workloads",
+        "health",
+        "extra",
+    )
+
+    @classmethod
+    def from_document(cls, doc):
+        record = cls()
+        meta = doc.get("meta", {})
+        record.id = meta.get("id")
+        record.hostname = _intern_string(meta.get("hostname"))
+        record.guid = _intern_string(meta.get("GUID"))
+        record.run_id = meta.get("run_id")
+        record.timestamp = meta.get("timestamp")
+        # Whatever does not fit the slots is kept as is
+        extra = {
+            key: value
+            for key, value in doc.items()
+            if key not in ("metrics", "stats", "health", "meta")
+        }
+        meta_extra = {
+            key: value for key, value in meta.items() if key not in meta_fields
+        }
+        if meta_extra:
+            extra["meta"] = meta_extra
+
+        metrics = doc.get("metrics", {})
+        try:
+            # Usual case: every metric measured, with numbers
+            record.means = array("d", [metrics[m]["mean"] for m in metrics_list])
+            record.stdevs = array("d", [metrics[m]["stdev"] for m in metrics_list])
+            record.durations = array(
+                "d", [metrics[m]["duration"] for m in metrics_list]
+            )
+            workloads = [
+                {k: v for k, v in metrics[m].items() if k not in value_fields}
+                for m in metrics_list
+            ]
+            irregular = {}
+        except (KeyError, TypeError):
+            workloads, irregular = record._split_metrics(metrics)
+        record.workloads = intern_value(workloads)
+        record.device = None
+        if "metrics" in doc:
+            record.device = intern_value(
+                {k: v for k, v in metrics.items() if k not in metrics_list}
+            )
+        if irregular:
+            extra["metrics"] = irregular
+
+        stats = doc.get("stats")
+        record.stats = None
+        if stats is not None:
+            try:
+                if set(stats) != set(stats_fields) or any(
+                    len(stats[field]) != len(metrics_list) for field in stats_fields
+                ):
+                    raise KeyError
+                record.stats = array(
+                    "d",
+                    [stats[field][m] for field in stats_fields for m in metrics_list],
+                )
+            except (KeyError, TypeError):
+                extra["stats"] = stats
+        record.health = doc.get("health")
+        record.extra = extra or None
+        return record
+
+    def _split_metrics(self, metrics):
+        """
+        Fill the arrays metric by metric, with NaN for the metrics missing.
+        Returns the workloads and the metrics that do not fit the arrays.
+        """
+        nan = float("nan")
+        self.means = array("d", [nan] * len(metrics_list))
+        self.stdevs = array("d", [nan] * len(metrics_list))
+        self.durations = array("d", [nan] * len(metrics_list))
+        workloads = [None] * len(metrics_list)
+        irregular = {}
+        for i, metric in enumerate(metrics_list):
+            if metric not in metrics:
+                continue
+            values = metrics[metric]
+            if not isinstance(values, dict) or not all(
+                _is_number(values.get(field)) for field in value_fields
+            ):
+                irregular[metric] = values
+                continue
+            self.means[i] = values["mean"]
+            self.stdevs[i] = values["stdev"]
+            self.durations[i] = values["duration"]
+            workloads[i] = {k: v for k, v in values.items() if k not in value_fields}
+        return workloads, irregular
+
+    def to_document(self):
+        """The document this record was loaded from."""
+        doc = {}
+        metrics = {} if self.device is None else _copy(self.device)
+        for i, metric in enumerate(metrics_list):
+            workload = self.workloads[i]
+            if workload is None:
+                continue
+            metrics[metric] = {
+                **workload,
+                "duration": self.durations[i],
+                "mean": self.means[i],
+                "stdev": self.stdevs[i],
+            }
+        if self.device is not None:
+            doc["metrics"] = metrics
+        if self.stats is not None:
+            n = len(metrics_list)
+            doc["stats"] = {
+                field: dict(zip(metrics_list, self.stats[j * n : (j + 1) * n]))
+                for j, field in enumerate(stats_fields)
+            }
+        if self.health is not None:
+            doc["health"] = _copy(self.health)
+        meta = {}
+        for field, value in zip(
+            meta_fields,
+            (self.id, self.hostname, self.guid, self.run_id, self.timestamp),
+        ):
+            if value is not None:
+                meta[field] = value
+        doc["meta"] = meta
+        if self.extra is not None:
+            extra = _copy(self.extra)
+            meta.update(extra.pop("meta", {}))
+            metrics.update(extra.pop("metrics", {}))
+            doc.update(extra)
+        return doc
+
+    def mean(self, metric):
+        """Mean of `metric` (NaN if not measured)."""
+        return self.means[metric_index[metric]]
+
+
+def load_records(collection, query={}):
+    """The results of `collection` matching `query`, as `BenchmarkRecord`s."""
+    return collection.find(query, document_class=BenchmarkRecord.from_document)
@@ -0,0 +1,228 @@
+# Recomputes the `stats` and `health` blocks of every stored result, e.g.
+# after changing the thresholds in `scoring.py` or fixing a scoring bug.
+#
+# Each collection is replayed once in time order: every result is scored
+# against the running population of the results before it (as
+# `benchmark_node` did when it was stored) and fed to the degradation
+# charts, so the cost is linear in the history. Collections are processed
+# in parallel, and documents are replaced atomically with `put`. Runs that
+# live checks store during the rescore keep their verdicts, and are added
+# to the rebuilt charts when the collection is done.
+#
+# Progress is checkpointed in the state of each collection every
+# `--checkpoint-every` documents; `--resume` continues the last run from
+# there instead of starting over.
+#
+#   python rescore.py --db cluster --workers 16
+
+import argparse
+import copy
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from degradation import DegradationTracker
+from degradation import state_key as degradation_state_key
+from locodb.codec import codec_choices, parse_codec
+from locodb.engines import open_database, writable_engines
+from locodb.utility import id_key
+from scoring import RunningPopulation, score_gpu
+
+# Key of the checkpoint stored with each collection
+state_key = "rescore"
+
+
+def sort_key(doc):
+    return (doc["meta"]["timestamp"], id_key(doc["meta"]["id"]))
+
+
+def load_position(position):
+    """`sort_key` of the last document of a checkpoint."""
+    timestamp, doc_id = position
+    return timestamp, tuple(doc_id)
+
+
+def merge_charts(collection, degradation, rescored_ids, live_count, wait=10.0):
+    """
+    Store the rebuilt degradation charts, continued with the runs that live
+    checks stored while the history was rescored (`rescored_ids` are the
+    documents rescored, `live_count` the runs in the charts before). Checks
+    that updated the charts but have not stored their run yet are waited for
+    up to `wait` seconds.
+    """
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        state = collection.get_state(degradation_state_key) or {"count": 0}
+        stored = sum(
+            1
+            for name in collection.list_documents()
+            if name.rsplit(".", 1)[0] not in rescored_ids
+        )
+        if stored >= state["count"] - live_count:
+            break
+        time.sleep(0.1)
+
+    def merge(state):
+        # Under the lock of the charts, so no live update is lost
+        tracker = DegradationTracker(copy.deepcopy(degradation.state))
+        newer = sorted(
+            (doc for doc in collection.find() if doc["meta"]["id"] not in rescored_ids),
+            key=sort_key,
+        )
+        for doc in newer:
+            tracker.update(doc["metrics"], doc["meta"]["timestamp"])
+        return tracker.state
+
+    collection.update_state(degradation_state_key, merge)
+
+
+def rescore_collection(collection, run_id, checkpoint_every=500):
+    """
+    Rescore every document of `collection` in time order, continuing from the
+    checkpoint of `run_id` if there is one. Returns the number of documents rescored.
+    """
+    checkpoint = collection.get_state(state_key)
+    if checkpoint is None or checkpoint["run_id"] != run_id:
+        checkpoint = {"run_id": run_id, "done": False, "position": None, "count": 0}
+        population = RunningPopulation()
+        degradation = DegradationTracker()
+    elif checkpoint["done"]:
+        return 0
+    else:
+        population = RunningPopulation(checkpoint["population"])
+        degradation = DegradationTracker(checkpoint["degradation"])
+
+    docs = sorted(collection.find(), key=sort_key)
+    rescored_ids = {doc["meta"]["id"] for doc in docs}
+    # Read after the listing, so every run counted later is stored after it
+    state = collection.get_state(degradation_state_key)
+    live_count = state["count"] if state is not None else 0
+    if checkpoint["position"] is not None:
+        position = load_position(checkpoint["position"])
+        docs = [doc for doc in docs if sort_key(doc) > position]
+
+    def save(done):
+        checkpoint["population"] = population.state()
+        checkpoint["degradation"] = degradation.state
+        checkpoint["done"] = done
+        collection.set_state(state_key, checkpoint)
+
+    rescored = 0
+    for start in range(0, len(docs), checkpoint_every):
+        batch = docs[start : start + checkpoint_every]
+        for doc in batch:
+            gpu_data = doc["metrics"]
+            gpu_stats, gpu_health = score_gpu(gpu_data, *population.summary())
+            population.add(gpu_data)
+            gpu_health.update(degradation.update(gpu_data, doc["meta"]["timestamp"]))
+            doc["stats"] = gpu_stats
+            doc["health"] = gpu_health
+        # Written before the checkpoint is saved, so an interrupted batch is redone
+        collection.put_many((doc["meta"]["id"], doc) for doc in batch)
+        checkpoint["position"] = list(sort_key(batch[-1]))
+        checkpoint["count"] += len(batch)
+        rescored += len(batch)
+        save(done=False)
+
+    # Live runs continue the degradation charts from the end of the history
+    merge_charts(collection, degradation, rescored_ids, live_count)
+    save(done=True)
+    return rescored
+
+
+def _rescore_collection(task):
+    db_path, engine, codec_spec, omit, db_name, collection_name, run_id, every = task
+    client = open_database(db_path, engine, parse_codec(codec_spec, omit))
+    collection = client[db_name][collection_name]
+    return db_name, collection_name, rescore_collection(collection, run_id, every)
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_checkpoint(path, checkpoint):
+    tmp_file = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_file, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Recompute the stats and health of every stored result, in parallel."
+    )
+    parser.add_argument(
+        "--db", type=str, default="cluster", help="Path of the cluster database."
+    )
+    parser.add_argument(
+        "--engine", type=str, default="directory", choices=writable_engines
+    )
+    parser.add_argument("--codec", type=str, default="json", choices=codec_choices)
+    parser.add_argument(
+        "--omit-stats",
+        action="store_true",
+        help="Do not store the recomputed `stats` block.",
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--checkpoint-every",
+        type=int,
+        default=500,
+        help="Documents rescored between two checkpoints of a collection.",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        default="rescore-checkpoint.json",
+        help="File recording the run to resume.",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue the last run from its checkpoints instead of starting over.",
+    )
+    args = parser.parse_args()
+
+    checkpoint = load_checkpoint(args.checkpoint) if args.resume else None
+    if checkpoint is None:
+        checkpoint = {"run_id": uuid.uuid4().hex, "db": args.db}
+        save_checkpoint(args.checkpoint, checkpoint)
+    elif checkpoint["db"] != args.db:
+        raise ValueError(f"{args.checkpoint} is a checkpoint of {checkpoint['db']}")
+    print(f"Rescoring {args.db} (run {checkpoint['run_id']})")
+
+    omit = ["stats"] if args.omit_stats else []
+    client = open_database(args.db, args.engine)
+    tasks = [
+        (
+            args.db,
+            args.engine,
+            args.codec,
+            omit,
+            db_name,
+            collection_name,
+            checkpoint["run_id"],
+            args.checkpoint_every,
+        )
+        for db_name in sorted(client.list_databases())
+        for collection_name in sorted(client[db_name].list_collections())
+        if collection_name.startswith("gpu-")
+    ]
+    total = 0
+    with ProcessPoolExecutor(args.workers) as executor:
+        futures = [executor.submit(_rescore_collection, task) for task in tasks]
+        for future in as_completed(futures):
+            db_name, collection_name, rescored = future.result()
+            total += rescored
+            print(f"{db_name}/{collection_name}: rescored {rescored} documents")
+    print(f"Rescored {total} documents in {len(tasks)} collections.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+# Chooses which nodes to health check next.
+#
+# Every GPU gets a priority from the latest results in the database: how
+# long ago it was checked (relative to `--target-age`), how many of its
+# recent checks were outliers, and whether it is unhealthy or degrading.
+# A node is checked as a whole, so its priority is that of its worst GPU.
+# Nodes are then taken in priority order and packed into `--parallel`
+# concurrent slots while the estimated time of every slot stays within the
+# sweep `--budget`. The time of a node is estimated from the phases timed
+# in `meta.timings` by its latest check.
+#
+#   python schedule.py --db cluster --budget 3600 --parallel 8
+#   python schedule.py --db cluster --budget 3600 --sbatch plan.sh
+
+import argparse
+import json
+import math
+from datetime import datetime, timezone
+
+from locodb.engines import engines, open_database
+from locodb.utility import id_key, parse_timestamp
+
+# Weights of the risk factors, in units of "one target age overdue"
+# (`outlier_weight` is for every recent check being an outlier)
+outlier_weight = 10.0
+unhealthy_weight = 10.0
+degrading_weight = 5.0
+# Nodes never checked come before any other
+never_checked_priority = 1e6
+
+# Phases of `benchmark_node` (spans nested in these are not added again)
+phases = [
+    "roofline",
+    "rocm-smi",
+    "parse",
+    "load_history",
+    "statistics",
+    "degradation",
+    "write",
+    "export",
+]
+
+
+def check_duration(doc):
+    """Seconds taken by the check that produced `doc`, or None if it was not timed."""
+    spans = doc.get("meta", {}).get("timings", {}).get("spans")
+    if not spans:
+        return None
+    return sum(spans[phase]["seconds"] for phase in phases if phase in spans)
+
+
+def recent_documents(collection, latest, history):
+    """The latest document and up to `history - 1` before it (by ID)."""
+    docs = [latest]
+    latest_key = id_key(latest["meta"]["id"])
+    earlier = sorted(
+        (
+            doc_id
+            for name in collection.list_documents()
+            if id_key(doc_id := name.rsplit(".", 1)[0]) < latest_key
+        ),
+        key=id_key,
+    )
+    # Only the last ones are read
+    for doc_id in reversed(earlier):
+        if len(docs) == history:
+            break
+        doc = collection.get(doc_id)
+        if doc is not None:  # Unless deleted after the listing
+            docs.append(doc)
+    return docs
+
+
+def gpu_priority(docs, now, target_age):
+    """
+    Priority of a GPU from its recent documents (latest first).
+    Returns the priority and the reasons behind it.
+    """
+    latest = docs[0]
+    age = (now - parse_timestamp(latest["meta"]["timestamp"])).total_seconds()
+    priority = age / target_age
+    reasons = [f"checked {age / 3600:.1f} h ago"]
+
+    outliers = sum(1 for doc in docs if doc.get("health", {}).get("Outlier"))
+    if outliers:
+        priority += outlier_weight * outliers / len(docs)
+        reasons.append(f"{outliers}/{len(docs)} recent outliers")
+    health = latest.get("health", {})
+    if health.get("Unhealthy"):
+        priority += unhealthy_weight
+        reasons.append("unhealthy: " + ", ".join(health.get("Unhealthy Metrics", [])))
+    if health.get("Degrading"):
+        priority += degrading_weight
+        reasons.append("degrading: " + ", ".join(health.get("Degrading Metrics", [])))
+    return priority, reasons
+
+
+def rank_nodes(
+    client, now=None, target_age=86400, history=10, default_duration=600, hostnames=()
+):
+    """
+    Priority, estimated duration and reasons of every node, highest priority
+    first. Nodes in `hostnames` without any result come first.
+    """
+    now = now or datetime.now(timezone.utc)
+    nodes = {}
+    for hostname in sorted(client.list_databases()):
+        database = client[hostname]
+        node = {"hostname": hostname, "priority": 0.0, "duration": None, "reasons": []}
+        for collection_name in sorted(database.list_collections()):
+            if not collection_name.startswith("gpu-"):
+                continue
+            collection = database[collection_name]
+            latest = collection.find_latest()
+            if latest is None:
+                continue
+            priority, reasons = gpu_priority(
+                recent_documents(collection, latest, history), now, target_age
+            )
+            if priority > node["priority"] or not node["reasons"]:
+                node["priority"] = priority
+                node["reasons"] = [f"{collection_name}: {reason}" for reason in reasons]
+            duration = check_duration(latest)
+            if duration is not None:
+                node["duration"] = max(node["duration"] or 0, duration)
+        if node["reasons"]:
+            nodes[hostname] = node
+    for hostname in hostnames:
+        if hostname not in nodes:
+            nodes[hostname] = {
+                "hostname": hostname,
+                "priority": never_checked_priority,
+                "duration": None,
+                "reasons": ["never checked"],
+            }
+    for node in nodes.values():
+        if node["duration"] is None:
+            node["duration"] = default_duration
+    return sorted(nodes.values(), key=lambda node: -node["priority"])
+
+
+def plan_sweep(nodes, budget, parallel=1, min_priority=0.0):
+    """
+    Assign nodes, in the given order, to the least loaded of `parallel` slots
+    as long as the slot stays within `budget` seconds.
+    Returns the scheduled nodes (with their slot and start) and the deferred ones.
+    """
+    slots = [0.0] * parallel
+    scheduled, deferred = [], []
+    for node in nodes:
+        if node["priority"] < min_priority:
+            continue  # Not due
+        slot = min(range(parallel), key=lambda i: slots[i])
+        if slots[slot] + node["duration"] > budget:
+            deferred.append(node)
+            continue
+        scheduled.append({**node, "slot": slot, "start": slots[slot]})
+        slots[slot] += node["duration"]
+    return scheduled, deferred
+
+
+def sbatch_plan(scheduled, job_script, margin=1.5):
+    """Shell script submitting one job per scheduled node, highest priority first."""
+    lines = ["#!/bin/bash", "# Generated by schedule.py, highest priority first", ""]
+    for node in scheduled:
+        minutes = max(1, math.ceil(node["duration"] * margin / 60))
+        lines.append(f"# priority {node['priority']:.2f}: {'; '.join(node['reasons'])}")
+        lines.append(
+            f"sbatch --nodelist={node['hostname']} --time={minutes}"
+            f" --job-name=healthcheck-{node['hostname']} {job_script}"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Prioritize the nodes to health check within a time budget."
+    )
+    parser.add_argument(
+        "--db", type=str, default="cluster", help="Path of the cluster database."
+    )
+    parser.add_argument(
+        "--engine", type=str, default="directory", choices=list(engines)
+    )
+    parser.add_argument(
+        "--budget", type=float, default=3600, help="Seconds available for the sweep."
+    )
+    parser.add_argument(
+        "--parallel", type=int, default=1, help="Nodes checked at the same time."
+    )
+    parser.add_argument(
+        "--target-age",
+        type=float,
+        default=24,
+        help="Hours after which a GPU is due for a check.",
+    )
+    parser.add_argument(
+        "--history", type=int, default=10, help="Recent checks counted for outliers."
+    )
+    parser.add_argument(
+        "--default-duration",
+        type=float,
+        default=600,
+        help="Seconds assumed for a node whose checks were not timed.",
+    )
+    parser.add_argument(
+        "--nodes",
+        type=str,
+        default="",
+        help="Comma-separated hostnames to include even if never checked.",
+    )
+    parser.add_argument(
+        "--min-priority",
+        type=float,
+        default=0.0,
+        help="Leave out nodes below this priority (1 is a GPU due for a check).",
+    )
+    parser.add_argument("--json", action="store_true", help="Print the plan as JSON.")
+    parser.add_argument(
+        "--sbatch",
+        type=str,
+        default=None,
+        help="Write a script submitting one Slurm job per scheduled node.",
+    )
+    parser.add_argument("--job-script", type=str, default="slurm/healthcheck.sh")
+    args = parser.parse_args()
+
+    client = open_database(args.db, args.engine)
+    nodes = rank_nodes(
+        client,
+        target_age=args.target_age * 3600,
+        history=args.history,
+        default_duration=args.default_duration,
+        hostnames=[hostname for hostname in args.nodes.split(",") if hostname],
+    )
+    scheduled, deferred = plan_sweep(
+        nodes, args.budget, args.parallel, args.min_priority
+    )
+
+    if args.sbatch is not None:
+        with open(args.sbatch, "w") as f:
+            f.write(sbatch_plan(scheduled, args.job_script))
+        print(f"Wrote {len(scheduled)} submissions to {args.sbatch}.")
+    elif args.json:
+        print(json.dumps({"scheduled": scheduled, "deferred": deferred}, indent=2))
+        return
+    else:
+        for node in scheduled:
+            print(
+                f"{node['hostname']:<16} priority {node['priority']:8.2f}"
+                f"  ~{node['duration']:6.0f} s  slot {node['slot']}  {'; '.join(node['reasons'])}"
+            )
+    print(f"{len(scheduled)} nodes scheduled, {len(deferred)} deferred to the next sweep.")
+
+
+if __name__ == "__main__":
+    main()
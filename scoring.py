@@ -0,0 +1,169 @@
+# Scoring of `rocm-amdgpu-bench` results against the history of each GPU.
+
+metrics_list = [
+    "HBM BW",
+    "MALL BW",
+    "L2 BW",
+    "L1 BW",
+    "LDS BW",
+    "Peak FLOPs (FP8)",
+    "Peak FLOPs (FP16)",
+    "Peak FLOPs (BF16)",
+    "Peak FLOPs (FP32)",
+    "Peak FLOPs (FP64)",
+    "Peak IOPs (INT8)",
+    "Peak IOPs (INT32)",
+    "Peak IOPs (INT64)",
+    "Peak MFMA FLOPs (F4)",
+    "Peak MFMA FLOPs (F6)",
+    "Peak MFMA FLOPs (F8)",
+    "Peak MFMA FLOPs (F16)",
+    "Peak MFMA FLOPs (BF16)",
+    "Peak MFMA FLOPs (F32)",
+    "Peak MFMA FLOPs (F64)",
+    "Peak MFMA IOPs (I8)",
+]
+
+# A metric further than `outlier_sigma` population standard deviations from
+# the population mean is an outlier, and further than `unhealthy_sigma`,
+# unhealthy. Only populations larger than `min_population` are judged.
+# After changing these, rescore the history with `python rescore.py`.
+outlier_sigma = 3
+unhealthy_sigma = 5
+min_population = 30
+
+
+def metric_means(benchmark):
+    """
+    Mean of every metric of a stored result, in the order of `metrics_list`.
+    Results may be documents or `BenchmarkRecord`s (see `records.py`).
+    """
+    if isinstance(benchmark, dict):
+        return [benchmark["metrics"][metric]["mean"] for metric in metrics_list]
+    return benchmark.means
+
+
+def population_summary(population_benchmarks):
+    """
+    Compute the population mean and standard deviation of every metric.
+    Returns the population size and a dictionary mapping metric to (mean, stdev).
+    """
+    population = len(population_benchmarks)
+    rows = [metric_means(benchmark) for benchmark in population_benchmarks]
+    summary = {}
+    for i, metric in enumerate(metrics_list):
+        if population != 0:
+            column = [row[i] for row in rows]
+            population_mean = sum(column) / population
+            population_stdev = (
+                sum([(value - population_mean) ** 2 for value in column]) / population
+            ) ** 0.5
+        else:
+            population_mean = 0
+            population_stdev = 0
+        summary[metric] = (population_mean, population_stdev)
+    return population, summary
+
+
+class RunningPopulation:
+    """
+    Population mean and standard deviation of every metric, updated one
+    benchmark at a time (Welford's algorithm) so long histories can be
+    scored without re-reading every previous run.
+    """
+
+    def __init__(self, state=None):
+        if state is None:
+            state = {
+                "population": 0,
+                "means": {metric: 0.0 for metric in metrics_list},
+                "m2": {metric: 0.0 for metric in metrics_list},
+            }
+        self.population = state["population"]
+        self.means = dict(state["means"])
+        self.m2 = dict(state["m2"])
+
+    def state(self):
+        """JSON-serializable state, to continue with `RunningPopulation(state)`."""
+        return {"population": self.population, "means": self.means, "m2": self.m2}
+
+    def add(self, gpu_data):
+        """Add the metrics of one benchmark to the population."""
+        self.population += 1
+        for metric in metrics_list:
+            value = gpu_data[metric]["mean"]
+            delta = value - self.means[metric]
+            self.means[metric] += delta / self.population
+            self.m2[metric] += delta * (value - self.means[metric])
+
+    def summary(self):
+        """Same return value as `population_summary`."""
+        summary = {}
+        for metric in metrics_list:
+            if self.population != 0:
+                summary[metric] = (
+                    self.means[metric],
+                    (self.m2[metric] / self.population) ** 0.5,
+                )
+            else:
+                summary[metric] = (0, 0)
+        return self.population, summary
+
+
+def score_gpu(gpu_data, population, summary):
+    """
+    Score one benchmark against a population summary.
+    Returns the `stats` and `health` blocks stored with each result.
+    """
+    gpu_stats = {
+        "mean_deviation": {},
+        "stdev": {},
+        "z_score": {},
+    }
+
+    gpu_health = {
+        "Outlier": False,
+        "Outlier Metrics": [],
+        "Unhealthy": False,
+        "Unhealthy Metrics": [],
+        "Message": "",
+    }
+
+    for metric in metrics_list:
+        population_mean, population_stdev = summary[metric]
+        if population != 0:
+            population_z_score = (
+                (gpu_data[metric]["mean"] - population_mean) / population_stdev
+                if population_stdev != 0
+                else 0
+            )
+        else:
+            population_z_score = 0
+
+        gpu_stats["mean_deviation"][metric] = gpu_data[metric]["mean"] - population_mean
+        gpu_stats["stdev"][metric] = population_stdev
+        gpu_stats["z_score"][metric] = population_z_score
+
+        deviation = abs(gpu_data[metric]["mean"] - population_mean)
+        if deviation > outlier_sigma * population_stdev:
+            # Mark as outlier if check lands past 3 sigma
+            # Note: This does not necessarily mean the GPU is unhealthy
+            # (should correlate to 0.3% of all health checks)
+            if population > min_population:
+                gpu_health["Outlier"] = True
+                gpu_health["Outlier Metrics"].append(metric)
+                # Mark as unhealthy if the metric is >= 5 sigma
+                # (should correlate to 0.00006% of health checks)
+                if deviation > unhealthy_sigma * population_stdev:
+                    gpu_health["Unhealthy"] = True
+                    gpu_health["Unhealthy Metrics"].append(metric)
+                    gpu_health["Message"] = (
+                        f"Health metric exceeds {unhealthy_sigma} sigma threshold."
+                        " Likely unhealthy GPU."
+                    )
+            else:
+                gpu_health["Message"] = (
+                    f"Population size ({population}) is too small to determine outliers."
+                )
+
+    return gpu_stats, gpu_health
@@ -0,0 +1,27 @@
+#!/bin/bash
+#SBATCH --job-name=healthcheck-fleet
+#SBATCH --nodes=16
+#SBATCH --exclusive
+#SBATCH --time=02:00:00
+#SBATCH -o fleet-%j.out
+#SBATCH -e fleet-%j.err
+
+# Health check of every node of the allocation, one job step per node
+# (instead of one job per node, as with nicholson.sh)
+
+# Load ROCm
+module load rocm/6.4.0
+
+# Activate and log conda environment
+source "$HOME/miniconda3/etc/profile.d/conda.sh"
+conda activate gpu-healthchecks
+conda env list
+
+# Run benchmark / health check on all the nodes; the environment is
+# inherited by the job steps
+python orchestrate.py \
+    --nodes "$SLURM_JOB_NODELIST" \
+    --launcher srun \
+    --parallel "$SLURM_JOB_NUM_NODES" \
+    --log-dir "fleet-logs-$SLURM_JOB_ID" \
+    --report "fleet-report-$SLURM_JOB_ID.json"
@@ -0,0 +1,20 @@
+#!/bin/bash
+#SBATCH --job-name=healthcheck
+#SBATCH --nodes=1
+#SBATCH --exclusive
+#SBATCH -o healthcheck-%N-%j.out
+#SBATCH -e healthcheck-%N-%j.err
+
+# Health check of a single node, submitted by the plan of `schedule.py`
+# (which sets --nodelist and --time)
+
+# Load ROCm
+module load rocm/6.4.0
+
+# Activate and log conda environment
+source "$HOME/miniconda3/etc/profile.d/conda.sh"
+conda activate gpu-healthchecks
+conda env list
+
+# Run benchmark / health check
+python benchmark_gpus.py
@@ -0,0 +1,38 @@
+import copy
+import json
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+# The scripts and locodb live at the top of the repository
+root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(root))
+
+from scoring import metrics_list  # noqa: E402
+
+template = json.loads((root / "example-cluster/nicholson/gpu-19794/1.json").read_text())
+
+
+@pytest.fixture
+def make_result():
+    """
+    Factory of results like those `benchmark_node` stores: the metrics of an
+    example-cluster result with every mean multiplied by `scale`, the `i`th
+    run of the GPU `guid` of `hostname` (one hour apart).
+    """
+
+    def make(scale=1.0, i=0, hostname="node01", guid=7):
+        doc = {"metrics": copy.deepcopy(template["metrics"])}
+        for metric in metrics_list:
+            doc["metrics"][metric]["mean"] *= scale
+        timestamp = datetime(2025, 6, 1) + timedelta(hours=i)
+        doc["meta"] = {
+            "hostname": hostname,
+            "GUID": guid,
+            "timestamp": timestamp.strftime("%Y-%m-%d %H:%M:%S UTC"),
+        }
+        return doc
+
+    return make
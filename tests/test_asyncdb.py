@@ -0,0 +1,85 @@
+import asyncio
+import time
+
+import pytest
+
+from locodb.asyncdb import AsyncLocoDatabase
+
+
+@pytest.mark.parametrize("engine", ["directory", "sqlite"])
+def test_concurrent_inserts(tmp_path, engine):
+    path = tmp_path / ("cluster.sqlite" if engine == "sqlite" else "cluster")
+
+    async def insert_all():
+        async with AsyncLocoDatabase(path, engine, max_workers=16) as client:
+            collection = client["node01"]["gpu-1"]
+            results = await asyncio.gather(
+                *(collection.insert_one({"value": i}) for i in range(200))
+            )
+            docs = await collection.find().to_list()
+        return results, docs
+
+    results, docs = asyncio.run(insert_all())
+    ids = [result["_id"] for result in results]
+    assert len(set(ids)) == 200
+    assert sorted(doc["value"] for doc in docs) == list(range(200))
+    # No temporary file left behind
+    assert not list((tmp_path / "cluster").rglob("*.tmp"))
+
+
+def test_fan_out(tmp_path):
+    async def latest():
+        async with AsyncLocoDatabase(tmp_path / "cluster") as client:
+            database = client["node01"]
+            for name in ["gpu-1", "gpu-2"]:
+                await database[name].insert_many([{"value": 1}, {"value": 2}])
+            return await database.fan_out("find_latest")
+
+    results = asyncio.run(latest())
+    assert {name: doc["value"] for name, doc in results.items()} == {
+        "gpu-1": 2,
+        "gpu-2": 2,
+    }
+
+
+class Slow(dict):
+    """Documents that take a while to convert, for cancelling a batch."""
+
+    def __init__(self, doc):
+        time.sleep(0.01)
+        super().__init__(doc)
+
+
+@pytest.mark.parametrize("engine", ["directory", "sqlite"])
+def test_cursor(tmp_path, engine):
+    path = tmp_path / ("cluster.sqlite" if engine == "sqlite" else "cluster")
+
+    async def read():
+        async with AsyncLocoDatabase(path, engine) as client:
+            collection = client["node01"]["gpu-1"]
+            await collection.insert_many([{"value": i} for i in range(10)])
+            run = client.run
+            batches = []
+
+            async def counted_run(func, *args):
+                result = await run(func, *args)
+                if func.__name__ == "_next_batch":
+                    batches.append(len(result))
+                return result
+
+            client.run = counted_run
+            cursor = collection.find(batch_size=4, document_class=Slow)
+            first = [await cursor.__anext__() for _ in range(4)]
+            assert all(isinstance(doc, Slow) for doc in first)
+            # Cancelled while the next batch is read: no document is lost
+            task = asyncio.create_task(cursor.__anext__())
+            await asyncio.sleep(0.005)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            rest = await cursor.to_list()
+            return batches, first + rest
+
+    batches, docs = asyncio.run(read())
+    assert batches == [4, 4, 2, 0]
+    assert sorted(doc["value"] for doc in docs) == list(range(10))
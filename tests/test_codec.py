@@ -0,0 +1,66 @@
+import pytest
+
+from locodb.codec import Codec, codec_choices, decode, parse_codec
+from locodb.engines import open_database
+from locodb.rewrite import rewrite
+
+
+@pytest.mark.parametrize("spec", codec_choices)
+def test_round_trip(spec, make_result):
+    doc = make_result()
+    doc["stats"] = {"z_score": {"HBM BW": 0.5}}
+    codec = parse_codec(spec)
+    assert codec.name == spec
+    assert decode(codec.encode(doc)) == doc
+    # Identical documents give identical bytes
+    assert codec.encode(doc) == codec.encode(doc)
+
+
+def test_omit(make_result):
+    doc = {**make_result(), "stats": {"z_score": {}}}
+    data = parse_codec("msgpack+zstd", ["stats"]).encode(doc)
+    assert "stats" not in decode(data)
+    assert "stats" in doc
+
+
+def test_invalid():
+    with pytest.raises(ValueError):
+        parse_codec("json+lz4")
+    with pytest.raises(ValueError):
+        Codec("yaml")
+    with pytest.raises(ValueError):
+        open_database("unused", "sqlite", parse_codec("json+gzip"))
+
+
+def test_mixed_reads_and_rewrite(tmp_path, make_result):
+    path = tmp_path / "cluster"
+    collection = open_database(path)["node01"]["gpu-7"]
+    collection.insert_many([make_result(1.0, i) for i in range(10)])
+    for i, spec in enumerate(["json+gzip", "msgpack", "msgpack+zstd"]):
+        open_database(path, codec=parse_codec(spec))["node01"]["gpu-7"].insert_one(
+            make_result(1.1, 10 + i)
+        )
+    docs = sorted(collection.find(), key=lambda doc: doc["meta"]["timestamp"])
+    assert len(docs) == 13
+    assert docs[-1]["metrics"] == make_result(1.1, 12)["metrics"]
+
+    files = list((path / "node01" / "gpu-7").glob("*.json"))
+    before = sum(file.stat().st_size for file in files)
+    assert rewrite(str(path), "directory", "json+zstd", ["stats"], workers=1) == 13
+    assert sorted(collection.find(), key=lambda doc: doc["meta"]["timestamp"]) == docs
+    assert sum(file.stat().st_size for file in files) < before
+    for file in files:
+        assert file.read_bytes()[:4] == b"\x28\xb5\x2f\xfd"
+
+
+@pytest.mark.parametrize("engine", ["directory", "sqlite"])
+def test_rewrite_records_no_changes(tmp_path, engine, make_result):
+    path = tmp_path / "cluster"
+    collection = open_database(path, engine)["node01"]["gpu-7"]
+    collection.insert_many([make_result(1.0, i) for i in range(3)])
+    stream = collection.watch()
+    assert rewrite(str(path), engine, "json", ["stats"], workers=1) == 3
+    assert stream.try_next() is None
+    collection.put("1", make_result(1.1, 0))
+    assert stream.try_next()["operationType"] == "replace"
+    stream.close()
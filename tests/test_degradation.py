@@ -0,0 +1,135 @@
+import copy
+import random
+import threading
+
+import pytest
+
+from degradation import (
+    DegradationTracker,
+    backfill_collection,
+    state_key,
+    update_collection,
+    update_ingested,
+    warmup,
+)
+from locodb.engines import open_database
+from locodb.ingest import ingest_records
+
+
+def first_alarm(scales, make_result):
+    """Index of the first run flagged as degrading, or None."""
+    tracker = DegradationTracker()
+    for i, scale in enumerate(scales):
+        doc = make_result(scale, i)
+        if tracker.update(doc["metrics"], doc["meta"]["timestamp"])["Degrading"]:
+            return i
+    return None
+
+
+def noise(n, seed=0):
+    rng = random.Random(seed)
+    return [rng.gauss(1.0, 0.002) for _ in range(n)]
+
+
+def test_stable_gpu_not_degrading(make_result):
+    assert first_alarm(noise(300), make_result) is None
+
+
+def test_step_detected(make_result):
+    scales = noise(100)
+    scales[60:] = [scale * 0.97 for scale in scales[60:]]
+    alarm = first_alarm(scales, make_result)
+    assert alarm is not None and 60 <= alarm < 70
+
+
+def test_linear_drift_detected(make_result):
+    # Losing 0.02% per run: no single run is a 3 sigma outlier for a while
+    scales = [
+        scale * (1 - 0.0002 * max(0, i - warmup)) for i, scale in enumerate(noise(400))
+    ]
+    alarm = first_alarm(scales, make_result)
+    assert alarm is not None and alarm < 200
+
+
+def test_change_point(make_result):
+    tracker = DegradationTracker()
+    scales = noise(100)
+    scales[60:] = [scale * 0.97 for scale in scales[60:]]
+    for i, scale in enumerate(scales):
+        doc = make_result(scale, i)
+        verdict = tracker.update(doc["metrics"], doc["meta"]["timestamp"])
+    # Close to the step (noise may start the CUSUM a run or two early)
+    near_step = {make_result(1.0, i)["meta"]["timestamp"] for i in range(57, 61)}
+    assert verdict["Change Points"]["HBM BW"] in near_step
+
+
+@pytest.mark.parametrize("engine", ["directory", "sqlite"])
+def test_concurrent_updates(tmp_path, engine, make_result):
+    path = tmp_path / ("cluster.sqlite" if engine == "sqlite" else "cluster")
+    client = open_database(path, engine)
+    collection = client["node01"]["gpu-7"]
+    doc = make_result()
+
+    def run():
+        # One client per thread, like separate jobs
+        collection = open_database(path, engine)["node01"]["gpu-7"]
+        for _ in range(10):
+            update_collection(collection, doc["metrics"], doc["meta"]["timestamp"])
+
+    threads = [threading.Thread(target=run) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert collection.get_state(state_key)["count"] == 80
+
+
+def test_spooled_runs_tracked_at_ingestion(tmp_path, make_result):
+    client = open_database(tmp_path / "cluster")
+    docs = [make_result(scale, i) for i, scale in enumerate(noise(50))]
+    for i, doc in enumerate(docs):
+        doc["meta"]["run_id"] = str(i)
+        doc["health"] = {"Outlier": False}
+    records = [
+        {"database": "node01", "collection": "gpu-7", "document": doc}
+        for doc in reversed(docs)
+    ]
+    assert ingest_records(client, records, prepare=update_ingested) == (50, 0)
+    collection = client["node01"]["gpu-7"]
+    assert collection.get_state(state_key)["count"] == 50
+    assert all("Degrading" in doc["health"] for doc in collection.find())
+    # Ingesting the spool again does not update the charts twice
+    assert ingest_records(client, records, prepare=update_ingested) == (0, 50)
+    assert collection.get_state(state_key)["count"] == 50
+
+
+def test_ingestion_retried_after_crash(tmp_path, make_result):
+    client = open_database(tmp_path / "cluster")
+    collection = client["node01"]["gpu-7"]
+    docs = [make_result(scale, i) for i, scale in enumerate(noise(40))]
+    for i, doc in enumerate(docs):
+        doc["meta"]["run_id"] = str(i)
+    records = [
+        {"database": "node01", "collection": "gpu-7", "document": copy.deepcopy(doc)}
+        for doc in docs
+    ]
+    # The charts were updated, but the ingester died before inserting
+    update_ingested(collection, copy.deepcopy(docs[:30]))
+    assert ingest_records(client, records, prepare=update_ingested) == (40, 0)
+    assert collection.get_state(state_key)["count"] == 40
+    expected = DegradationTracker()
+    verdicts = [
+        expected.update(doc["metrics"], doc["meta"]["timestamp"]) for doc in docs
+    ]
+    stored = sorted(collection.find(), key=lambda doc: int(doc["meta"]["run_id"]))
+    assert [doc["health"] for doc in stored] == verdicts
+
+
+def test_backfill_mixed_ids(tmp_path, make_result):
+    collection = open_database(tmp_path / "cluster")["node01"]["gpu-7"]
+    collection.insert_many([make_result(1.0, i) for i in range(5)])
+    imported = make_result(1.0, 5)
+    imported["meta"]["id"] = "imported"
+    collection.put("imported", imported)
+    assert backfill_collection(collection) == 6
+    assert collection.get_state(state_key)["count"] == 6
@@ -0,0 +1,60 @@
+# The directory and sqlite engines behave the same through the
+# LocoDatabase API.
+
+import pytest
+
+from locodb.engines import open_database
+
+
+def database_path(tmp_path, engine):
+    return tmp_path / ("cluster.sqlite" if engine == "sqlite" else "cluster")
+
+
+@pytest.fixture(params=["directory", "sqlite"])
+def client(request, tmp_path):
+    return open_database(database_path(tmp_path, request.param), request.param)
+
+
+def test_insert_and_read(client):
+    collection = client["node01"]["gpu-1"]
+    assert collection.insert_one({"value": 1}) == {"_id": "1"}
+    inserted = collection.insert_many([{"value": 2}, {"value": 3}])
+    assert inserted == {"inserted_ids": ["2", "3"]}
+
+    assert sorted(doc["value"] for doc in collection.find()) == [1, 2, 3]
+    assert collection.get("2")["value"] == 2
+    assert collection.get("4") is None
+    assert collection.find_latest()["value"] == 3
+    assert collection.find_one({"value": 3})["meta"]["id"] == "3"
+    assert sorted(collection.list_documents()) == ["1.json", "2.json", "3.json"]
+    assert client.list_databases() == ["node01"]
+    assert client["node01"].list_collections() == ["gpu-1"]
+
+
+def test_put_delete_and_state(client):
+    collection = client["node01"]["gpu-1"]
+    collection.put("abc", {"value": 1})
+    assert collection.get("abc") == {"value": 1}
+    collection.put("abc", {"value": 2})
+    assert collection.find() == [{"value": 2}]
+    assert collection.delete_one({"value": 2}) == {"deleted_count": 1}
+    assert collection.delete_one({"value": 2}) == {"deleted_count": 0}
+    assert collection.find() == []
+
+    assert collection.get_state("charts") is None
+    collection.set_state("charts", {"n": 1})
+    assert collection.get_state("charts") == {"n": 1}
+    assert collection.list_states() == ["charts"]
+
+
+def test_sqlite_lookups_do_not_register_names(tmp_path):
+    client = open_database(tmp_path / "cluster.sqlite", "sqlite")
+    collection = client["node01"]["gpu-1"]
+    assert collection.find() == []
+    assert collection.get_state("charts") is None
+    assert client.list_databases() == []
+    assert client["node01"].list_collections() == []
+
+    collection.insert_one({"value": 1})
+    assert client.list_databases() == ["node01"]
+    assert client["node01"].list_collections() == ["gpu-1"]
@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+pq = pytest.importorskip("pyarrow.parquet")
+
+from export_parquet import export_cluster, metric_column  # noqa: E402
+from locodb.engines import open_database  # noqa: E402
+
+
+def result(value, day=1):
+    return {
+        "metrics": {"HBM BW": {"mean": value, "stdev": 0.0, "duration": 1.0}},
+        "meta": {"GUID": 7, "timestamp": f"2025-06-{day:02d} 00:00:00 UTC"},
+    }
+
+
+def exported_rows(output):
+    rows = {}
+    for file in sorted(output.glob("hostname=*/month=*/part-*.parquet")):
+        for row in pq.read_table(file).to_pylist():
+            key = (row["GUID"], row["id"])
+            assert key not in rows, f"{key} exported twice"
+            rows[key] = row[metric_column("HBM BW", "mean")]
+    return rows
+
+
+@pytest.mark.parametrize("engine", ["directory", "sqlite"])
+def test_incremental_export(tmp_path, engine):
+    db_path = tmp_path / ("cluster.sqlite" if engine == "sqlite" else "cluster")
+    output = tmp_path / "parquet"
+    collection = open_database(db_path, engine)["node01"]["gpu-7"]
+    collection.insert_many([result(1.0), result(2.0), result(3.0, day=30)])
+
+    assert export_cluster(db_path, engine, output, workers=1) == 1
+    assert exported_rows(output) == {(7, 1): 1.0, (7, 2): 2.0, (7, 3): 3.0}
+    assert export_cluster(db_path, engine, output, workers=1) == 0
+
+    # Replaced (e.g. rescored) and deleted documents, and an ID below the others
+    doc = collection.get("2")
+    doc["metrics"]["HBM BW"]["mean"] = 20.0
+    collection.put("2", doc)
+    collection.delete_one({"meta.id": "1"})
+    collection.put("0", result(0.5))
+    collection.insert_one(result(4.0, day=2))
+    export_cluster(db_path, engine, output, workers=1)
+    assert exported_rows(output) == {
+        (7, 0): 0.5,
+        (7, 2): 20.0,
+        (7, 3): 3.0,
+        (7, 4): 4.0,
+    }
+
+    # The watermark only lists the files of the dataset
+    watermark = json.loads((output / "_watermark.json").read_text())
+    files = watermark["nodes"]["node01"]["files"]
+    on_disk = output.glob("hostname=*/month=*/part-*.parquet")
+    assert sorted(files) == sorted(str(f.relative_to(output)) for f in on_disk)
+
+
+def test_lost_changes_export_everything_again(tmp_path, monkeypatch):
+    from locodb import watch
+
+    db_path = tmp_path / "cluster"
+    output = tmp_path / "parquet"
+    collection = open_database(db_path)["node01"]["gpu-7"]
+    collection.insert_one(result(1.0))
+    export_cluster(db_path, "directory", output, workers=1)
+
+    monkeypatch.setattr(watch, "max_log_bytes", 200)
+    for i in range(50):
+        collection.put("1", result(float(i)))
+    export_cluster(db_path, "directory", output, workers=1)
+    assert exported_rows(output) == {(7, 1): 49.0}
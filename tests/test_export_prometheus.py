@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+from export_prometheus import (
+    escape_label,
+    export_cluster,
+    render_metrics,
+    write_textfile,
+)
+from locodb.engines import open_database
+from scoring import metrics_list
+
+checked = 1748736000.0  # 2025-06-01 00:00:00 UTC
+
+
+def samples(content):
+    """Map of sample (name and labels) to value of a textfile."""
+    values = {}
+    for line in content.splitlines():
+        if not line.startswith("#"):
+            sample, value = line.rsplit(" ", 1)
+            values[sample] = float(value)
+    return values
+
+
+def test_render(make_result):
+    doc = make_result()
+    doc["health"] = {"Unhealthy": True, "Outlier": False}
+    doc["stats"] = {"z_score": {"HBM BW": -3.5}}
+    content = render_metrics([doc])
+    values = samples(content)
+    labels = 'host="node01",guid="7"'
+    assert values[f"gpu_health_unhealthy{{{labels}}}"] == 1
+    assert values[f"gpu_health_outlier{{{labels}}}"] == 0
+    assert values[f"gpu_health_last_check_timestamp_seconds{{{labels}}}"] == checked
+    # Computed by PromQL, from the timestamp
+    assert not any(sample.startswith("gpu_health_last_check_age") for sample in values)
+    assert values[f'gpu_metric_zscore{{{labels},metric="HBM BW"}}'] == -3.5
+    assert (
+        values[f'gpu_metric_mean{{{labels},metric="HBM BW"}}']
+        == doc["metrics"]["HBM BW"]["mean"]
+    )
+    assert content.count("# TYPE gpu_metric_mean gauge") == 1
+    assert content.endswith("\n")
+
+
+def test_render_without_stats(make_result):
+    values = samples(render_metrics([make_result()]))
+    assert not any(sample.startswith("gpu_metric_zscore") for sample in values)
+    assert sum(sample.startswith("gpu_metric_mean") for sample in values) == len(
+        metrics_list
+    )
+
+
+def test_escape_label():
+    assert escape_label('a"b\\c\nd') == 'a\\"b\\\\c\\nd'
+
+
+def test_write_textfile(tmp_path):
+    path = tmp_path / "gpu_health.prom"
+    write_textfile(path, "first\n")
+    write_textfile(path, "second\n")
+    assert path.read_text() == "second\n"
+    assert os.listdir(tmp_path) == ["gpu_health.prom"]
+
+
+@pytest.mark.parametrize("engine", ["directory", "sqlite"])
+def test_export_cluster(tmp_path, engine, make_result):
+    client = open_database(tmp_path / "cluster", engine)
+    for hostname, guid in [("node01", 7), ("node01", 8), ("node02", 9)]:
+        client[hostname][f"gpu-{guid}"].insert_many(
+            [make_result(1.0, i, hostname, guid) for i in range(3)]
+        )
+    client["node02"]["other"].insert_one({"meta": {}})
+    path = tmp_path / "gpu_health.prom"
+    export_cluster(client, path)
+    values = samples(path.read_text())
+    timestamps = {
+        sample: value
+        for sample, value in values.items()
+        if sample.startswith("gpu_health_last_check_timestamp_seconds")
+    }
+    # The latest document of every GPU
+    assert sorted(timestamps) == [
+        f'gpu_health_last_check_timestamp_seconds{{host="{host}",guid="{guid}"}}'
+        for host, guid in [("node01", 7), ("node01", 8), ("node02", 9)]
+    ]
+    assert set(timestamps.values()) == {checked + 2 * 3600}
@@ -0,0 +1,121 @@
+import random
+from argparse import Namespace
+from pathlib import Path
+
+import pytest
+
+import generate_cluster
+from degradation import state_key
+from generate_cluster import generate_node, gpu_profile, init_worker, load_templates
+from locodb.engines import open_database
+from locodb.sharding import reshard
+from locodb.utility import id_key
+
+root = Path(__file__).resolve().parent.parent
+
+
+def make_args(output, **kwargs):
+    args = {
+        "output": str(output),
+        "layout": "directory",
+        "codec": "json",
+        "omit_stats": False,
+        "gpus_per_node": 2,
+        "runs": 30,
+        "hostname_prefix": "node",
+        "start": "2025-01-01 00:00:00",
+        "interval_minutes": 60,
+        "bias": 0.01,
+        "drift": 0.02,
+        "noise": 0.002,
+        "faulty_fraction": 0.0,
+        "seed": 0,
+        "batch_size": 7,
+    }
+    args.update(kwargs)
+    return Namespace(**args)
+
+
+@pytest.fixture(autouse=True)
+def templates():
+    init_worker(load_templates(root / "example-cluster"))
+
+
+def node_documents(path, layout, hostname="node0001"):
+    database = open_database(path, layout)[hostname]
+    return {
+        name: sorted(database[name].find(), key=lambda doc: id_key(doc["meta"]["id"]))
+        for name in sorted(database.list_collections())
+    }
+
+
+def test_load_templates(tmp_path):
+    assert len(generate_cluster.templates) > 0
+    with pytest.raises(ValueError):
+        load_templates(tmp_path)
+
+
+@pytest.mark.parametrize("layout", ["directory", "sqlite"])
+def test_reproducible(tmp_path, layout):
+    first = make_args(tmp_path / "first", layout=layout)
+    second = make_args(tmp_path / "second", layout=layout)
+    assert generate_node(first, 1) == ("node0001", 60)
+    assert generate_node(second, 1) == ("node0001", 60)
+    documents = node_documents(first.output, layout)
+    assert len(documents) == 2
+    assert all(len(docs) == 30 for docs in documents.values())
+    assert documents == node_documents(second.output, layout)
+    # Another seed gives other GPUs
+    generate_node(make_args(tmp_path / "third", layout=layout, seed=1), 1)
+    assert documents.keys() != node_documents(tmp_path / "third", layout).keys()
+
+
+@pytest.mark.parametrize("runs", ["0", "1"])
+def test_too_few_runs(tmp_path, monkeypatch, runs):
+    output = tmp_path / "cluster"
+    argv = ["generate_cluster.py", "--runs", runs, "--output", str(output)]
+    monkeypatch.setattr("sys.argv", argv)
+    with pytest.raises(SystemExit):
+        generate_cluster.main()
+    assert not output.exists()
+
+
+def test_sharded(tmp_path):
+    generate_node(make_args(tmp_path / "flat"), 1)
+    (tmp_path / "sharded").mkdir()
+    reshard(tmp_path / "sharded", "sharded", shard_size=10)
+    generate_node(make_args(tmp_path / "sharded"), 1)
+    documents = node_documents(tmp_path / "sharded", "directory")
+    assert documents == node_documents(tmp_path / "flat", "directory")
+    for name in documents:
+        shards = tmp_path / "sharded" / "node0001" / name
+        assert sorted(d.name for d in shards.iterdir() if d.name.isdigit()) == [
+            "0",
+            "1",
+            "2",
+            "3",
+        ]
+        assert list(shards.glob("*.json")) == []
+
+
+def test_documents(tmp_path):
+    args = make_args(tmp_path / "cluster")
+    generate_node(args, 3)
+    database = open_database(args.output)["node0003"]
+    for name in database.list_collections():
+        collection = database[name]
+        docs = sorted(collection.find(), key=lambda doc: id_key(doc["meta"]["id"]))
+        guid = int(name.split("-")[1])
+        assert all(doc["meta"]["GUID"] == guid for doc in docs)
+        timestamps = [doc["meta"]["timestamp"] for doc in docs]
+        assert timestamps == sorted(timestamps)
+        assert all("Degrading" in doc["health"] for doc in docs)
+        assert collection.get_state(state_key) is not None
+
+
+def test_faults(tmp_path):
+    args = make_args(tmp_path / "cluster", faulty_fraction=1.0, runs=100)
+    profile = gpu_profile(random.Random(0), args)
+    assert 50 <= profile["fault_start"] < 100
+    assert 1 <= len(profile["fault_metrics"]) <= 3
+    assert 0.5 <= profile["fault_factor"] <= 0.9
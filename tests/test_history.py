@@ -0,0 +1,120 @@
+import pytest
+
+from history import HistoryService, UnknownCollection, lttb, minmax_buckets
+from locodb.engines import open_database
+
+
+def test_lttb_keeps_ends_and_peak():
+    times = list(range(100))
+    values = [0.0] * 100
+    values[42] = 10.0
+    selected = lttb(times, values, 10)
+    assert len(selected) == 10
+    assert selected[0] == 0 and selected[-1] == 99
+    assert 42 in selected
+    assert lttb(times[:5], values[:5], 10) == list(range(5))
+
+
+def test_minmax_buckets():
+    times = list(range(10))
+    values = [float(t) for t in times]
+    buckets = minmax_buckets(times, values, 0, 10, 2)
+    assert buckets["min"] == [0.0, 5.0]
+    assert buckets["max"] == [4.0, 9.0]
+    assert buckets["mean"] == [2.0, 7.0]
+    assert minmax_buckets([], [], 0, 10, 2)["min"] == []
+
+
+@pytest.fixture
+def cluster(tmp_path, make_result):
+    client = open_database(tmp_path / "cluster")
+    client["node01"]["gpu-7"].insert_many([make_result(1.0, i) for i in range(20)])
+    return client
+
+
+def test_history_refresh(cluster, make_result):
+    service = HistoryService(cluster, max_age=0)
+    result = service.history("node01", "gpu-7", ["HBM BW"], points=5, method="lttb")
+    assert result["total"] == 20
+    assert len(result["series"]["HBM BW"]["t"]) == 5
+
+    cluster["node01"]["gpu-7"].insert_one(make_result(0.5, 20))
+    result = service.history("node01", "gpu-7", ["HBM BW"], points=5, method="lttb")
+    assert result["total"] == 21
+    assert min(result["series"]["HBM BW"]["value"]) < 2000
+
+    start = make_result(1.0, 10)["meta"]["timestamp"]
+    assert service.history("node01", "gpu-7", start=start)["total"] == 11
+    with pytest.raises(ValueError):
+        service.history("node01", "gpu-7", ["No such metric"])
+
+
+@pytest.mark.parametrize(
+    "db_name, collection_name",
+    [("bogus-host", "gpu-0"), ("node01", "gpu-0"), ("..", "escaped"), ("node01", "..")],
+)
+def test_unknown_collections_not_created(cluster, tmp_path, db_name, collection_name):
+    service = HistoryService(cluster)
+    with pytest.raises(UnknownCollection):
+        service.history(db_name, collection_name)
+    assert sorted(cluster.list_databases()) == ["node01"]
+    assert cluster["node01"].list_collections() == ["gpu-7"]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["cluster"]
+    assert not service.loading
+
+
+def test_api_not_found(cluster, tmp_path):
+    pytest.importorskip("dash")
+    from dashboard import create_app
+
+    app = create_app(cluster, HistoryService(cluster))
+    client = app.server.test_client()
+    assert client.get("/api/history/node01/gpu-7?points=3").status_code == 200
+    assert client.get("/api/history/bogus-host/gpu-0").status_code == 404
+    assert client.get("/api/history/%2E%2E/escaped").status_code == 404
+    assert client.get("/api/history/node01/gpu-7?method=bad").status_code == 400
+    assert sorted(cluster.list_databases()) == ["node01"]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["cluster"]
+
+
+@pytest.mark.parametrize("engine", ["directory", "sqlite"])
+def test_history_replaced_and_deleted(tmp_path, engine, make_result):
+    client = open_database(tmp_path / "cluster", engine)
+    collection = client["node01"]["gpu-7"]
+    collection.insert_many([make_result(1.0, i) for i in range(5)])
+    service = HistoryService(client, max_age=0)
+    result = service.history("node01", "gpu-7", ["HBM BW"], method="lttb")
+    assert result["total"] == 5
+
+    # Rescored or rewritten in place: the cached values are stale
+    collection.put("3", make_result(0.5, 2))
+    result = service.history("node01", "gpu-7", ["HBM BW"], method="lttb")
+    assert result["total"] == 5
+    assert min(result["series"]["HBM BW"]["value"]) < 2000
+
+    collection.delete_one({"meta.id": "2"})
+    collection.insert_one(make_result(1.0, 5))
+    assert service.history("node01", "gpu-7", method="lttb")["total"] == 5
+
+
+def test_history_changes_dropped(cluster, make_result, monkeypatch):
+    service = HistoryService(cluster, max_age=0)
+    assert service.history("node01", "gpu-7")["total"] == 20
+    monkeypatch.setattr("locodb.watch.max_log_bytes", 100)
+    cluster["node01"]["gpu-7"].insert_many([make_result(1.0, 20 + i) for i in range(5)])
+    assert service.history("node01", "gpu-7")["total"] == 25
+
+
+def test_drilldown_unknown_collection(cluster):
+    pytest.importorskip("dash")
+    from dashboard import drilldown
+
+    service = HistoryService(cluster)
+    selected = {"db": "node01", "collection": "gpu-7"}
+    title, figure = drilldown(service, selected, ["HBM BW"], "All", "lttb", 10)
+    assert title.startswith("node01 gpu-7: 20 runs")
+    title, figure = drilldown(
+        service, {"db": "node02", "collection": "gpu-0"}, ["HBM BW"], "All", "lttb", 10
+    )
+    assert title == "node02 gpu-0: no data"
+    assert figure.data == ()
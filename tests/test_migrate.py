@@ -0,0 +1,43 @@
+import pytest
+
+from degradation import state_key, update_collection
+from locodb.engines import open_database
+from locodb.migrate import migrate
+
+
+def by_id(docs):
+    return sorted(docs, key=lambda doc: doc["meta"]["id"])
+
+
+@pytest.mark.parametrize(
+    "source_engine, destination_engine",
+    [("directory", "sqlite"), ("sqlite", "directory")],
+)
+def test_migrate(tmp_path, make_result, source_engine, destination_engine):
+    source = open_database(tmp_path / "source", source_engine)
+    collection = source["node01"]["gpu-7"]
+    for i in range(5):
+        doc = make_result(1.0, i)
+        doc["health"] = update_collection(
+            collection, doc["metrics"], doc["meta"]["timestamp"]
+        )
+        collection.insert_one(doc)
+    collection.set_state("rescore", {"position": ["2025-06-01", [0, 3, ""]]})
+
+    destination = open_database(tmp_path / "destination", destination_engine)
+    assert migrate(source, destination) == 5
+    copied = destination["node01"]["gpu-7"]
+    assert by_id(copied.find()) == by_id(collection.find())
+    # The degradation charts and checkpoints go along with the documents
+    assert sorted(copied.list_states()) == ["degradation", "rescore"]
+    assert copied.get_state(state_key) == collection.get_state(state_key)
+    assert copied.get_state(state_key)["count"] == 5
+    assert copied.get_state("rescore") == collection.get_state("rescore")
+
+
+def test_ids_with_dots(tmp_path, make_result):
+    source = open_database(tmp_path / "source")
+    source["node01"]["gpu-7"].put("2025.06.01", make_result())
+    destination = open_database(tmp_path / "destination", "sqlite")
+    assert migrate(source, destination) == 1
+    assert destination["node01"]["gpu-7"].get("2025.06.01") == make_result()
@@ -0,0 +1,153 @@
+import json
+import subprocess
+import sys
+from argparse import Namespace
+from pathlib import Path
+
+import orchestrate
+from benchmark_gpus import summary_prefix
+from orchestrate import (
+    Fleet,
+    LocalLauncher,
+    SrunLauncher,
+    SshLauncher,
+    expand_hostlist,
+    fleet_totals,
+    node_verdict,
+)
+
+root = Path(__file__).resolve().parent.parent
+fixture = str(root / "example-cluster/nicholson/gpu-19794/1.json")
+
+
+def make_args(**kwargs):
+    args = {
+        "workdir": str(root),
+        "python": "python",
+        "setup": None,
+        "slurm_partition": None,
+        "timeout": None,
+        "fixture": [fixture],
+    }
+    args.update(kwargs)
+    return Namespace(**args)
+
+
+def test_expand_hostlist():
+    assert expand_hostlist("n[01-03,07],login") == ["n01", "n02", "n03", "n07", "login"]
+    assert expand_hostlist("r[1-2]n[8-9]") == ["r1n8", "r1n9", "r2n8", "r2n9"]
+    assert expand_hostlist("a, b,,c") == ["a", "b", "c"]
+    assert expand_hostlist("gpu[098-101]") == ["gpu098", "gpu099", "gpu100", "gpu101"]
+
+
+def test_launcher_timeouts():
+    check = ["benchmark_gpus.py", "--summary"]
+    srun = SrunLauncher(make_args(timeout=61)).command("n01", check)
+    assert "--time=2" in srun
+    srun = SrunLauncher(make_args(timeout=30)).command("n01", check)
+    assert "--time=1" in srun
+    # The check is stopped on the node, not only the local ssh client
+    ssh = SshLauncher(make_args(timeout=90.5)).command("n01", check)
+    assert ssh[-1].endswith("timeout 91 python benchmark_gpus.py --summary")
+    ssh = SshLauncher(make_args()).command("n01", check)
+    assert "timeout" not in ssh[-1]
+
+
+def test_fleet_timeout(tmp_path):
+    command = [sys.executable, "-c", "import time; time.sleep(30)"]
+    report = Fleet().run("n01", command, str(tmp_path / "n01.log"), timeout=0.5)
+    assert report["status"] == "timeout"
+    assert report["wall_seconds"] < 10
+
+
+def test_summary_parsing(tmp_path):
+    summary = {"hostname": "n01", "run_id": "r", "gpus": []}
+    script = f"print('noise'); print({summary_prefix + json.dumps(summary)!r})"
+    report = Fleet().run(
+        "n01", [sys.executable, "-c", script], str(tmp_path / "n01.log")
+    )
+    assert report["status"] == "ok"
+    assert report["summary"] == summary
+    report = Fleet().run(
+        "n01", [sys.executable, "-c", "print('noise')"], str(tmp_path / "n01.log")
+    )
+    assert report["status"] == "no summary"
+    report = Fleet().run(
+        "n01", [sys.executable, "-c", "raise SystemExit(3)"], str(tmp_path / "n01.log")
+    )
+    assert (report["status"], report["returncode"]) == ("failed", 3)
+
+
+def test_local_launcher_without_gpus(tmp_path):
+    db = tmp_path / "cluster"
+    check = ["benchmark_gpus.py", "--summary", "--db", str(db)]
+    launcher = LocalLauncher(make_args(workdir=str(tmp_path)))
+    report = Fleet().run(
+        "vm01", launcher.command("vm01", check), str(tmp_path / "vm01.log")
+    )
+    assert report["status"] == "ok", (tmp_path / "vm01.log").read_text()
+    assert report["summary"]["hostname"] == "vm01"
+    assert [gpu["GUID"] for gpu in report["summary"]["gpus"]] == [19794]
+    assert node_verdict(report) == "1 GPUs"
+    # Nothing is stored
+    assert not db.exists()
+
+
+def test_local_fleet(tmp_path):
+    subprocess.run(
+        [
+            sys.executable,
+            orchestrate.__file__,
+            "--nodes",
+            "vm[01-03]",
+            "--launcher",
+            "local",
+            "--parallel",
+            "2",
+            "--log-dir",
+            str(tmp_path / "logs"),
+            "--report",
+            str(tmp_path / "report.json"),
+        ],
+        cwd=tmp_path,
+        check=True,
+        capture_output=True,
+    )
+    report = json.loads((tmp_path / "report.json").read_text())
+    assert [node["hostname"] for node in report["nodes"]] == ["vm01", "vm02", "vm03"]
+    assert report["totals"]["ok"] == 3
+    assert report["totals"]["gpus"] == 3
+
+
+def test_verdicts_and_totals():
+    gpus = [
+        {
+            "GUID": 1,
+            "Unhealthy": True,
+            "Unhealthy Metrics": ["HBM BW"],
+            "Degrading": False,
+            "Degrading Metrics": [],
+        },
+        {
+            "GUID": 2,
+            "Unhealthy": False,
+            "Unhealthy Metrics": [],
+            "Degrading": True,
+            "Degrading Metrics": ["L2 BW", "FP64"],
+        },
+    ]
+    ok = {"status": "ok", "summary": {"gpus": gpus}, "wall_seconds": 3.0}
+    failed = {"status": "failed", "summary": None, "log": "n02.log", "wall_seconds": 1}
+    assert node_verdict(ok) == (
+        "2 GPUs, 1 unhealthy (gpu-1: HBM BW), 1 degrading (gpu-2: L2 BW, FP64)"
+    )
+    assert node_verdict(failed) == "see n02.log"
+    totals = fleet_totals([ok, failed])
+    assert totals["nodes"] == 2
+    assert (totals["ok"], totals["failed"]) == (1, 1)
+    assert (totals["gpus"], totals["unhealthy_gpus"], totals["degrading_gpus"]) == (
+        2,
+        1,
+        1,
+    )
+    assert totals["wall_seconds"] == {"min": 1, "median": 3.0, "max": 3.0}
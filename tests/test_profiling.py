@@ -0,0 +1,117 @@
+import json
+import threading
+
+import pytest
+
+from locodb.engines import open_database
+from benchmark_gpus import benchmark_node
+from locodb.profiling import (
+    NullTracer,
+    Tracer,
+    active_tracer,
+    get_tracer,
+    set_tracer,
+    traced,
+)
+
+
+@pytest.fixture
+def tracer():
+    tracer = Tracer()
+    previous = set_tracer(tracer)
+    yield tracer
+    set_tracer(previous)
+
+
+def test_inactive():
+    assert isinstance(get_tracer(), NullTracer)
+    with get_tracer().span("nothing"):
+        get_tracer().count("nothing")
+
+
+def test_active_tracer_restored():
+    tracer = Tracer()
+    with pytest.raises(RuntimeError):
+        with active_tracer(tracer):
+            assert get_tracer() is tracer
+            raise RuntimeError
+    assert isinstance(get_tracer(), NullTracer)
+
+
+def test_failed_benchmark_restores_tracer(tmp_path, monkeypatch):
+    # No roofline binary here
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(OSError):
+        benchmark_node(db_path=str(tmp_path / "cluster"), hostname="node01")
+    assert isinstance(get_tracer(), NullTracer)
+
+
+def test_spans_and_counts(tracer):
+    @traced("work")
+    def work(x):
+        get_tracer().count("items", x)
+        return x
+
+    with tracer.span("outer", node="n01"):
+        assert work(2) == 2
+        assert work(3) == 3
+    summary = tracer.summary()
+    assert summary["spans"]["work"]["calls"] == 2
+    assert summary["spans"]["outer"]["calls"] == 1
+    # Nested spans count in their parent's total
+    assert summary["spans"]["outer"]["seconds"] >= summary["spans"]["work"]["seconds"]
+    assert summary["counters"] == {"items": 5}
+    outer = [event for event in tracer.events if event["name"] == "outer"]
+    assert outer[0]["args"] == {"node": "n01"}
+
+
+def test_span_on_error(tracer):
+    with pytest.raises(RuntimeError):
+        with tracer.span("failing"):
+            raise RuntimeError
+    assert tracer.summary()["spans"]["failing"]["calls"] == 1
+
+
+def test_threads(tracer):
+    def work():
+        for _ in range(1000):
+            with tracer.span("step"):
+                tracer.count("steps")
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert tracer.summary()["spans"]["step"]["calls"] == 4000
+    assert tracer.counters["steps"] == 4000
+
+
+def test_chrome_trace(tmp_path, tracer):
+    with tracer.span("phase"):
+        tracer.count("bytes", 10)
+    path = tmp_path / "trace.json"
+    tracer.write_chrome_trace(path)
+    events = json.loads(path.read_text())["traceEvents"]
+    assert events[0]["name"] == "phase" and events[0]["ph"] == "X"
+    assert events[0]["dur"] >= 0
+    assert events[-1] == {
+        "name": "counters",
+        "ph": "C",
+        "ts": events[-1]["ts"],
+        "pid": events[0]["pid"],
+        "args": {"bytes": 10},
+    }
+
+
+@pytest.mark.parametrize("engine", ["directory", "sqlite"])
+def test_database_operations(tmp_path, tracer, engine, make_result):
+    collection = open_database(tmp_path / "cluster", engine)["node01"]["gpu-7"]
+    collection.insert_many([make_result(1.0, i) for i in range(3)])
+    collection.find()
+    summary = tracer.summary()
+    assert summary["spans"]["collection.insert_many"]["calls"] == 1
+    assert summary["spans"]["collection.find"]["calls"] == 1
+    assert summary["counters"]["documents_written"] == 3
+    assert summary["counters"]["documents_read"] == 3
+    assert summary["counters"]["bytes_parsed"] > 0
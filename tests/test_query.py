@@ -0,0 +1,112 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from locodb.engines import open_database
+from locodb.query import _missing, matches, matches_condition, plan_query
+
+docs = [
+    {"meta": {"id": "1", "hostname": "a"}, "value": 1, "tags": "x"},
+    {"meta": {"id": "2", "hostname": "b"}, "value": 5, "tags": None},
+    {"meta": {"id": "3", "hostname": "a"}, "value": 9},
+    {"meta": {"id": "4", "hostname": "c"}, "value": "n/a"},
+]
+
+queries = [
+    {"value": 5},
+    {"value": {"$eq": 5}},
+    {"value": {"$ne": 5}},
+    {"value": {"$gt": 1}},
+    {"value": {"$gte": 1, "$lt": 9}},
+    {"value": {"$lte": 5}},
+    {"value": {"$in": [1, 9]}},
+    {"value": {"$nin": [1, 9]}},
+    {"tags": {"$exists": True}},
+    {"tags": {"$exists": False}},
+    {"tags": None},
+    {"tags": {"$eq": None}},
+    {"tags": {"$in": [None, "x"]}},
+    {"tags": {"$ne": None}},
+    {"meta.hostname": "a", "value": {"$gt": 1}},
+    {"$or": [{"value": 1}, {"meta.hostname": "c"}]},
+    {"$and": [{"value": {"$gte": 5, "$lt": 100}}, {"value": {"$lte": 9}}]},
+]
+
+
+def test_operators():
+    assert matches_condition(3, {"$gt": 2, "$lt": 4})
+    assert not matches_condition("3", {"$gt": 2})
+    assert not matches_condition(_missing, {"$lt": 4})
+    assert matches_condition(_missing, None)
+    assert matches_condition(_missing, {"$nin": [1]})
+    assert matches_condition(_missing, {"$exists": False})
+    assert not matches({"a": {"b": 1}}, {"a.b.c": 1})
+    with pytest.raises(ValueError):
+        matches_condition(1, {"$regex": "1"})
+
+
+def test_plan_query():
+    indexes = ["meta.hostname", "value"]
+    assert plan_query({"tags": "x"}, indexes).describe() == "COLLSCAN"
+    # Equality beats a range
+    plan = plan_query({"value": {"$gt": 1}, "meta.hostname": "a"}, indexes)
+    assert (plan.index, plan.bounds) == ("meta.hostname", {"$eq": "a"})
+    plan = plan_query({"value": {"$gt": 1, "$ne": 3}}, indexes)
+    assert (plan.index, plan.bounds) == ("value", {"$gt": 1})
+    assert plan_query({"value": {"$nin": [1]}}, indexes).index is None
+    # Documents without the field are not in the index
+    assert plan_query({"value": None}, indexes).index is None
+    assert plan_query({"value": {"$in": [1, None]}}, indexes).index is None
+
+
+@pytest.mark.parametrize("engine", ["directory", "sqlite"])
+def test_index_results_match_scan(tmp_path, engine):
+    collection = open_database(tmp_path / "cluster", engine)["node01"]["gpu-7"]
+    collection.insert_many(docs)
+    expected = [
+        sorted(doc["meta"]["id"] for doc in docs if matches(doc, query))
+        for query in queries
+    ]
+    scanned = [
+        sorted(doc["meta"]["id"] for doc in collection.find(query)) for query in queries
+    ]
+    assert scanned == expected
+    collection.create_index("value")
+    collection.create_index("tags")
+    collection.create_index("meta.hostname")
+    indexed = [
+        sorted(doc["meta"]["id"] for doc in collection.find(query)) for query in queries
+    ]
+    assert indexed == expected
+
+
+@pytest.mark.parametrize("engine", ["directory", "sqlite"])
+def test_explain(tmp_path, engine):
+    collection = open_database(tmp_path / "cluster", engine)["node01"]["gpu-7"]
+    collection.insert_many(docs)
+    explanation = collection.explain({"value": {"$gte": 5, "$lt": 100}})
+    assert explanation["plan"] == "COLLSCAN"
+    assert (explanation["docs_examined"], explanation["docs_returned"]) == (4, 2)
+    collection.create_index("value")
+    explanation = collection.explain({"value": {"$gte": 5, "$lt": 100}})
+    assert explanation["plan"].startswith("IXSCAN value")
+    assert (explanation["docs_examined"], explanation["docs_returned"]) == (2, 2)
+    # Kept up to date by writes
+    collection.insert_one({"value": 7})
+    assert collection.explain({"value": {"$gte": 5, "$lt": 100}})["docs_returned"] == 3
+
+
+def test_index_created_during_inserts(tmp_path):
+    collection = open_database(tmp_path / "cluster")["node01"]["gpu-7"]
+    collection.insert_many([{"value": i} for i in range(100)])
+    with ThreadPoolExecutor(8) as executor:
+        inserts = [
+            executor.submit(collection.insert_one, {"value": i})
+            for i in range(100, 300)
+        ]
+        executor.submit(collection.create_index, "value").result()
+        for insert in inserts:
+            insert.result()
+    explanation = collection.explain({"value": {"$gte": 0}})
+    assert explanation["plan"].startswith("IXSCAN value")
+    assert explanation["docs_returned"] == 300
@@ -0,0 +1,51 @@
+import math
+
+import records
+from locodb.engines import open_database
+from records import BenchmarkRecord, intern_value, load_records
+from scoring import population_summary
+
+
+def test_round_trip(make_result):
+    doc = make_result(1.01, 3)
+    doc["health"] = {"Outlier": False, "Change Points": {"HBM BW": "2025-06-01"}}
+    doc["stats"] = {
+        field: {metric: 0.5 for metric in records.metrics_list}
+        for field in records.stats_fields
+    }
+    doc["extra"] = [1, 2]
+    assert BenchmarkRecord.from_document(doc).to_document() == doc
+
+
+def test_irregular_metrics(make_result):
+    doc = make_result()
+    del doc["metrics"]["L1 BW"]
+    doc["metrics"]["HBM BW"]["mean"] = None
+    record = BenchmarkRecord.from_document(doc)
+    assert math.isnan(record.mean("L1 BW"))
+    assert record.to_document() == doc
+    assert BenchmarkRecord.from_document({}).to_document() == {"meta": {}}
+
+
+def test_shared_workloads_only(make_result):
+    first = BenchmarkRecord.from_document({**make_result(1.0, 0), "health": {"n": 0}})
+    second = BenchmarkRecord.from_document({**make_result(1.1, 1), "health": {"n": 0}})
+    assert first.workloads is second.workloads
+    assert first.device is second.device
+    assert first.health is not second.health
+
+
+def test_interned_values_bounded(monkeypatch):
+    monkeypatch.setattr(records, "_interned", {})
+    monkeypatch.setattr(records, "max_interned", 10)
+    for i in range(100):
+        intern_value({"value": i})
+    assert len(records._interned) <= 10
+
+
+def test_load_records(tmp_path, make_result):
+    collection = open_database(tmp_path / "cluster")["node01"]["gpu-7"]
+    collection.insert_many([make_result(1.0 + i * 0.01, i) for i in range(10)])
+    loaded = load_records(collection)
+    assert all(isinstance(record, BenchmarkRecord) for record in loaded)
+    assert population_summary(loaded) == population_summary(collection.find())
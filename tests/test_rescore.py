@@ -0,0 +1,59 @@
+import copy
+import threading
+
+from degradation import DegradationTracker, update_collection
+from degradation import state_key as degradation_state_key
+from locodb.engines import open_database
+from rescore import rescore_collection
+
+
+def test_rescore_mixed_ids(tmp_path, make_result):
+    collection = open_database(tmp_path / "cluster")["node01"]["gpu-7"]
+    collection.insert_many([make_result(1.0 + i % 3 * 0.001, i) for i in range(40)])
+    # e.g. restored or ingested under an ID that is not a number
+    imported = make_result(0.5, 40)
+    imported["meta"]["id"] = "imported"
+    collection.put("imported", imported)
+
+    assert rescore_collection(collection, "run-1", checkpoint_every=10) == 41
+    doc = collection.get("imported")
+    assert doc["health"]["Unhealthy"]
+    assert not collection.get("40")["health"]["Outlier"]
+    # Done: running it again does nothing
+    assert rescore_collection(collection, "run-1") == 0
+
+
+def test_live_checks_during_rescore(tmp_path, make_result):
+    collection = open_database(tmp_path / "cluster")["node01"]["gpu-7"]
+    docs = [make_result(1.0 + i % 3 * 0.001, i) for i in range(40)]
+    for doc in docs:
+        doc["health"] = update_collection(
+            collection, doc["metrics"], doc["meta"]["timestamp"]
+        )
+    collection.insert_many(copy.deepcopy(docs))
+    live = [make_result(0.99, 40), make_result(0.99, 41)]
+    put_many = collection.put_many
+
+    def check(doc, delay):
+        # The charts are updated before the run is stored
+        update_collection(collection, doc["metrics"], doc["meta"]["timestamp"])
+        timer = threading.Timer(delay, collection.insert_one, [copy.deepcopy(doc)])
+        timer.start()
+        return timer
+
+    def put_many_with_checks(items):
+        put_many(items)
+        if not timers:
+            timers.append(check(live[0], 0))
+            timers.append(check(live[1], 0.5))
+
+    timers = []
+    collection.put_many = put_many_with_checks
+    assert rescore_collection(collection, "run-1", checkpoint_every=10) == 40
+    for timer in timers:
+        timer.join()
+    # As if the live runs had come after the rescored history
+    expected = DegradationTracker()
+    for doc in docs + live:
+        expected.update(doc["metrics"], doc["meta"]["timestamp"])
+    assert collection.get_state(degradation_state_key) == expected.state
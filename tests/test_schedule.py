@@ -0,0 +1,123 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from locodb.engines import open_database
+from schedule import (
+    check_duration,
+    gpu_priority,
+    plan_sweep,
+    rank_nodes,
+    recent_documents,
+    sbatch_plan,
+)
+
+# A day after the first result of `make_result`
+now = datetime(2025, 6, 2, tzinfo=timezone.utc)
+
+
+def node(hostname, priority, duration):
+    return {
+        "hostname": hostname,
+        "priority": priority,
+        "duration": duration,
+        "reasons": [],
+    }
+
+
+def test_check_duration():
+    spans = {
+        "roofline": {"seconds": 100.0},
+        "write": {"seconds": 2.0},
+        # Nested in the phases
+        "collection.insert_one": {"seconds": 1.0},
+    }
+    assert check_duration({"meta": {"timings": {"spans": spans}}}) == 102.0
+    assert check_duration({"meta": {}}) is None
+
+
+def test_gpu_priority(make_result):
+    docs = [make_result(1.0, i) for i in reversed(range(4))]
+    # The latest check was 21 hours ago, with a target age of 12 hours
+    priority, reasons = gpu_priority(docs, now, 12 * 3600)
+    assert priority == pytest.approx(21 / 12)
+    assert reasons == ["checked 21.0 h ago"]
+    docs[0]["health"] = {
+        "Outlier": True,
+        "Unhealthy": True,
+        "Unhealthy Metrics": ["HBM BW"],
+    }
+    docs[1]["health"] = {"Outlier": True, "Degrading": True}
+    priority, reasons = gpu_priority(docs, now, 12 * 3600)
+    # Only the latest check counts as unhealthy or degrading
+    assert priority == pytest.approx(21 / 12 + 10 * 2 / 4 + 10)
+    assert reasons[1:] == ["2/4 recent outliers", "unhealthy: HBM BW"]
+
+
+@pytest.mark.parametrize("engine", ["directory", "sqlite"])
+def test_rank_nodes(tmp_path, engine, make_result):
+    client = open_database(tmp_path / "cluster", engine)
+    # node01 was checked an hour before node02
+    for hostname, guid, first in [("node01", 1, 0), ("node02", 2, 1), ("node02", 3, 1)]:
+        client[hostname][f"gpu-{guid}"].insert_many(
+            [make_result(1.0, first + i, hostname, guid) for i in range(3)]
+        )
+    timed = make_result(1.0, 3, "node02", 3)
+    timed["meta"]["timings"] = {"spans": {"roofline": {"seconds": 120.0}}}
+    timed["health"] = {"Degrading": True, "Degrading Metrics": ["L2 BW"]}
+    client["node02"]["gpu-3"].insert_one(timed)
+    recent = recent_documents(
+        client["node02"]["gpu-3"], client["node02"]["gpu-3"].find_latest(), 2
+    )
+    assert [doc["meta"]["id"] for doc in recent] == ["4", "3"]
+
+    nodes = rank_nodes(
+        client, now=now, target_age=86400, hostnames=["node03"], default_duration=60
+    )
+    assert [node["hostname"] for node in nodes] == ["node03", "node02", "node01"]
+    assert nodes[0]["reasons"] == ["never checked"]
+    assert nodes[1]["duration"] == 120.0
+    assert nodes[1]["reasons"][-1] == "gpu-3: degrading: L2 BW"
+    assert nodes[2]["duration"] == 60
+
+
+def test_recent_documents(tmp_path, make_result):
+    collection = open_database(tmp_path / "cluster")["node01"]["gpu-7"]
+    collection.insert_many([make_result(1.0, i) for i in range(12)])
+    collection.delete_one({"meta.id": "10"})
+    collection.put("extra", make_result(1.0, 12))
+    latest = collection.get("12")
+    recent = recent_documents(collection, latest, 4)
+    # By ID, skipping the deleted ones, and only before the latest
+    assert [doc["meta"]["id"] for doc in recent] == ["12", "11", "9", "8"]
+    assert len(recent_documents(collection, latest, 20)) == 11
+
+
+def test_plan_sweep():
+    nodes = [
+        node("a", 9.0, 300),
+        node("b", 8.0, 200),
+        node("c", 7.0, 200),
+        node("d", 6.0, 100),
+        node("e", 0.5, 10),
+    ]
+    scheduled, deferred = plan_sweep(nodes, budget=400, parallel=2, min_priority=1)
+    assert [(n["hostname"], n["slot"], n["start"]) for n in scheduled] == [
+        ("a", 0, 0.0),
+        ("b", 1, 0.0),
+        ("c", 1, 200.0),
+        ("d", 0, 300.0),
+    ]
+    assert deferred == []
+    scheduled, deferred = plan_sweep(nodes, budget=250, parallel=1)
+    assert [n["hostname"] for n in scheduled] == ["b", "e"]
+    assert [n["hostname"] for n in deferred] == ["a", "c", "d"]
+
+
+def test_sbatch_plan():
+    script = sbatch_plan([node("node01", 2.0, 100)], "slurm/healthcheck.sh")
+    assert script.startswith("#!/bin/bash\n")
+    assert (
+        "sbatch --nodelist=node01 --time=3 --job-name=healthcheck-node01"
+        " slurm/healthcheck.sh\n"
+    ) in script
@@ -0,0 +1,86 @@
+import pytest
+
+from locodb.engines import open_database
+from locodb.sharding import load_layout, reshard, shard_may_match, shard_name
+
+
+def timestamps(docs):
+    return sorted(doc["meta"]["timestamp"] for doc in docs)
+
+
+def test_shard_name():
+    assert shard_name("12345", 1000) == "12"
+    assert shard_name(7, 1000) == "0"
+    assert shard_name("a-b", 1000).startswith("h")
+    assert len(shard_name("a-b", 1000)) == 3
+
+
+def test_shard_may_match():
+    time_range = ["2025-06-01", "2025-06-30"]
+    assert shard_may_match(None, {"$lt": "2000"})
+    assert shard_may_match(time_range, {"$gte": "2025-06-30"})
+    assert not shard_may_match(time_range, {"$gt": "2025-06-30"})
+    assert not shard_may_match(time_range, {"$lt": "2025-06-01"})
+    assert shard_may_match(time_range, {"$lte": "2025-06-01"})
+    assert not shard_may_match(time_range, "2025-07-01")
+    assert shard_may_match(time_range, {"$in": ["2025-01-01", "2025-06-15"]})
+    # Only string bounds are compared
+    assert shard_may_match(time_range, {"$lt": 3})
+
+
+def test_reshard(tmp_path, make_result):
+    path = tmp_path / "cluster"
+    collection = open_database(path)["node01"]["gpu-7"]
+    collection.insert_many([make_result(1.0, i) for i in range(25)])
+    collection.put("extra", make_result(1.0, 25))
+    expected = collection.find()
+
+    assert reshard(path, "sharded", shard_size=10) == 26
+    assert load_layout(path) == {"layout": "sharded", "shard_size": 10}
+    collection = open_database(path)["node01"]["gpu-7"]
+    assert (collection.path / "2" / "20.json").exists()
+    assert list(collection.path.glob("*.json")) == []
+    assert timestamps(collection.find()) == timestamps(expected)
+    assert (collection.path / shard_name("extra", 10) / "extra.json").exists()
+    assert collection.get("extra") is not None
+    # New documents go to their shard
+    doc_id = collection.insert_one(make_result(1.0, 26))["_id"]
+    assert (collection.path / shard_name(doc_id, 10) / f"{doc_id}.json").exists()
+    with pytest.raises(ValueError):
+        reshard(path, "sharded", shard_size=100)
+
+    assert reshard(path, "flat") == 27
+    assert load_layout(path) == {"layout": "flat"}
+    collection = open_database(path)["node01"]["gpu-7"]
+    assert len(list(collection.path.glob("*.json"))) == 27
+    assert len(collection.find()) == 27
+
+
+def test_shard_pruning(tmp_path, make_result):
+    path = tmp_path / "cluster"
+    collection = open_database(path)["node01"]["gpu-7"]
+    collection.insert_many([make_result(1.0, i) for i in range(30)])
+    reshard(path, "sharded", shard_size=10)
+    collection = open_database(path)["node01"]["gpu-7"]
+    # Runs 25 to 29, i.e. IDs 26 to 30, in the shards of IDs 20-29 and 30-39
+    query = {"meta.timestamp": {"$gte": "2025-06-02 01:00:00 UTC"}}
+    explanation = collection.explain(query)
+    assert explanation["shards_scanned"] == "2/4"
+    assert explanation["docs_returned"] == 5
+    assert explanation["docs_examined"] == 11
+    assert collection.explain({})["shards_scanned"] == "4/4"
+
+
+def test_documents_not_moved_yet(tmp_path, make_result):
+    path = tmp_path / "cluster"
+    flat = open_database(path)["node01"]["gpu-7"]
+    flat.insert_many([make_result(1.0, i) for i in range(5)])
+    reshard(path, "sharded", shard_size=10)
+    # Written by a writer opened before the conversion: the IDs of the
+    # documents moved to the shards are not taken again
+    assert flat.insert_one(make_result(1.0, 5))["_id"] == "6"
+    flat.put("1", make_result(1.1, 0))
+    collection = open_database(path)["node01"]["gpu-7"]
+    assert len(collection.find()) == 6
+    assert collection.get("1")["metrics"] == make_result(1.1, 0)["metrics"]
+    assert list(collection.path.glob("*.json")) == []
@@ -0,0 +1,110 @@
+import pytest
+
+from locodb.engines import open_database
+from locodb.snapshot import SnapshotDatabase, export_snapshot, restore_snapshot
+
+
+def contents(client):
+    """{(database, collection): {ID: document}} of a whole LocoDatabase."""
+    return {
+        (db_name, name): {
+            doc_id: client[db_name][name].get(doc_id)
+            for doc_id in (
+                f.rsplit(".", 1)[0] for f in client[db_name][name].list_documents()
+            )
+        }
+        for db_name in client.list_databases()
+        for name in client[db_name].list_collections()
+    }
+
+
+@pytest.fixture
+def cluster(tmp_path, make_result):
+    client = open_database(tmp_path / "cluster")
+    for hostname in ["node01", "node02"]:
+        for guid in [7, 8]:
+            collection = client[hostname][f"gpu-{guid}"]
+            collection.insert_many(
+                [make_result(1.0, i, hostname, guid) for i in range(5)]
+            )
+    client["node01"]["gpu-7"].set_state("degradation", {"count": 5})
+    client["node01"]["gpu-7"].create_index("meta.timestamp")
+    return client
+
+
+def test_export_and_read(cluster, tmp_path, make_result):
+    path = tmp_path / "full.locosnap"
+    assert export_snapshot(cluster, path, compression="gzip") == {
+        "written": 20,
+        "deleted": 0,
+    }
+    snapshot = SnapshotDatabase(path)
+    assert contents(snapshot) == contents(cluster)
+    collection = snapshot["node01"]["gpu-7"]
+    assert collection.get_state("degradation") == {"count": 5}
+    assert collection.find_latest()["meta"]["id"] == "5"
+    since = make_result(1.0, 3)["meta"]["timestamp"]
+    assert len(collection.find({"meta.timestamp": {"$gte": since}})) == 2
+
+
+def test_filtered_export(cluster, tmp_path):
+    path = tmp_path / "part.locosnap"
+    export_snapshot(cluster, path, hosts=["node02"], guids=[8], compression="gzip")
+    snapshot = SnapshotDatabase(path)
+    assert snapshot.list_databases() == ["node02"]
+    assert snapshot["node02"].list_collections() == ["gpu-8"]
+
+
+def test_incremental_export(cluster, tmp_path, make_result):
+    full = tmp_path / "full.locosnap"
+    export_snapshot(cluster, full, compression="gzip")
+
+    collection = cluster["node01"]["gpu-7"]
+    doc = collection.get("2")
+    doc["health"] = {"Outlier": True}
+    collection.put("2", doc)
+    collection.delete_one({"meta.id": "3"})
+    collection.insert_one(make_result(1.0, 5))
+    # A whole GPU, and a whole host, removed since the base
+    for path in [
+        tmp_path / "cluster/node01/gpu-8",
+        tmp_path / "cluster/node02",
+    ]:
+        for file in sorted(path.rglob("*"), reverse=True):
+            file.unlink() if file.is_file() else file.rmdir()
+        path.rmdir()
+
+    incremental = tmp_path / "incremental.locosnap"
+    counts = export_snapshot(cluster, incremental, base=full, compression="gzip")
+    assert counts == {"written": 2, "deleted": 1 + 5 + 10}
+    snapshot = SnapshotDatabase(incremental)
+    assert snapshot.list_databases() == ["node01"]
+    assert snapshot["node01"].list_collections() == ["gpu-7"]
+    assert contents(snapshot) == contents(cluster)
+
+    restored = open_database(tmp_path / "restored.sqlite", "sqlite")
+    assert restore_snapshot(incremental, restored) == 5
+    assert contents(restored) == contents(cluster)
+    assert restored["node01"]["gpu-7"].get_state("degradation") == {"count": 5}
+    assert "meta.timestamp" in restored["node01"]["gpu-7"].list_indexes()
+
+
+def test_read_only(cluster, tmp_path):
+    status = cluster["node01"]["status"]
+    status.insert_one({"_timestamp": "2025-06-01 00:00:00", "state": "idle"})
+    status.insert_one({"_timestamp": "2025-06-02 00:00:00", "state": "busy"})
+    path = tmp_path / "full.locosnap"
+    export_snapshot(cluster, path, compression="gzip")
+    collection = SnapshotDatabase(path)["node01"]["gpu-7"]
+    for method, args in [
+        ("insert_one", ({},)),
+        ("put", ("1", {})),
+        ("set_state", ("key", {})),
+        ("update_state", ("key", dict)),
+        ("watch", ()),
+    ]:
+        with pytest.raises(PermissionError):
+            getattr(collection, method)(*args)
+    status = SnapshotDatabase(path)["node01"]["status"]
+    assert status.find_most_recent_matching({})["state"] == "busy"
+    assert [doc["state"] for doc in status.find_most_recent_matching_set()] == ["busy"]
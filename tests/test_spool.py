@@ -0,0 +1,82 @@
+import os
+import time
+
+import pytest
+
+from locodb.engines import open_database
+from locodb.ingest import ingest_records, ingest_spools, pending_spools
+from locodb.spool import Spool, read_spool
+
+
+def test_spool(tmp_path, make_result):
+    spool = Spool(tmp_path, "node01-1")
+    assert spool.insert_one("node01", "gpu-7", make_result())["run_id"]
+    # Only closed spools are picked up
+    assert list(tmp_path.glob("*.jsonl")) == []
+    spool.close()
+    spool.close()
+    records = read_spool(tmp_path / "node01-1.jsonl")
+    assert [(r["database"], r["collection"]) for r in records] == [("node01", "gpu-7")]
+    assert records[0]["document"]["meta"]["timestamp"] == "2025-06-01 00:00:00 UTC"
+
+
+def test_truncated_last_line(tmp_path, make_result):
+    with Spool(tmp_path, "node01-1") as spool:
+        for i in range(3):
+            spool.insert_one("node01", "gpu-7", make_result(1.0, i))
+    path = tmp_path / "node01-1.jsonl"
+    data = path.read_bytes()
+    path.write_bytes(data[: len(data) - 20])
+    assert len(read_spool(path)) == 2
+
+
+@pytest.mark.parametrize("engine", ["directory", "sqlite"])
+def test_ingest_once(tmp_path, engine, make_result):
+    client = open_database(tmp_path / "cluster", engine)
+    spool_dir = tmp_path / "spool"
+    with Spool(spool_dir, "node01-1") as spool:
+        for i in range(5):
+            spool.insert_one("node01", "gpu-7", make_result(1.0, i))
+    records = read_spool(spool_dir / "node01-1.jsonl")
+    assert ingest_spools(client, spool_dir, batch_size=2) == (5, 0)
+    assert list(spool_dir.iterdir()) == []
+    # Ingested again, e.g. after a crash before the spool was removed, and
+    # with a record repeated within the spool
+    assert ingest_records(client, records + records[:1], batch_size=2) == (0, 6)
+    assert len(client["node01"]["gpu-7"].find()) == 5
+
+
+def test_prepare(tmp_path, make_result):
+    client = open_database(tmp_path / "cluster")
+    prepared = []
+
+    def prepare(collection, docs):
+        prepared.append(len(docs))
+        for doc in docs:
+            doc["health"] = {"prepared": True}
+
+    records = [
+        {"database": "node01", "collection": "gpu-7", "document": make_result(1.0, i)}
+        for i in range(3)
+    ]
+    for i, record in enumerate(records):
+        record["document"]["meta"]["run_id"] = str(i)
+    ingest_records(client, records, prepare=prepare)
+    ingest_records(client, records, prepare=prepare)
+    assert prepared == [3]
+    docs = client["node01"]["gpu-7"].find()
+    assert all(doc["health"] == {"prepared": True} for doc in docs)
+
+
+def test_pending_spools(tmp_path):
+    for name in ["closed.jsonl", "open.jsonl.open", "stale.jsonl.open"]:
+        (tmp_path / name).write_text("")
+    (tmp_path / "claimed.jsonl.ingesting-host-1").write_text("")
+    old = time.time() - 7200
+    os.utime(tmp_path / "stale.jsonl.open", (old, old))
+    os.utime(tmp_path / "claimed.jsonl.ingesting-host-1", (old, old))
+    assert sorted(path.name for path in pending_spools(tmp_path, 3600)) == [
+        "claimed.jsonl.ingesting-host-1",
+        "closed.jsonl",
+        "stale.jsonl.open",
+    ]
@@ -0,0 +1,75 @@
+import pytest
+
+from locodb import sqlitedb, watch
+from locodb.engines import open_database
+from locodb.watch import ChangeStreamHistoryLost
+
+
+@pytest.fixture(params=["directory", "sqlite"])
+def client(request, tmp_path):
+    path = tmp_path / ("cluster.sqlite" if request.param == "sqlite" else "cluster")
+    return open_database(path, request.param)
+
+
+def drain(stream):
+    events = []
+    while (event := stream.try_next()) is not None:
+        events.append(event)
+    return events
+
+
+def test_events_and_resume(client):
+    collection = client["node01"]["gpu-1"]
+    collection.insert_one({"value": 0})
+    with client["node01"].watch() as stream:
+        collection.insert_one({"value": 1})
+        collection.put("2", {"value": 2})
+        collection.delete_one({"value": 0})
+        events = drain(stream)
+        token = stream.resume_token
+    assert [(e["operationType"], e["documentKey"]["_id"]) for e in events] == [
+        ("insert", "2"),
+        ("replace", "2"),
+        ("delete", "1"),
+    ]
+    assert events[1]["fullDocument"] == {"value": 2}
+    assert events[0]["ns"] == {"db": "node01", "coll": "gpu-1"}
+
+    collection.insert_one({"value": 3})
+    with collection.watch(resume_after=token) as stream:
+        events = drain(stream)
+    assert [e["documentKey"]["_id"] for e in events] == ["3"]
+
+
+def test_directory_log_compaction(tmp_path, monkeypatch):
+    monkeypatch.setattr(watch, "max_log_bytes", 1000)
+    collection = open_database(tmp_path / "cluster")["node01"]["gpu-1"]
+    stream = collection.watch()
+    old_token = stream.resume_token
+    for i in range(200):
+        collection.put(str(i), {"value": i})
+        # Positions of the changes kept do not move when the log is compacted
+        assert [e["documentKey"]["_id"] for e in drain(stream)] == [str(i)]
+    assert (tmp_path / "cluster/node01/gpu-1/_changes.jsonl").stat().st_size <= 1000
+
+    with pytest.raises(ChangeStreamHistoryLost):
+        drain(collection.watch(resume_after=old_token))
+    collection.put("200", {"value": 200})
+    with collection.watch(resume_after=stream.resume_token) as resumed:
+        assert [e["documentKey"]["_id"] for e in drain(resumed)] == ["200"]
+
+
+def test_sqlite_changes_trimmed(tmp_path, monkeypatch):
+    monkeypatch.setattr(sqlitedb, "max_changes", 10)
+    client = open_database(tmp_path / "cluster.sqlite", "sqlite")
+    collection = client["node01"]["gpu-1"]
+    stream = collection.watch()
+    old_token = stream.resume_token
+    collection.insert_many([{"value": i} for i in range(5)])
+    assert len(drain(stream)) == 5
+    collection.insert_many([{"value": i} for i in range(50)])
+    count = client.connection().execute("SELECT COUNT(*) FROM changes").fetchone()[0]
+    assert count == 10
+
+    with pytest.raises(ChangeStreamHistoryLost):
+        drain(collection.watch(resume_after=old_token))